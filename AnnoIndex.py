@@ -0,0 +1,406 @@
+import numpy as np
+from scipy import sparse
+
+#Number of set bits in every possible byte (fallback for older numpy)
+_BYTE_BITS = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+def popcount(bits):
+    """Count the set bits along the last axis of a uint64 array."""
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(bits).sum(axis=-1, dtype=np.int64)
+    bytesView = np.ascontiguousarray(bits).view(np.uint8)
+    return _BYTE_BITS[bytesView].sum(axis=-1, dtype=np.int64)
+
+def setBits(matrix, rows, ids):
+    """Set bit ids[i] in row rows[i] of a packed uint64 matrix."""
+    rows = np.asarray(rows, dtype=np.int64)
+    ids = np.asarray(ids, dtype=np.int64)
+    masks = np.left_shift(np.uint64(1), (ids & 63).astype(np.uint64))
+    np.bitwise_or.at(matrix, (rows, ids >> 6), masks)
+
+def unpackIds(bits):
+    """Return the positions of the set bits in a packed uint64 vector."""
+    #Most rows are sparse: unpack only the words that have a bit set
+    words = np.flatnonzero(bits)
+    flags = np.unpackbits(np.ascontiguousarray(bits[words], dtype="<u8").view(np.uint8), bitorder="little")
+    positions = np.flatnonzero(flags.view(bool))
+    return words[positions >> 6] * 64 + (positions & 63)
+
+
+class AnnoIndex:
+    """Integer-indexed bitset view of the annotations in an Ontology.
+
+    Genes and annotated terms get dense integer ids. Every term row holds a
+    packed bitset (one bit per gene) of its propagated annotations, both for
+    all evidence codes together and split by evidence code, so overlaps with
+    a query are computed with AND + popcount instead of set intersections.
+
+    The rows are filled from the direct annotations with one sparse product
+    per evidence code against the ancestor closure, so the propagated
+    annotations never exist as Python sets; see attach().
+    """
+
+    def __init__(self, ontology):
+        self.genes = list(ontology.genes.values())
+        self.geneIds = {g: i for i, g in enumerate(self.genes)}
+        allTerms = list(ontology.terms.values())
+        positions = {t: i for i, t in enumerate(allTerms)}
+        self.nWords = max(1, (len(self.genes) + 63) // 64)
+
+        #closure[i, j]: term j is term i or one of its ancestors
+        rows = []
+        cols = []
+        for i, term in enumerate(allTerms):
+            rows.append(i)
+            cols.append(i)
+            for ancestor in term.ancestors:
+                rows.append(i)
+                cols.append(positions[ancestor])
+        closure = sparse.csr_matrix((np.ones(len(rows), dtype=bool), (rows, cols)),
+                                    shape=(len(allTerms), len(allTerms)))
+        #Direct annotations per code as (term position, gene id) pairs
+        direct = {}
+        for i, term in enumerate(allTerms):
+            for code in term.direct:
+                if code not in direct:
+                    direct[code] = ([], [])
+                for gene in term.direct[code]:
+                    direct[code][0].append(i)
+                    direct[code][1].append(self.geneIds[gene])
+        #A term has annotations if it or any term below it has direct ones
+        hasDirect = np.zeros(len(allTerms), dtype=bool)
+        for termPos, ids in direct.values():
+            hasDirect[termPos] = True
+        annotated = (closure.T @ hasDirect) > 0
+
+        #Only annotated terms get a row, in the Ontology's term order
+        self.terms = [allTerms[i] for i in np.flatnonzero(annotated).tolist()]
+        self.termIds = {t: i for i, t in enumerate(self.terms)}
+        rowOf = np.cumsum(annotated) - 1
+        #Union over all evidence codes, one row per annotated term
+        self.bits = np.zeros((len(self.terms), self.nWords), dtype=np.uint64)
+        self.codeRows = {}  #Code --> term ids that have annotations with code
+        self.codeBits = {}  #Code --> packed rows aligned with codeRows[code]
+        for code in sorted(direct):
+            termPos, ids = direct[code]
+            found = sparse.csr_matrix((np.ones(len(ids), dtype=bool), (termPos, ids)),
+                                      shape=(len(allTerms), len(self.genes)))
+            #Propagate: a term gets the genes annotated to it or to any term below it
+            pairs = (closure.T @ found).tocoo()
+            termRows, local = np.unique(rowOf[pairs.row], return_inverse=True)
+            matrix = np.zeros((len(termRows), self.nWords), dtype=np.uint64)
+            setBits(matrix, local, pairs.col)
+            self.codeRows[code] = termRows
+            self.codeBits[code] = matrix
+            self.bits[termRows] |= matrix
+        self.sizes = popcount(self.bits)  #Number of genes annotated to each term row
+        self.codeSlots = self._codeSlots()
+        self.filteredSizes = {}  #Frozenset of codes --> term row sizes under that filter
+        self.geneCountsByCodes = {}  #Frozenset of codes (or None) --> terms per gene
+        self.attached = False  #Whether the terms read their annotations from this index
+
+    @classmethod
+    def fromArrays(cls, genes, terms, bits, sizes, codeRows, codeBits):
+        """Rebuild an index from saved arrays (see Snapshot.loadSnapshot)."""
+        index = cls.__new__(cls)
+        index.genes = genes
+        index.geneIds = {g: i for i, g in enumerate(genes)}
+        index.terms = terms
+        index.termIds = {t: i for i, t in enumerate(terms)}
+        index.nWords = bits.shape[1]
+        index.bits = bits
+        index.sizes = sizes
+        index.codeRows = codeRows
+        index.codeBits = codeBits
+        index.codeSlots = index._codeSlots()
+        index.filteredSizes = {}
+        index.geneCountsByCodes = {}
+        index.attached = False
+        return index
+
+    def _codeSlots(self):
+        #Code --> position of every term row in codeRows[code] (-1 where absent)
+        slots = {}
+        for code, rows in self.codeRows.items():
+            slots[code] = np.full(len(self.terms), -1, dtype=np.int32)
+            slots[code][rows] = np.arange(len(rows), dtype=np.int32)
+        return slots
+
+    def attach(self, ontology):
+        """Drop the propagated annotation sets of ontology's terms and genes.
+
+        Terms then answer allAnnos()/annos from their row of this index and
+        genes from the ancestors of their direct terms, so each propagated
+        annotation is held once, as a bit, instead of in two Python sets.
+        """
+        for term in ontology.terms.values():
+            term.annos = None
+            term.store = self
+        for gene in ontology.genes.values():
+            gene.annos = None
+        self.attached = True
+
+    def update(self, ontology, changes):
+        """Set and clear propagated annotation bits in place.
+
+        changes lists (gene, code, terms gained, terms lost) for the
+        propagated annotations of each changed (gene, code) pair. New genes
+        get the next gene ids (the rows are widened when they run out of
+        spare bits) and newly annotated terms get zeroed rows, inserted so
+        the rows stay in ontology's term order; rows of terms that lose
+        every gene are kept, empty. Returns the terms whose rows changed.
+        """
+        for gene, code, gained, lost in changes:
+            if gene not in self.geneIds:
+                self.geneIds[gene] = len(self.genes)
+                self.genes.append(gene)
+        if len(self.genes) > self.nWords * 64:
+            #Leave room for the next few updates' genes too
+            words = (len(self.genes) + 63) // 64
+            self._widen(words + max(1, words // 32))
+        elif not self.bits.flags.writeable:
+            #Arrays loaded from a snapshot are read-only memory maps: copy on first write
+            self.bits = np.array(self.bits)
+            self.codeBits = {code: np.array(bits) for code, bits in self.codeBits.items()}
+        newTerms = set([t for gene, code, gained, lost in changes for t in gained if t not in self.termIds])
+        if len(newTerms) > 0:
+            self._insertRows(ontology, newTerms)
+
+        #(row, gene id) pairs to set and to clear, per code
+        gains = {}
+        losses = {}
+        for gene, code, gained, lost in changes:
+            gid = self.geneIds[gene]
+            for pairs, terms in ((gains, gained), (losses, lost)):
+                if len(terms) > 0:
+                    if code not in pairs:
+                        pairs[code] = ([], [])
+                    pairs[code][0].extend([self.termIds[t] for t in terms])
+                    pairs[code][1].extend([gid] * len(terms))
+        for code in gains:
+            if code not in self.codeRows:
+                self.codeRows[code] = np.zeros(0, dtype=np.int64)
+                self.codeBits[code] = np.zeros((0, self.nWords), dtype=np.uint64)
+                self.codeSlots[code] = np.full(len(self.terms), -1, dtype=np.int32)
+            rows = np.unique(gains[code][0])
+            missing = rows[self.codeSlots[code][rows] < 0]
+            if len(missing) > 0:
+                self.codeSlots[code][missing] = np.arange(len(missing), dtype=np.int32) + len(self.codeRows[code])
+                self.codeRows[code] = np.concatenate([self.codeRows[code], missing])
+                self.codeBits[code] = np.concatenate([self.codeBits[code],
+                                                      np.zeros((len(missing), self.nWords), dtype=np.uint64)])
+            setBits(self.codeBits[code], self.codeSlots[code][gains[code][0]], gains[code][1])
+            setBits(self.bits, gains[code][0], gains[code][1])
+        for code in losses:
+            ids = np.asarray(losses[code][1], dtype=np.int64)
+            masks = ~np.left_shift(np.uint64(1), (ids & 63).astype(np.uint64))
+            np.bitwise_and.at(self.codeBits[code], (self.codeSlots[code][losses[code][0]], ids >> 6), masks)
+        touched = np.unique(np.concatenate([np.asarray(pairs[code][0], dtype=np.int64)
+                                            for pairs in (gains, losses) for code in pairs] + [np.zeros(0, dtype=np.int64)]))
+        if len(losses) > 0:
+            #A gene stays in the union row while any other code still has it there,
+            #so the words that lost a bit are ORed again from the code rows
+            rows = np.concatenate([np.asarray(losses[code][0], dtype=np.int64) for code in losses])
+            words = np.concatenate([np.asarray(losses[code][1], dtype=np.int64) >> 6 for code in losses])
+            cells = np.unique(rows * self.nWords + words)
+            rows, words = np.divmod(cells, self.nWords)
+            union = np.zeros(len(cells), dtype=np.uint64)
+            for code in self.codeRows:
+                slots = self.codeSlots[code][rows]
+                has = slots >= 0
+                union[has] |= self.codeBits[code][slots[has], words[has]]
+            self.bits[rows, words] = union
+        self.sizes[touched] = popcount(self.bits[touched])
+        self.filteredSizes = {}
+        self.geneCountsByCodes = {}
+        return [self.terms[row] for row in touched.tolist()]
+
+    def _widen(self, nWords):
+        #Copies of the packed rows with nWords words per row
+        pad = ((0, 0), (0, nWords - self.nWords))
+        self.bits = np.pad(self.bits, pad)
+        self.codeBits = {code: np.pad(bits, pad) for code, bits in self.codeBits.items()}
+        self.nWords = nWords
+
+    def _insertRows(self, ontology, terms):
+        #Zeroed rows for terms, at their place in ontology's term order
+        order = {t: i for i, t in enumerate(ontology.terms.values())}
+        terms = sorted(terms, key=order.get)
+        at = np.searchsorted(np.array([order[t] for t in self.terms], dtype=np.int64),
+                             np.array([order[t] for t in terms], dtype=np.int64))
+        #Old row i moves down by the number of rows inserted at or before it
+        moved = np.arange(len(self.terms)) + np.searchsorted(at, np.arange(len(self.terms)), side="right")
+        self.bits = np.insert(self.bits, at, 0, axis=0)
+        self.sizes = np.insert(self.sizes, at, 0)
+        for code in self.codeRows:
+            self.codeRows[code] = moved[self.codeRows[code]]
+            self.codeSlots[code] = np.insert(self.codeSlots[code], at, -1)
+        self.terms = sorted(self.terms + terms, key=order.get)
+        self.termIds = {t: i for i, t in enumerate(self.terms)}
+
+    def pack(self, genes):
+        """Pack an iterable of Genes into a query bitset."""
+        qBits = np.zeros(self.nWords, dtype=np.uint64)
+        ids = [self.geneIds[g] for g in genes if g in self.geneIds]
+        if len(ids) > 0:
+            setBits(qBits[np.newaxis, :], np.zeros(len(ids), dtype=np.int64), ids)
+        return qBits
+
+    def combine(self, codes, words=None):
+        """OR the per-code rows of codes together, optionally only some words."""
+        width = self.nWords if words is None else len(words)
+        bits = np.zeros((len(self.terms), width), dtype=np.uint64)
+        for code in codes:
+            if code in self.codeBits:
+                rows = self.codeBits[code] if words is None else self.codeBits[code][:, words]
+                bits[self.codeRows[code]] |= rows
+        return bits
+
+    def termSizes(self, codes=None):
+        """Term row sizes counting only annotations with codes (None for all)."""
+        if codes is None:
+            return self.sizes
+        if codes not in self.filteredSizes:
+            self.filteredSizes[codes] = popcount(self.combine(codes))
+        return self.filteredSizes[codes]
+
+    def overlapCounts(self, qBits, codes=None):
+        """Return the overlap size between the query and every term row."""
+        #Only the words holding query genes can contribute to an overlap
+        words = np.flatnonzero(qBits)
+        if len(words) == 0:
+            return np.zeros(len(self.terms), dtype=np.int64)
+        rows = self.bits[:, words] if codes is None else self.combine(codes, words)
+        return popcount(rows & qBits[words])
+
+    def rowGenes(self, row, qBits=None):
+        """Return the Genes in a term row, optionally restricted to a query."""
+        bits = self.bits[row]
+        if qBits is not None:
+            bits = bits & qBits
+        return [self.genes[i] for i in unpackIds(bits)]
+
+    def termBits(self, term, codes=None):
+        """Packed gene bits of one term under codes (None for all), or None if it has no annotations."""
+        row = self.termIds.get(term)
+        if row is None:
+            return None
+        if codes is None:
+            return self.bits[row]
+        bits = np.zeros(self.nWords, dtype=np.uint64)
+        for code in codes:
+            #term.totalCounts lists the codes the term has annotations with
+            if code in term.totalCounts:
+                bits |= self.codeBits[code][self.codeSlots[code][row]]
+        return bits
+
+    def termGenes(self, term, codes=None):
+        """Set of the Genes annotated to term (incl. propagated), optionally only with codes."""
+        bits = self.termBits(term, codes)
+        if bits is None:
+            return set()
+        return set([self.genes[i] for i in unpackIds(bits).tolist()])
+
+    def termAnnos(self, term):
+        """Code --> set of Genes annotated to term, as in OntoTerm.annos."""
+        result = {}
+        for code in self.codeRows:
+            genes = self.termGenes(term, (code,))
+            if len(genes) > 0:
+                result[code] = genes
+        return result
+
+    def termCodeCounts(self, terms, code):
+        """Term --> number of genes annotated to it with code (0 included), for some terms."""
+        terms = [t for t in terms if t in self.termIds]
+        counts = dict.fromkeys(terms, 0)
+        if code not in self.codeRows or len(terms) == 0:
+            return counts
+        slots = self.codeSlots[code][np.array([self.termIds[t] for t in terms], dtype=np.int64)]
+        has = np.flatnonzero(slots >= 0)
+        for i, n in zip(has.tolist(), popcount(self.codeBits[code][slots[has]]).tolist()):
+            counts[terms[i]] = n
+        return counts
+
+    def codeCounts(self):
+        """Term --> {code: number of genes} for every annotated term."""
+        counts = {term: {} for term in self.terms}
+        for code in self.codeRows:
+            for row, n in zip(self.codeRows[code].tolist(), popcount(self.codeBits[code]).tolist()):
+                if n > 0: #Rows emptied by update() keep their slot
+                    counts[self.terms[row]][code] = n
+        return counts
+
+    def overlapGenes(self, rows, qBits, codes=None):
+        """Return, for each term row, the list of query Genes annotated to it."""
+        words = np.flatnonzero(qBits)
+        result = [[] for _ in range(len(rows))]
+        if len(words) == 0 or len(rows) == 0:
+            return result
+        if codes is None:
+            sub = self.bits[np.asarray(rows)][:, words]
+        else:
+            sub = self.combine(codes, words)[np.asarray(rows)]
+        sub = sub & qBits[words]
+        flags = np.unpackbits(np.ascontiguousarray(sub, dtype="<u8").view(np.uint8), axis=1, bitorder="little")
+        hitRows, cols = np.nonzero(flags)
+        ids = words[cols >> 6] * 64 + (cols & 63)
+        for r, i in zip(hitRows.tolist(), ids.tolist()):
+            result[r].append(self.genes[i])
+        return result
+
+    def genesIn(self, bits):
+        """Return, for each row of a packed bitset matrix, the list of Genes set in it."""
+        result = [[] for _ in range(len(bits))]
+        words = np.flatnonzero(np.any(bits != 0, axis=0)) if len(bits) > 0 else []
+        if len(words) == 0:
+            return result
+        flags = np.unpackbits(np.ascontiguousarray(bits[:, words], dtype="<u8").view(np.uint8), axis=1, bitorder="little")
+        hitRows, cols = np.nonzero(flags)
+        ids = words[cols >> 6] * 64 + (cols & 63)
+        for r, i in zip(hitRows.tolist(), ids.tolist()):
+            result[r].append(self.genes[i])
+        return result
+
+    def _unpackRows(self, rows, codes=None, chunk=1024):
+        """Yield (row offset, 0/1 gene flags) for blocks of term rows."""
+        rows = np.asarray(rows, dtype=np.int64)
+        source = self.bits if codes is None else self.combine(codes)
+        for start in range(0, len(rows), chunk):
+            bits = source[rows[start:start + chunk]]
+            flags = np.unpackbits(np.ascontiguousarray(bits, dtype="<u8").view(np.uint8), axis=1, bitorder="little")
+            yield start, flags[:, :len(self.genes)]
+
+    def membership(self, rows, codes=None):
+        """Sparse genes x rows 0/1 matrix of the annotations of some term rows."""
+        rows = np.asarray(rows, dtype=np.int64)
+        source = self.bits if codes is None else self.combine(codes)
+        geneIds = []
+        cols = []
+        for start in range(0, len(rows), 1024):
+            bits = source[rows[start:start + 1024]]
+            #Rows are sparse: only unpack the words holding genes
+            blockRows, words = np.nonzero(bits)
+            values = np.ascontiguousarray(bits[blockRows, words], dtype="<u8").view(np.uint8).reshape(-1, 8)
+            flags = np.unpackbits(values, axis=1, bitorder="little")
+            hits, bitPos = np.nonzero(flags)
+            geneIds.append(words[hits] * 64 + bitPos)
+            cols.append(blockRows[hits] + start)
+        geneIds = np.concatenate(geneIds) if len(geneIds) > 0 else np.zeros(0, dtype=np.int64)
+        cols = np.concatenate(cols) if len(cols) > 0 else np.zeros(0, dtype=np.int64)
+        return sparse.csr_matrix((np.ones(len(geneIds), dtype=np.int32), (geneIds, cols)),
+                                 shape=(len(self.genes), len(rows)))
+
+    def geneCounts(self, codes=None):
+        """Number of (propagated) terms annotated to each gene, memoized per filter."""
+        if codes not in self.geneCountsByCodes:
+            counts = np.zeros(len(self.genes), dtype=np.int64)
+            for start, flags in self._unpackRows(np.arange(len(self.terms)), codes):
+                counts += flags.sum(axis=0, dtype=np.int64)
+            self.geneCountsByCodes[codes] = counts
+        return self.geneCountsByCodes[codes]
+
+    def termSize(self, term):
+        if term not in self.termIds:
+            return 0
+        return int(self.sizes[self.termIds[term]])
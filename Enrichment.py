@@ -1,16 +1,39 @@
+from Fragments import RawJSON, encodeValue
+
 class Enrichment:
-    def __init__(self, _term=None, _unadjPval=None, _pval=None, _genes=None):
+    def __init__(self, _term=None, _unadjPval=None, _pval=None, _genes=None, _nDirect=None, _nTotal=None,
+                 _statistic=None):
         self.term = _term  # The OntoTerm
         self.unadjPval = _unadjPval  # Unadjusted p-value
         self.pval = _pval  # Adjusted p-value (FDR)
         self.genes = _genes if _genes is not None else set()  # Overlapping genes
+        # Annotation counts under an evidence-code filter (None: the term's own counts)
+        self.nDirect = _nDirect
+        self.nTotal = _nTotal
+        self.statistic = _statistic  # Test statistic of ranked-list methods (None: not reported)
+        self.jsonFragment = None  # Encoded toJSON(), see toJSONFragment()
         
     def toJSON(self):
-        return {
+        result = {
             "term": self.term.toJSON(),
             "unadjusted_pvalue": self.unadjPval,
             "adjusted_pvalue": self.pval,
-            "direct_annotations": len(self.term.directAnnos()),
-            "total_annotations": len(self.term.allAnnos()),
+            "direct_annotations": self.nDirect if self.nDirect is not None else self.term.nDirect,
+            "total_annotations": self.nTotal if self.nTotal is not None else self.term.nTotal,
             "overlapping_genes": [g.toJSON() for g in self.genes]
         }
+        if self.statistic is not None:
+            result["statistic"] = self.statistic
+        return result
+
+    def toJSONFragment(self):
+        """toJSON() as encoded JSON text, spliced from the term and gene fragments."""
+        if self.jsonFragment is None:
+            self.jsonFragment = RawJSON('{"term": ' + self.term.fragment() +
+                ', "unadjusted_pvalue": ' + encodeValue(self.unadjPval) +
+                ', "adjusted_pvalue": ' + encodeValue(self.pval) +
+                ', "direct_annotations": ' + encodeValue(self.nDirect if self.nDirect is not None else self.term.nDirect) +
+                ', "total_annotations": ' + encodeValue(self.nTotal if self.nTotal is not None else self.term.nTotal) +
+                ', "overlapping_genes": [' + ", ".join([g.fragment() for g in self.genes]) + ']' +
+                (', "statistic": ' + encodeValue(self.statistic) if self.statistic is not None else '') + '}')
+        return self.jsonFragment
@@ -0,0 +1,38 @@
+"""GO evidence codes and named filters over them."""
+
+#Experimental evidence codes, including the high-throughput ones
+EXPERIMENTAL = frozenset(["EXP", "IDA", "IPI", "IMP", "IGI", "IEP",
+                          "HTP", "HDA", "HMP", "HGI", "HEP"])
+
+#Preset name --> (codes to keep or None for all, codes to drop)
+PRESETS = {
+    "experimental": (EXPERIMENTAL, frozenset()),
+    "no_iea": (None, frozenset(["IEA"])),
+}
+
+def selectCodes(knownCodes, include=None, exclude=None, preset=None):
+    """Return the evidence codes a filter keeps, or None when it keeps them all.
+
+    include and exclude are iterables of codes; preset names one of
+    PRESETS. They combine: a code is kept when the preset and include both
+    allow it and neither the preset nor exclude drops it. Raises ValueError
+    for an unknown preset.
+    """
+    if not preset and not include and not exclude:
+        return None
+    codes = set(knownCodes)
+    if preset:
+        if preset not in PRESETS:
+            raise ValueError("Unknown evidence preset " + str(preset) +
+                             " (expected one of " + ", ".join(sorted(PRESETS)) + ")")
+        keep, drop = PRESETS[preset]
+        if keep is not None:
+            codes.intersection_update(keep)
+        codes.difference_update(drop)
+    if include:
+        codes.intersection_update([c.upper() for c in include])
+    if exclude:
+        codes.difference_update([c.upper() for c in exclude])
+    if codes == set(knownCodes):
+        return None
+    return frozenset(codes)
@@ -0,0 +1,40 @@
+"""Pre-encoded JSON fragments and an encoder that splices them.
+
+Terms and genes encode their JSON once and keep the text (see
+OntoTerm.fragment and Gene.fragment); response builders wrap such text in
+RawJSON and encodeJSON copies it through instead of re-encoding it. The
+output is byte-for-byte what json.dumps (and CherryPy's json_out) would
+produce for the equivalent plain structure.
+"""
+import json
+
+class RawJSON(str):
+    """Text that is already valid JSON and is spliced in as-is by encodeJSON."""
+    __slots__ = ()
+
+_FLOAT_CONSTANTS = {"nan": "NaN", "inf": "Infinity", "-inf": "-Infinity"}
+
+def encodeValue(value):
+    """Encode a scalar the way json.dumps does, with fast paths for numbers."""
+    if isinstance(value, RawJSON):
+        return value
+    if isinstance(value, float):
+        text = float.__repr__(value)
+        return _FLOAT_CONSTANTS.get(text, text)
+    if isinstance(value, int) and not isinstance(value, bool):
+        return int.__repr__(value)
+    return json.dumps(value)
+
+def encodeJSON(obj):
+    """json.dumps(obj) for dicts and lists that may hold RawJSON fragments.
+
+    Dicts are walked; a list is spliced when its first item is RawJSON and
+    is otherwise handed to json.dumps whole, as is every other value.
+    """
+    if isinstance(obj, RawJSON):
+        return obj
+    if isinstance(obj, dict):
+        return "{" + ", ".join([json.dumps(k) + ": " + encodeJSON(v) for k, v in obj.items()]) + "}"
+    if isinstance(obj, list) and len(obj) > 0 and isinstance(obj[0], RawJSON):
+        return "[" + ", ".join([encodeJSON(v) for v in obj]) + "]"
+    return json.dumps(obj)
@@ -1,31 +1,182 @@
 import cherrypy as cp
-from Ontology import Ontology
+from cherrypy.lib import reprconf
+from OrganismRegistry import OrganismRegistry
 import cherrypy_cors
 import json
+import bisect
+import hashlib
+import itertools
+import time
 from collections import defaultdict
+from ResultCache import ResultCache
+from WorkerPool import WorkerPool, Saturated, DeadlineExceeded
+from Fragments import encodeJSON
+from Metrics import METRICS
+from Similarity import METHODS
+import Ranked
 
 cherrypy_cors.install()
 
 #Update the CherryPy configuration
 cp.config.update('server.conf')
 
+#Fields /term and /allTerms can return, in output order
+TERM_FIELDS = ["uid", "name", "defn", "namespace", "direct_annotations", "total_annotations", "evidence_codes", "all"]
+
+#Deepest /tm layout served
+MAX_TM_DEPTH = 20
+#Most permutations one /enrich request may ask for
+MAX_PERMUTATIONS = 100000
+#Request parameters passed through to the enrichment method
+METHOD_OPTIONS = ["permutations", "seed", "time_budget", "match_counts", "elim_cutoff"]
+#Most terms or genes one similarity matrix may cover
+MAX_SIMILARITY_ITEMS = 1000
+#Most terms one /lca or /subgraph request may name
+MAX_QUERY_TERMS = 1000
+#Most scored genes one /enrichRanked request may send
+MAX_RANKED_GENES = 100000
+#Namespace abbreviations accepted by /geneSimilarity
+NAMESPACES = {"BP": "biological_process", "MF": "molecular_function", "CC": "cellular_component"}
+
+def _record_request():
+    """Count the finished request and its latency by endpoint (unknown paths as "other")."""
+    request = cp.serving.request
+    endpoint = request.path_info if request.path_info in ENDPOINTS else "other"
+    METRICS.inc("go_requests_total", (("endpoint", endpoint), ("status", str(cp.serving.response.status).split()[0])))
+    METRICS.observe("go_request_seconds", time.time() - request.time, (("endpoint", endpoint),))
+
+cp.tools.go_metrics = cp.Tool('on_end_request', _record_request)
+
+class ServiceUnavailable(cp.HTTPError):
+    """503 with a Retry-After header (HTTPError drops one set on the response)."""
+
+    def __init__(self, retry_after, message):
+        super().__init__(503, message)
+        self.retry_after = retry_after
+
+    def set_response(self):
+        super().set_response()
+        cp.serving.response.headers['Retry-After'] = str(self.retry_after)
+
+METRICS.describe("go_rejected_total", "counter", "Requests refused with 503, by reason (saturated or deadline).")
+
 class GOServer(object):
+    _cp_config = {'tools.go_metrics.on': True}
 
-    def __init__(self):
+    def __init__(self, organisms=None):
         #Fields
-        self.go = Ontology("go.obo","gene_association.sgd")
+        if organisms is None:
+            organisms = reprconf.Parser().dict_from_file('server.conf').get('organisms')
+        if not organisms:
+            organisms = {"sgd": "gene_association.sgd"}
+        budget = cp.config.get('go.memory_budget_mb')
+        self.registry = OrganismRegistry(cp.config.get('go.obo_file', "go.obo"), organisms,
+                                         default=cp.config.get('go.default_org'),
+                                         memoryBudget=None if budget is None else budget * 2**20,
+                                         cacheDir=cp.config.get('go.cache_dir'))
+        #Full enrichment results by organism, data generation and resolved gene set
+        self.cache = ResultCache(cp.config.get('go.result_cache_size', 256),
+                                 cp.config.get('go.result_cache_ttl', 600))
+        self.registry.listeners.append(lambda name, go: self.cache.invalidate(name))
+        #Forked worker processes for /enrichBatch and the CPU-bound endpoints, with
+        #at most go.max_pending requests running or waiting for them
+        self.pool = WorkerPool(self, cp.config.get('go.workers'), cp.config.get('go.max_pending', 32))
+        self.deadline = cp.config.get('go.request_deadline', 60)
+        self.retry_after = cp.config.get('go.retry_after', 5)
+        cp.engine.subscribe('stop', self.pool.close)
+        METRICS.enabled = cp.config.get('go.metrics', True)
+        #Reload changed ontology/annotation files every go.reload_interval seconds
+        interval = cp.config.get('go.reload_interval')
+        if interval:
+            cp.process.plugins.Monitor(cp.engine, self._reload_changed, frequency=interval,
+                                       name='GOReload').subscribe()
 
     @cp.expose
+    @cp.tools.json_out()
     def index(self, org=''):
-        return "GO Server for organism " + org + " has " + str(len(self.go.roots)) + " roots with " + str(len(self.go.genes)) + " genes"
+        go = self._ontology(org)
+        msg = self.registry.status()
+        msg["result_cache"] = self.cache.stats()
+        if go is None:
+            msg["message"] = "Organism " + org + " not found"
+        else:
+            msg["message"] = ("GO Server for organism " + (org or self.registry.default) + " has " +
+                              str(len(go.roots)) + " roots with " + str(len(go.genes)) + " genes")
+        return msg
+
+    @cp.expose
+    @cp.tools.json_out()
+    def reload(self, force=0, token=''):
+        """Rebuild the resident organisms from changed files (all of them with force=1).
+
+        A POST starts the reload in the background and returns at once; the
+        current data keeps being served until each organism is swapped.
+        GET returns the reload status. If go.admin_token is set, it must be
+        given as token or in an X-Admin-Token header.
+        """
+        admin_token = cp.config.get('go.admin_token')
+        if admin_token and admin_token not in (token, cp.request.headers.get('X-Admin-Token')):
+            raise cp.HTTPError(403, "Invalid admin token")
+        started = False
+        if cp.request.method == "POST":
+            started = self.registry.reload(force=str(force).lower() in ('1', 'true'))
+        status = self.registry.status()
+        return {"started": started, "reloading": status["reloading"], "last_reload": status["last_reload"]}
+
+    @cp.expose
+    @cp.tools.json_out()
+    def updateAnnotations(self, org='', token=''):
+        """Apply a GAF diff in the POST body to org's loaded annotations.
+
+        The body holds "+" (add) and "-" (remove) GAF lines, e.g. the output
+        of `diff -u old.gaf new.gaf`. The update is applied in place and
+        cached results for the organism are dropped; it lasts until the
+        organism is next rebuilt from its GAF file. Needs go.admin_token as
+        /reload does.
+        """
+        admin_token = cp.config.get('go.admin_token')
+        if admin_token and admin_token not in (token, cp.request.headers.get('X-Admin-Token')):
+            raise cp.HTTPError(403, "Invalid admin token")
+        if cp.request.method != "POST":
+            return {"error": "updateAnnotations requires a POST with a GAF diff body"}
+        try:
+            lines = cp.request.body.read().decode('utf-8').splitlines(True)
+        except UnicodeDecodeError:
+            return {"error": "The GAF diff must be UTF-8 text"}
+        summary = self.registry.applyDiff(org, "<updateAnnotations>", lines)
+        if summary is None:
+            return {"error": "Organism " + org + " not found"}
+        return summary
+
+    @cp.expose
+    def metrics(self):
+        """Request, stage and data metrics in the Prometheus text format."""
+        cp.response.headers['Content-Type'] = 'text/plain; version=0.0.4; charset=utf-8'
+        cache = self.cache.stats()
+        status = self.registry.status()
+        gauges = [
+            ("go_result_cache_entries", "Enrichment results in the result cache.", [((), cache["entries"])]),
+            ("go_result_cache_hits", "Result cache hits since startup.", [((), cache["hits"])]),
+            ("go_result_cache_misses", "Result cache misses since startup.", [((), cache["misses"])]),
+            ("go_organism_resident", "1 if the organism's annotations are loaded.",
+             [((("org", o["name"]),), int(o["resident"])) for o in status["organisms"]]),
+            ("go_organism_load_seconds", "Seconds the organism's last load took.",
+             [((("org", o["name"]),), o["load_seconds"]) for o in status["organisms"] if o["load_seconds"] is not None]),
+            ("go_reloading", "1 while a reload is running.", [((), int(status["reloading"]))]),
+            ("go_pool_pending", "Requests running in or waiting for the worker pool.", [((), self.pool.pending)]),
+        ]
+        return METRICS.render(gauges).encode('utf-8')
 
     @cp.expose
     @cp.tools.json_out()
     def gene(self, org='', uid=''):
-        if(uid not in self.go.genes):
+        go = self._ontology(org)
+        if go is None:
+            return "Organism " + org + " not found"
+        if(uid not in go.genes):
             return "Gene " + uid + " not found"
         else:
-            g = self.go.genes[uid]
+            g = go.genes[uid]
             msg =  {}
             msg["uid"] = g.uid
             msg["symbol"] = g.symbol
@@ -35,53 +186,195 @@ class GOServer(object):
             return msg
 
     @cp.expose
-    @cp.tools.json_out()
-    def term(self, org='', uid=''):
+    def term(self, org='', uid='', evidence=None, include_codes=None, exclude_codes=None,
+             cursor=None, limit=None, fields=None, stream=None):
+        """One GO term and its annotated genes.
+
+        limit/cursor page through the "all" gene list (sorted by gene uid),
+        adding "next_cursor"; fields selects a subset of TERM_FIELDS;
+        stream=1 encodes the gene list one gene at a time.
+        """
+        cp.response.headers['Content-Type'] = 'application/json'
+        go = self._ontology(org)
+        if go is None:
+            return self._json("Organism " + org + " not found")
+        try:
+            codes = self._evidence_codes(go, evidence, include_codes, exclude_codes)
+            fields = self._parse_fields(fields, TERM_FIELDS)
+            limit = self._parse_limit(limit)
+        except ValueError as e:
+            return self._json(str(e))
         uid = uid.upper()
         if uid[0:3] != "GO:":
             uid = "GO:" + uid
 
-        if(uid not in self.go.terms):
-            return "Term " + uid + " not found"
-        else:
-            t = self.go.terms[uid]
-            msg = {}
+        t = go.getTerm(uid)
+        if t is None:
+            return self._json("Term " + uid + " not found")
+        msg = self._term_record(t, [f for f in fields if f != "all"], codes)
+        if "all" not in fields:
+            return self._json(msg)
+        genes = t.allAnnos(codes)
+        if limit is not None or cursor:
+            genes = sorted(genes, key=lambda g: g.uid)
+            start = bisect.bisect_right([g.uid for g in genes], cursor) if cursor else 0
+            page = genes[start:] if limit is None else genes[start:start + limit]
+            msg["next_cursor"] = page[-1].uid if len(page) > 0 and start + len(page) < len(genes) else None
+            genes = page
+        if self._streaming(stream):
+            head = json.dumps(msg)[:-1] + (", " if len(msg) > 0 else "") + '"all": ['
+            return self._stream_json(head, (g.toJSON() for g in genes), "]}")
+        msg["all"] = [g.toJSON() for g in genes]
+        return self._json(msg)
+
+    @cp.expose
+    def allTerms(self, org='', cursor=None, limit=None, fields=None, stream=None):
+        """Every annotated term, in uid order.
+
+        Without paging parameters the response is a JSON list. limit/cursor
+        return at most limit terms after the term uid cursor, as
+        {"terms": [...], "next_cursor": uid or null}. fields selects a subset
+        of TERM_FIELDS (default uid,name,defn,all). stream=1 streams a JSON
+        list instead, encoding one term at a time (cursor and limit still
+        apply), so memory use does not grow with the ontology.
+        """
+        cp.response.headers['Content-Type'] = 'application/json'
+        go = self._ontology(org)
+        if go is None:
+            return self._json("Organism " + org + " not found")
+        try:
+            fields = self._parse_fields(fields, ["uid", "name", "defn", "all"])
+            limit = self._parse_limit(limit)
+        except ValueError as e:
+            return self._json(str(e))
+        terms = go.annotatedTerms(cursor or None)
+        if limit is not None:
+            terms = itertools.islice(terms, limit)
+        if self._streaming(stream):
+            return self._stream_json("[", (self._term_record(t, fields) for t in terms), "]")
+        if limit is None and not cursor:
+            return self._json([self._term_record(t, fields) for t in terms])
+        page = list(terms)
+        last = go.annotatedUids[-1] if len(go.annotatedUids) > 0 else None
+        return self._json({"terms": [self._term_record(t, fields) for t in page],
+                           "next_cursor": page[-1].uid if len(page) > 0 and page[-1].uid != last else None})
+
+    def _term_record(self, t, fields, codes=None):
+        """The requested fields of a term, counted under an evidence filter if codes is given."""
+        msg = {}
+        if "uid" in fields:
             msg["uid"] = t.uid
+        if "name" in fields:
             msg["name"] = t.name
+        if "defn" in fields:
             msg["defn"] = t.defn
-            msg["all"] = [x.toJSON() for x in list(t.allAnnos())]
-            return msg
+        if "namespace" in fields:
+            msg["namespace"] = t.namespace
+        if "direct_annotations" in fields:
+            msg["direct_annotations"] = t.nDirect if codes is None else len(t.directAnnos(codes))
+        if "total_annotations" in fields:
+            msg["total_annotations"] = t.nTotal if codes is None else len(t.allAnnos(codes))
+        if "evidence_codes" in fields:
+            msg["evidence_codes"] = None if codes is None else sorted(codes)
+        if "all" in fields:
+            msg["all"] = [x.toJSON() for x in t.allAnnos(codes)]
+        return msg
 
-    @cp.expose
-    @cp.tools.json_out()
-    def allTerms(self, org=''):
-        terms = []
-        for termid in self.go.terms.keys():
-            t = self.go.terms[termid]
-            if len(t.allAnnos()) > 0:
-                term = {}
-                term["uid"] = t.uid
-                term["name"] = t.name
-                term["defn"] = t.defn
-                term["all"] = [x.toJSON() for x in list(t.allAnnos())]
-                terms.append(term)
-        return terms
+    def _parse_fields(self, fields, default):
+        """Requested term fields, in TERM_FIELDS order."""
+        if not fields:
+            return default
+        requested = self._parse_gene_list(fields)
+        unknown = [f for f in requested if f not in TERM_FIELDS]
+        if unknown:
+            raise ValueError("Unknown field(s) " + ", ".join(unknown) +
+                             " (expected any of " + ", ".join(TERM_FIELDS) + ")")
+        return [f for f in TERM_FIELDS if f in requested]
+
+    def _json(self, obj):
+        #Handlers that set their own Content-Type must return bytes
+        return json.dumps(obj).encode('utf-8')
+
+    def _parse_limit(self, limit):
+        if limit is None or limit == '':
+            return None
+        limit = int(limit)
+        if limit <= 0:
+            raise ValueError("limit must be a positive integer")
+        return limit
+
+    def _streaming(self, stream):
+        return str(stream).lower() in ("1", "true", "yes")
+
+    def _stream_json(self, head, items, tail, chunkSize=65536):
+        """Encode head, the comma-separated JSON items and tail as byte chunks.
+
+        Switches the response to chunked streaming, so items are encoded
+        while the response is written.
+        """
+        cp.response.stream = True
+        return self._json_chunks(head, items, tail, chunkSize)
+
+    def _json_chunks(self, head, items, tail, chunkSize):
+        chunk = [head]
+        size = len(head)
+        first = True
+        for item in items:
+            text = json.dumps(item) if first else ", " + json.dumps(item)
+            first = False
+            chunk.append(text)
+            size += len(text)
+            if size >= chunkSize:
+                yield "".join(chunk).encode('utf-8')
+                chunk = []
+                size = 0
+        chunk.append(tail)
+        yield "".join(chunk).encode('utf-8')
 
     @cp.expose
-    @cp.tools.json_out()
-    def tm(self, org='', uid=''):
+    def tm(self, org='', uid='', depth=6, format='nested', evidence=None, include_codes=None, exclude_codes=None):
+        """Treemap/sunburst data for the annotated terms below a term.
+
+        format "nested" gives {name, uid, size, kids}; "flat" gives parallel
+        ids/uids/labels/parents/values lists (Plotly treemap/sunburst input)
+        with one path-based id per path. depth is the number of levels below
+        uid. Encoded responses are cached per data generation.
+        """
+        cp.response.headers['Content-Type'] = 'application/json'
+        go = self._ontology(org)
+        if go is None:
+            return self._json("Organism " + org + " not found")
+        try:
+            codes = self._evidence_codes(go, evidence, include_codes, exclude_codes)
+            depth = int(depth)
+            if depth < 0 or depth > MAX_TM_DEPTH:
+                raise ValueError("depth must be between 0 and " + str(MAX_TM_DEPTH))
+            if format not in ("nested", "flat"):
+                raise ValueError("format must be nested or flat")
+        except ValueError as e:
+            return self._json(str(e))
         uid = uid.upper()
         if uid[0:3] != "GO:":
             uid = "GO:" + uid
 
-        if (uid not in self.go.terms):
-            return "Term " + uid + " not found"
-        else:
-            t = self.go.terms[uid]
-            msg = t.toTreeMapJSON()
-            return msg
+        t = go.getTerm(uid)
+        if t is None:
+            return self._json("Term " + uid + " not found")
+        key = (self.registry.name(org), go.generation, "tm", t.uid, depth, codes, format)
+        body = self.cache.get(key)
+        if body is None:
+            body = self._offload('_tm_body', org, t.uid, depth, codes, format)
+            self.cache.put(key, body)
+        return body
+
+    def _tm_body(self, org, uid, depth, codes, format):
+        """The encoded /tm response (runs in a worker)."""
+        go = self.registry.get(org)
+        treeMap = go.treeMap(codes)
+        t = go.terms[uid]
+        return self._json(treeMap.nested(t, depth) if format == "nested" else treeMap.flat(t, depth))
 
-    def _resolve_gene_names(self, query_list):
+    def _resolve_gene_names(self, go, query_list):
         """Resolve query strings to official gene symbols, handling aliases and duplicates.
         
         Returns:
@@ -98,56 +391,143 @@ class GOServer(object):
         
         resolved_genes = {}  # Maps query string to Gene object
         
-        # First pass: check for exact matches with official symbols
+        # Constant-time lookup per query in the Ontology's name index
         for query in query_list:
             query = str(query).strip()
-            if query in self.go.genes:
-                resolved_genes[query] = self.go.genes[query]
+            kind, matching_genes = go.resolveName(query)
+            if kind == "direct":
+                resolved_genes[query] = matching_genes[0]
                 resolution_results["direct_matches"].append(query)
+            elif len(matching_genes) == 1:
+                # Unique alias match
+                gene = matching_genes[0]
+                resolved_genes[query] = gene
+                resolution_results["alias_matches"].append({
+                    "query": query,
+                    "matched_to": gene.symbol
+                })
+            elif len(matching_genes) > 1:
+                # Ambiguous alias
+                resolution_results["ambiguous_queries"].append({
+                    "query": query,
+                    "possible_matches": [g.symbol for g in matching_genes]
+                })
             else:
-                # Build reverse alias lookup for unmatched queries
-                matching_genes = []
-                for gene in self.go.genes.values():
-                    if query in gene.aliases:
-                        matching_genes.append(gene)
-                
-                if len(matching_genes) == 1:
-                    # Unique alias match
-                    gene = matching_genes[0]
-                    resolved_genes[query] = gene
-                    resolution_results["alias_matches"].append({
-                        "query": query,
-                        "matched_to": gene.symbol
-                    })
-                elif len(matching_genes) > 1:
-                    # Ambiguous alias
-                    resolution_results["ambiguous_queries"].append({
-                        "query": query,
-                        "possible_matches": [g.symbol for g in matching_genes]
-                    })
-                else:
-                    # No matches found
-                    resolution_results["unmatched_queries"].append(query)
+                # No matches found
+                resolution_results["unmatched_queries"].append(query)
         
         return resolved_genes, resolution_results
 
-    def _process_enrichment(self, org, genes, threshold):
+    def _parse_gene_list(self, genes):
+        """Turn a comma-separated string or a list into a list of query strings."""
+        if isinstance(genes, str):
+            return [g.strip() for g in genes.split(',') if g.strip()]
+        return [str(g).strip() for g in genes if str(g).strip()]
+
+    def _evidence_codes(self, go, evidence=None, include_codes=None, exclude_codes=None):
+        """Evidence codes selected by the request's filter parameters (None for all).
+
+        include_codes/exclude_codes are comma-separated strings or lists;
+        evidence names a preset from Evidence.PRESETS.
+        """
+        include = self._parse_gene_list(include_codes) if include_codes else None
+        exclude = self._parse_gene_list(exclude_codes) if exclude_codes else None
+        return go.evidenceCodes(include, exclude, evidence)
+
+    def _method_settings(self, method, options, threshold):
+        """Validated settings of an enrichment method (raises ValueError).
+
+        options holds the request's method parameters; the settings are
+        part of the result cache key.
+        """
+        options = options or {}
+        if method == "hypergeometric" or method == "weight":
+            return {}
+        if method == "elim":
+            return {"cutoff": float(options.get('elim_cutoff', 0.01))}
+        if method == "permutation":
+            settings = {
+                "permutations": int(options.get('permutations', 10000)),
+                "seed": int(options.get('seed', 0)),
+                "time_budget": float(options.get('time_budget', cp.config.get('go.permutation_time_budget', 10))),
+                "match_counts": str(options.get('match_counts', False)).lower() in ("1", "true", "yes"),
+                "alpha": threshold, #Early stopping settles each term against the threshold
+            }
+            if settings["permutations"] < 1 or settings["permutations"] > MAX_PERMUTATIONS:
+                raise ValueError("permutations must be between 1 and " + str(MAX_PERMUTATIONS))
+            return settings
+        raise ValueError("Unknown method " + str(method) + " (expected hypergeometric, elim, weight or permutation)")
+
+    def _run_enrichment(self, go, genes, codes, method, settings):
+        """Score genes with method; returns (results, info about the run or None)."""
+        if method == "permutation":
+            return go.permutationEnrich(genes, codes, settings["permutations"], settings["seed"],
+                                        settings["time_budget"], settings["match_counts"], settings["alpha"],
+                                        mapper=lambda fn, tasks: self.pool.imapOrdered(fn, tasks, self._pool_key()))
+        if method == "elim" or method == "weight":
+            return go.topologyEnrich(genes, method, codes, **settings), None
+        return go.enrichByGeneNames(genes, codes), None
+
+    def _offload(self, fn, *args):
+        """Return self.fn(*args) computed in the worker pool.
+
+        Raises 503 with Retry-After when the admission queue is full or the
+        result is not ready within go.request_deadline seconds.
+        """
+        try:
+            return self.pool.call(fn, args, self._pool_key(), self.deadline)
+        except (Saturated, DeadlineExceeded) as e:
+            reason = "saturated" if isinstance(e, Saturated) else "deadline"
+            METRICS.inc("go_rejected_total", (("reason", reason),))
+            raise ServiceUnavailable(self.retry_after, "Server busy, try again later" if reason == "saturated"
+                                     else "Request deadline exceeded")
+
+    def _ontology(self, org):
+        """The Ontology for org, with its release in the X-GO-Release response header.
+
+        Handlers fetch it once and use that object throughout, so a reload
+        that swaps in new data never changes it in mid-request.
+        """
+        go = self.registry.get(org)
+        if go is not None:
+            cp.response.headers['X-GO-Release'] = go.release()
+        return go
+
+    def _reload_changed(self):
+        if self.registry.changed():
+            self.registry.reload()
+
+    def _pool_key(self):
+        #The worker pool is re-forked when this changes
+        return tuple(sorted((name, go.generation) for name, go in self.registry.loaded().items()))
+
+    def _process_enrichment(self, org, genes, threshold, evidence=None, include_codes=None, exclude_codes=None,
+                            method='hypergeometric', options=None):
         """Internal method to process enrichment analysis."""
         try:
             # Convert threshold to float
             threshold = float(threshold)
             
             # Ensure genes is a list
-            if isinstance(genes, str):
-                query_list = [g.strip() for g in genes.split(',') if g.strip()]
-            else:
-                query_list = [str(g).strip() for g in genes if str(g).strip()]
+            query_list = self._parse_gene_list(genes)
             
             if not query_list:
                 return {"error": "No valid gene queries provided"}
             
+            go = self.registry.get(org)
+            if go is None:
+                return {"error": "Organism " + org + " not found"}
+            
+            try:
+                codes = self._evidence_codes(go, evidence, include_codes, exclude_codes)
+                settings = self._method_settings(method, options, threshold)
+            except ValueError as e:
+                return {"error": str(e)}
+            
             # Resolve gene names
-            resolved_genes, resolution_results = self._resolve_gene_names(query_list)
+            with METRICS.stage("resolve"):
+                resolved_genes, resolution_results = self._resolve_gene_names(go, query_list)
+            METRICS.observe("go_query_genes", len(resolved_genes))
             
             if not resolved_genes:
                 return {
@@ -155,13 +535,23 @@ class GOServer(object):
                     "name_resolution": resolution_results
                 }
             
-            # Perform enrichment analysis with resolved genes
-            results = self.go.enrichByGeneNames(list(resolved_genes.values()))
+            # Perform enrichment analysis with resolved genes, unless the same
+            # gene set was scored against this data before; the threshold
+            # only filters the cached full result
+            key = (self.registry.name(org), go.generation, codes,
+                   tuple(sorted(set(g.symbol for g in resolved_genes.values()))),
+                   method, tuple(sorted(settings.items())))
+            cached = self.cache.get(key)
+            if cached is None:
+                cached = self._run_enrichment(go, list(resolved_genes.values()), codes, method, settings)
+                self.cache.put(key, cached)
+            results, info = cached
             
             # Filter by adjusted p-value threshold
-            filtered_results = [r.toJSON() for r in results if r.pval <= threshold]
+            # Pre-encoded JSON per result, spliced into the response by encodeJSON
+            filtered_results = [r.toJSONFragment() for r in results if r.pval <= threshold]
             
-            return {
+            response = {
                 "name_resolution": resolution_results,
                 "query_summary": {
                     "input_count": len(query_list),
@@ -170,45 +560,584 @@ class GOServer(object):
                                    len(resolution_results["unmatched_queries"])
                 },
                 "threshold": threshold,
-                "total_results": len(results),
-                "filtered_results": len(filtered_results),
-                "enriched_terms": filtered_results
+                "evidence_codes": None if codes is None else sorted(codes),
+                "method": method,
+                "release": go.releases
             }
+            if info is not None:
+                # Details of the run, e.g. permutations requested and run
+                response[method] = info
+            response["total_results"] = len(results)
+            response["filtered_results"] = len(filtered_results)
+            response["enriched_terms"] = filtered_results
+            return response
             
         except ValueError:
             return {"error": "Invalid threshold value. Must be a number between 0 and 1"}
         except Exception as e:
             return {"error": str(e)}
 
+    def _enrichment_etag(self, go, org, genes, threshold, *filters):
+        """Entity tag for an /enrich response: the query plus the data generation."""
+        if go is None:
+            return None
+        key = json.dumps([self.registry.name(org), go.generation,
+                          self._parse_gene_list(genes), str(threshold), filters])
+        return '"' + hashlib.sha1(key.encode('utf-8')).hexdigest() + '"'
+
+    @cp.expose
+    @cp.tools.json_out()
+    def resolve(self, org='', genes='', **kwargs):
+        """Resolve gene names/symbols/aliases without running enrichment.
+
+        Accepts the same GET parameter and POST body as /enrich, so large
+        lists can be checked before they are submitted.
+        """
+        if cp.request.method == "POST":
+            try:
+                data = json.loads(cp.request.body.read().decode('utf-8'))
+                genes = data.get('genes', [])
+            except json.JSONDecodeError:
+                return {"error": "Invalid JSON in request body"}
+            except Exception as e:
+                return {"error": f"Error processing POST request: {str(e)}"}
+
+        query_list = self._parse_gene_list(genes)
+        if not query_list:
+            return {"error": "No valid gene queries provided"}
+        go = self._ontology(org)
+        if go is None:
+            return {"error": "Organism " + org + " not found"}
+        resolved_genes, resolution_results = self._resolve_gene_names(go, query_list)
+        return {
+            "name_resolution": resolution_results,
+            "query_summary": {
+                "input_count": len(query_list),
+                "resolved_count": len(resolved_genes),
+                "excluded_count": len(resolution_results["ambiguous_queries"]) +
+                               len(resolution_results["unmatched_queries"])
+            }
+        }
+
+    @cp.expose
+    @cp.tools.json_out()
+    def termSimilarity(self, org='', terms='', method='resnik', **kwargs):
+        """Semantic similarity between GO terms (see Similarity).
+
+        terms is a comma-separated list of term ids, or a POST body
+        {"terms": [...], "method": "lin"}; method is resnik, lin or jc.
+        Returns each term's information content and the pairwise matrix,
+        plus "similarity" when exactly two terms are given.
+        """
+        if cp.request.method == "POST":
+            try:
+                data = json.loads(cp.request.body.read().decode('utf-8'))
+                terms = data.get('terms', [])
+                method = data.get('method', method)
+            except json.JSONDecodeError:
+                return {"error": "Invalid JSON in request body"}
+            except Exception as e:
+                return {"error": f"Error processing POST request: {str(e)}"}
+        go = self._ontology(org)
+        if go is None:
+            return {"error": "Organism " + org + " not found"}
+        uids = self._parse_gene_list(terms)
+        if method not in METHODS:
+            return {"error": "method must be one of " + ", ".join(METHODS)}
+        if not uids or len(uids) > MAX_SIMILARITY_ITEMS:
+            return {"error": "Between 1 and " + str(MAX_SIMILARITY_ITEMS) + " terms are required"}
+        try:
+            found = self._lookup_terms(go, uids)
+        except ValueError as e:
+            return {"error": str(e)}
+        return self._offload('_term_similarity', org, [t.uid for t in found], method)
+
+    def _term_similarity(self, org, uids, method):
+        """The /termSimilarity response for validated term uids (runs in a worker)."""
+        go = self.registry.get(org)
+        found = [go.terms[uid] for uid in uids]
+        similarity = go.similarity()
+        with METRICS.stage("similarity"):
+            matrix = self._matrix(similarity.termMatrix(found, method))
+        msg = {"method": method,
+               "terms": uids,
+               "information_content": [similarity.termIC(t) for t in found],
+               "matrix": matrix}
+        if len(found) == 2:
+            msg["similarity"] = matrix[0][1]
+        return msg
+
+    @cp.expose
+    @cp.tools.json_out()
+    def geneSimilarity(self, org='', genes='', method='resnik', namespace='biological_process',
+                       evidence=None, include_codes=None, exclude_codes=None, **kwargs):
+        """Best-match-average semantic similarity between genes (see Similarity).
+
+        genes are names/symbols/aliases as for /enrich, comma-separated or
+        in a POST body {"genes": [...], ...} that may also carry method,
+        namespace and the evidence filters. Genes are compared by their
+        direct annotations in namespace (biological_process, or BP/MF/CC).
+        Returns the pairwise matrix, null where a gene has no annotations
+        in the namespace, plus "similarity" when exactly two genes resolve.
+        """
+        if cp.request.method == "POST":
+            try:
+                data = json.loads(cp.request.body.read().decode('utf-8'))
+                genes = data.get('genes', [])
+                method = data.get('method', method)
+                namespace = data.get('namespace', namespace)
+                evidence = data.get('evidence')
+                include_codes = data.get('include_codes')
+                exclude_codes = data.get('exclude_codes')
+            except json.JSONDecodeError:
+                return {"error": "Invalid JSON in request body"}
+            except Exception as e:
+                return {"error": f"Error processing POST request: {str(e)}"}
+        go = self._ontology(org)
+        if go is None:
+            return {"error": "Organism " + org + " not found"}
+        namespace = NAMESPACES.get(str(namespace).upper(), namespace)
+        if namespace not in go.popSizes:
+            return {"error": "Unknown namespace " + str(namespace)}
+        if method not in METHODS:
+            return {"error": "method must be one of " + ", ".join(METHODS)}
+        try:
+            codes = self._evidence_codes(go, evidence, include_codes, exclude_codes)
+        except ValueError as e:
+            return {"error": str(e)}
+        query_list = self._parse_gene_list(genes)
+        if not query_list or len(query_list) > MAX_SIMILARITY_ITEMS:
+            return {"error": "Between 1 and " + str(MAX_SIMILARITY_ITEMS) + " genes are required"}
+        with METRICS.stage("resolve"):
+            resolved_genes, resolution_results = self._resolve_gene_names(go, query_list)
+        symbols = list(dict.fromkeys([g.symbol for g in resolved_genes.values()]))
+        msg = {"name_resolution": resolution_results}
+        msg.update(self._offload('_gene_similarity', org, symbols, method, namespace, codes))
+        return msg
+
+    def _gene_similarity(self, org, symbols, method, namespace, codes):
+        """The /geneSimilarity matrix for resolved gene symbols (runs in a worker)."""
+        go = self.registry.get(org)
+        found = [go.genes[symbol] for symbol in symbols]
+        similarity = go.similarity()
+        with METRICS.stage("similarity"):
+            matrix = self._matrix(similarity.geneMatrix(found, namespace, method, codes))
+        msg = {"method": method,
+               "namespace": namespace,
+               "evidence_codes": None if codes is None else sorted(codes),
+               "genes": symbols,
+               "annotated_terms": [len(similarity.geneTerms(g, namespace, codes)) for g in found],
+               "matrix": matrix}
+        if len(found) == 2:
+            msg["similarity"] = matrix[0][1]
+        return msg
+
+    def _matrix(self, matrix):
+        # Nested lists for JSON, with null for undefined (NaN) entries
+        return [[None if v != v else v for v in row] for row in matrix.tolist()]
+
+    def _lookup_terms(self, go, uids):
+        """Terms for uids (GO: prefix optional); ValueError names the first unknown one."""
+        found = []
+        for uid in uids:
+            uid = uid.upper() if uid.upper()[0:3] == "GO:" else "GO:" + uid
+            t = go.getTerm(uid)
+            if t is None:
+                raise ValueError("Term " + uid + " not found")
+            found.append(t)
+        return found
+
+    def _parse_depth(self, depth):
+        if depth is None or depth == '':
+            return None
+        depth = int(depth)
+        if depth < 0:
+            raise ValueError("depth must be a non-negative integer")
+        return depth
+
+    def _term_brief(self, t, distance=None):
+        msg = {"uid": t.uid, "name": t.name, "namespace": t.namespace}
+        if distance is not None:
+            msg["distance"] = distance
+        return msg
+
+    @cp.expose
+    @cp.tools.json_out()
+    def ancestors(self, org='', term='', depth=None):
+        """Ancestors of a term over is_a, part_of and regulates edges, nearest first (see Reachability).
+
+        depth keeps those at most depth edges above the term; "distance" is
+        the length of the shortest path to each.
+        """
+        return self._reachable(org, term, depth, "ancestors")
+
+    @cp.expose
+    @cp.tools.json_out()
+    def descendants(self, org='', term='', depth=None):
+        """Descendants of a term, nearest first, down to depth edges (see /ancestors)."""
+        return self._reachable(org, term, depth, "descendants")
+
+    def _reachable(self, org, term, depth, direction):
+        go = self._ontology(org)
+        if go is None:
+            return {"error": "Organism " + org + " not found"}
+        try:
+            depth = self._parse_depth(depth)
+            t = self._lookup_terms(go, [term])[0]
+        except ValueError as e:
+            return {"error": str(e)}
+        reachability = go.reachability()
+        related = reachability.ancestors(t, depth) if direction == "ancestors" else reachability.descendants(t, depth)
+        return {"term": t.uid, "depth": depth, direction: [self._term_brief(r, d) for r, d in related]}
+
     @cp.expose
     @cp.tools.json_out()
-    def enrich(self, org='', genes='', threshold=0.05, **kwargs):
+    def isAncestor(self, org='', ancestor='', term=''):
+        """Whether ancestor lies above term, with the shortest path length between them."""
+        go = self._ontology(org)
+        if go is None:
+            return {"error": "Organism " + org + " not found"}
+        try:
+            a, t = self._lookup_terms(go, [ancestor, term])
+        except ValueError as e:
+            return {"error": str(e)}
+        reachability = go.reachability()
+        return {"ancestor": a.uid, "term": t.uid, "is_ancestor": reachability.isAncestor(a, t),
+                "distance": reachability.distance(a, t)}
+
+    def _query_terms(self, go, terms):
+        """The terms named by a comma-separated string, a list or a POST body {"terms": [...]}."""
+        if cp.request.method == "POST":
+            try:
+                terms = json.loads(cp.request.body.read().decode('utf-8')).get('terms', [])
+            except (json.JSONDecodeError, AttributeError):
+                raise ValueError("Invalid JSON in request body")
+        uids = self._parse_gene_list(terms)
+        if not uids or len(uids) > MAX_QUERY_TERMS:
+            raise ValueError("Between 1 and " + str(MAX_QUERY_TERMS) + " terms are required")
+        return self._lookup_terms(go, uids)
+
+    @cp.expose
+    @cp.tools.json_out()
+    def lca(self, org='', terms=''):
+        """Lowest common ancestors of terms (comma-separated, or POST {"terms": [...]}).
+
+        A term counts as its own ancestor, so the answer for a term and one
+        of its ancestors is that ancestor; terms of different namespaces
+        have none.
+        """
+        go = self._ontology(org)
+        if go is None:
+            return {"error": "Organism " + org + " not found"}
+        try:
+            found = self._query_terms(go, terms)
+        except ValueError as e:
+            return {"error": str(e)}
+        lowest = go.reachability().lowestCommonAncestors(found)
+        return {"terms": [t.uid for t in found], "lowest_common_ancestors": [self._term_brief(t) for t in lowest]}
+
+    @cp.expose
+    @cp.tools.json_out()
+    def subgraph(self, org='', terms=''):
+        """Minimal induced subgraph connecting terms (comma-separated, or POST {"terms": [...]}).
+
+        nodes are the terms on the upward paths from the query terms to
+        their lowest common ancestors (to the roots if they have none);
+        edges are the typed is_a/part_of/regulates edges between nodes, as
+        {"child", "relation", "parent"}.
+        """
+        go = self._ontology(org)
+        if go is None:
+            return {"error": "Organism " + org + " not found"}
+        try:
+            found = self._query_terms(go, terms)
+        except ValueError as e:
+            return {"error": str(e)}
+        nodes, edges, lowest = go.reachability().subgraph(found)
+        return {"terms": [t.uid for t in found],
+                "lowest_common_ancestors": [t.uid for t in lowest],
+                "nodes": [self._term_brief(t) for t in nodes],
+                "edges": [{"child": c.uid, "relation": r, "parent": p.uid} for c, r, p in edges]}
+
+    @cp.expose
+    def enrich(self, org='', genes='', threshold=0.05, evidence=None, include_codes=None, exclude_codes=None,
+               method='hypergeometric', **kwargs):
         """Perform enrichment analysis on a list of genes.
         Handles both GET and POST requests.
         
         For GET requests:
             genes: Comma-separated list of gene names/symbols/aliases
             threshold: P-value threshold for filtering results (default 0.05)
+            evidence: Evidence preset, "experimental" or "no_iea" (optional)
+            include_codes / exclude_codes: Comma-separated evidence codes (optional)
+            method: "hypergeometric" (default), "elim", "weight" or "permutation"
+            timing: 1 to add the seconds spent in each stage as "timing" (optional)
+            elim_cutoff: Significance at which elim removes a term's genes from its ancestors (default 0.01)
+            permutations, seed, time_budget, match_counts: Permutation settings (optional)
             
         For POST requests:
             Accepts JSON body with format:
             {
                 "genes": ["gene1", "gene2", ...],  # List of gene names/symbols/aliases
-                "threshold": 0.05
+                "threshold": 0.05,
+                "evidence": "no_iea",              # Optional, as for GET
+                "include_codes": ["IDA", "IMP"],   # Optional
+                "exclude_codes": ["IEA"],          # Optional
+                "method": "permutation",           # Optional, with its settings as for GET
+                "permutations": 10000
             }
         """
+        cp.response.headers['Content-Type'] = 'application/json'
         # Check if this is a POST request with JSON data
         if cp.request.method == "POST":
             try:
                 data = json.loads(cp.request.body.read().decode('utf-8'))
                 genes = data.get('genes', [])
                 threshold = data.get('threshold', 0.05)
+                evidence = data.get('evidence')
+                include_codes = data.get('include_codes')
+                exclude_codes = data.get('exclude_codes')
+                method = data.get('method', 'hypergeometric')
+                kwargs = data
             except json.JSONDecodeError:
-                return {"error": "Invalid JSON in request body"}
+                return self._json({"error": "Invalid JSON in request body"})
             except Exception as e:
-                return {"error": f"Error processing POST request: {str(e)}"}
+                return self._json({"error": f"Error processing POST request: {str(e)}"})
+        
+        # Let clients revalidate a response they already have
+        options = {k: kwargs[k] for k in METHOD_OPTIONS if k in kwargs}
+        go = self._ontology(org)
+        etag = self._enrichment_etag(go, org, genes, threshold, evidence, include_codes, exclude_codes, method, options)
+        if etag is not None:
+            cp.response.headers['ETag'] = etag
+            matches = [t.strip() for t in cp.request.headers.get('If-None-Match', '').split(',')]
+            if etag in matches or '*' in matches:
+                raise cp.HTTPRedirect([], 304)
         
-        return self._process_enrichment(org, genes, threshold)
+        # Encoded responses are cached by entity tag, except those with timings
+        timing = str(kwargs.get('timing', '')).lower() in ('1', 'true')
+        key = (self.registry.name(org), "enrich", etag)
+        body = self.cache.get(key) if etag is not None and not timing else None
+        if body is None:
+            body = self._offload('_enrichment_body', org, genes, threshold, evidence, include_codes,
+                                 exclude_codes, method, options, timing)
+            if etag is not None and not timing:
+                self.cache.put(key, body)
+        return body
+
+    def _enrichment_body(self, org, genes, threshold, evidence, include_codes, exclude_codes, method, options,
+                         timing=False):
+        """The encoded /enrich response (runs in a worker)."""
+        with METRICS.timing() as stages:
+            result = self._process_enrichment(org, genes, threshold, evidence, include_codes, exclude_codes,
+                                              method, options)
+            with METRICS.stage("serialize"):
+                body = encodeJSON(result).encode('utf-8')
+        if timing:
+            # Seconds per stage of this request, appended as the last field
+            body = body[:-1] + b', "timing": ' + json.dumps(stages).encode('utf-8') + b'}'
+        return body
+
+    def _enrichment_record(self, name, org, genes, threshold, evidence, include_codes, exclude_codes,
+                           method='hypergeometric', options=None):
+        """One /enrichBatch output line: the /enrich response for one named list."""
+        record = {"name": name}
+        record.update(self._process_enrichment(org, genes, threshold, evidence, include_codes, exclude_codes,
+                                               method, options))
+        return encodeJSON(record) + "\n"
+
+    @cp.expose
+    def enrichBatch(self, org='', **kwargs):
+        """Run enrichment for many named gene lists in the worker processes.
+
+        Accepts a POST with a JSON body:
+            {
+                "lists": {"cluster1": ["gene1", ...], "cluster2": [...]},
+                "threshold": 0.05,                 # Optional, applies to every list
+                "evidence": "no_iea",              # Optional filters, as for /enrich
+                "include_codes": [...],
+                "exclude_codes": [...],
+                "method": "permutation"            # Optional, with its settings, as for /enrich
+            }
+        Streams one JSON line per list as soon as it is scored (not in input
+        order); each is {"name": ...} plus the fields of an /enrich response.
+        """
+        cp.response.headers['Content-Type'] = 'application/x-ndjson'
+        if cp.request.method != "POST":
+            return self._json({"error": "enrichBatch requires a POST with a JSON body"}) + b"\n"
+        try:
+            data = json.loads(cp.request.body.read().decode('utf-8'))
+            lists = data['lists']
+            if not isinstance(lists, dict):
+                raise ValueError("lists must map names to gene lists")
+        except json.JSONDecodeError:
+            return self._json({"error": "Invalid JSON in request body"}) + b"\n"
+        except Exception as e:
+            return self._json({"error": f"Error processing POST request: {str(e)}"}) + b"\n"
+
+        # Load the organism here first so the workers are forked with it
+        if self._ontology(org) is None:
+            return self._json({"error": "Organism " + org + " not found"}) + b"\n"
+        key = self._pool_key()
+        options = {k: data[k] for k in METHOD_OPTIONS if k in data}
+        tasks = [(name, org, genes, data.get('threshold', 0.05), data.get('evidence'),
+                  data.get('include_codes'), data.get('exclude_codes'),
+                  data.get('method', 'hypergeometric'), options) for name, genes in lists.items()]
+
+        def records():
+            for line in self.pool.imap('_enrichment_record', tasks, key):
+                yield line.encode('utf-8')
+        return records()
+    enrichBatch._cp_config = {
+        'response.stream': True,
+        'tools.response_headers.headers': [
+            ('Content-Type', 'application/x-ndjson'),
+            ('Access-Control-Allow-Origin', '*'),
+        ],
+    }
+
+    @cp.expose
+    def enrichRanked(self, org='', genes='', threshold=0.05, method='mann_whitney', direction='both',
+                     min_size=1, max_size=None, evidence=None, include_codes=None, exclude_codes=None, **kwargs):
+        """Threshold-free enrichment of a scored gene list (see Ranked).
+
+        For GET requests, genes is a comma-separated list of name:score
+        pairs ("RAD51:2.3,CDC28:-0.4"); the other parameters are:
+            threshold: Adjusted p-value threshold for the output (default 0.05)
+            method: "mann_whitney" (default) or "ks"
+            direction: "up", "down" or "both" (default)
+            min_size / max_size: Scored genes a term needs to be tested (default 1 / no limit)
+            evidence / include_codes / exclude_codes: Evidence filters, as for /enrich
+            timing: 1 to add the seconds spent in each stage as "timing" (optional)
+
+        POST requests send the same parameters in a JSON body, with genes
+        either {"gene1": score, ...} or [["gene1", score], ...]. Results have
+        the shape of /enrich results plus each term's "statistic"; their
+        overlapping genes are the term's scored genes, highest score first.
+        """
+        cp.response.headers['Content-Type'] = 'application/json'
+        if cp.request.method == "POST":
+            try:
+                data = json.loads(cp.request.body.read().decode('utf-8'))
+                genes = data.get('genes', [])
+                threshold = data.get('threshold', 0.05)
+                method = data.get('method', 'mann_whitney')
+                direction = data.get('direction', 'both')
+                min_size = data.get('min_size', 1)
+                max_size = data.get('max_size')
+                evidence = data.get('evidence')
+                include_codes = data.get('include_codes')
+                exclude_codes = data.get('exclude_codes')
+                kwargs = data
+            except json.JSONDecodeError:
+                return self._json({"error": "Invalid JSON in request body"})
+            except Exception as e:
+                return self._json({"error": f"Error processing POST request: {str(e)}"})
+        try:
+            scored = self._parse_scores(genes)
+            threshold = float(threshold)
+            min_size = int(min_size)
+            max_size = None if max_size in (None, '') else int(max_size)
+        except (TypeError, ValueError) as e:
+            return self._json({"error": str(e)})
+        if not scored or len(scored) > MAX_RANKED_GENES:
+            return self._json({"error": "Between 1 and " + str(MAX_RANKED_GENES) + " scored genes are required"})
+        if method not in Ranked.METHODS:
+            return self._json({"error": "method must be one of " + ", ".join(Ranked.METHODS)})
+        if direction not in Ranked.DIRECTIONS:
+            return self._json({"error": "direction must be one of " + ", ".join(Ranked.DIRECTIONS)})
+        if self._ontology(org) is None:
+            return self._json({"error": "Organism " + org + " not found"})
+        timing = str(kwargs.get('timing', '')).lower() in ('1', 'true')
+        return self._offload('_ranked_body', org, scored, threshold, method, direction, min_size, max_size,
+                             evidence, include_codes, exclude_codes, timing)
+
+    def _parse_scores(self, genes):
+        """[(query, score)] from a name:score string, a {name: score} dict or [name, score] pairs (raises ValueError)."""
+        if isinstance(genes, str):
+            pairs = [g.rsplit(':', 1) for g in genes.split(',') if g.strip()]
+        elif isinstance(genes, dict):
+            pairs = list(genes.items())
+        else:
+            pairs = list(genes)
+        scored = []
+        for pair in pairs:
+            if isinstance(pair, str) or len(pair) != 2:
+                raise ValueError("Each gene needs a score, as name:score or [name, score]")
+            query, score = str(pair[0]).strip(), float(pair[1])
+            if score != score or score in (float('inf'), float('-inf')):
+                raise ValueError("Score of " + query + " is not a finite number")
+            if query:
+                scored.append((query, score))
+        return scored
+
+    def _ranked_body(self, org, scored, threshold, method, direction, min_size, max_size, evidence,
+                     include_codes, exclude_codes, timing=False):
+        """The encoded /enrichRanked response (runs in a worker)."""
+        with METRICS.timing() as stages:
+            result = self._process_ranked(org, scored, threshold, method, direction, min_size, max_size,
+                                          evidence, include_codes, exclude_codes)
+            with METRICS.stage("serialize"):
+                body = encodeJSON(result).encode('utf-8')
+        if timing:
+            body = body[:-1] + b', "timing": ' + json.dumps(stages).encode('utf-8') + b'}'
+        return body
+
+    def _process_ranked(self, org, scored, threshold, method, direction, min_size, max_size, evidence,
+                        include_codes, exclude_codes):
+        go = self.registry.get(org)
+        if go is None:
+            return {"error": "Organism " + org + " not found"}
+        try:
+            codes = self._evidence_codes(go, evidence, include_codes, exclude_codes)
+        except ValueError as e:
+            return {"error": str(e)}
+        with METRICS.stage("resolve"):
+            resolved_genes, resolution_results = self._resolve_gene_names(go, [q for q, s in scored])
+        # The first score given for a gene wins; later queries naming it are reported
+        scores = {}
+        duplicates = []
+        for query, score in scored:
+            gene = resolved_genes.get(query)
+            if gene is None:
+                continue
+            if gene in scores:
+                duplicates.append(query)
+            else:
+                scores[gene] = score
+        METRICS.observe("go_query_genes", len(scores))
+        if not scores:
+            return {"error": "No valid genes found after name resolution",
+                    "name_resolution": resolution_results}
+
+        key = (self.registry.name(org), go.generation, codes, "ranked", method, direction, min_size, max_size,
+               tuple(sorted((g.symbol, s) for g, s in scores.items())))
+        results = self.cache.get(key)
+        if results is None:
+            results = go.rankedEnrich(scores, codes, method, direction, min_size, max_size)
+            self.cache.put(key, results)
+        filtered_results = [r.toJSONFragment() for r in results if r.pval <= threshold]
+        return {
+            "name_resolution": resolution_results,
+            "query_summary": {
+                "input_count": len(scored),
+                "resolved_count": len(scores),
+                "duplicate_queries": duplicates,
+                "excluded_count": len(resolution_results["ambiguous_queries"]) +
+                               len(resolution_results["unmatched_queries"])
+            },
+            "threshold": threshold,
+            "evidence_codes": None if codes is None else sorted(codes),
+            "method": method,
+            "direction": direction,
+            "release": go.releases,
+            "total_results": len(results),
+            "filtered_results": len(filtered_results),
+            "enriched_terms": filtered_results
+        }
+
+#Paths counted by name in go_requests_total
+ENDPOINTS = set(["/"] + ["/" + name for name, fn in vars(GOServer).items() if getattr(fn, 'exposed', False)])
 
 if __name__ == '__main__':
     print("Running main")
@@ -218,6 +1147,7 @@ if __name__ == '__main__':
     config = {
         '/': {
             'cors.expose.on': True,
+            'cors.expose.expose_headers': ['X-GO-Release', 'ETag'],
             'tools.response_headers.on': True,
             'tools.response_headers.headers': [
                 ('Content-Type', 'application/json'),
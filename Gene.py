@@ -1,20 +1,46 @@
-from OntoTerm import OntoTerm
+from OntoTerm import OntoTerm, EMPTY
+from Fragments import RawJSON
 import json
 
 class Gene:
-    def __init__(self, _uid=None, _symb=None, _name=None, _alias=set()):
+    # No per-instance __dict__: organisms have tens of thousands of genes
+    __slots__ = ("uid", "symbol", "name", "aliases", "direct", "_annos", "lines", "jsonFragment")
+
+    def __init__(self, _uid=None, _symb=None, _name=None, _alias=None):
         self.uid = _uid
         self.symbol = _symb
         self.name = _name
-        self.aliases = _alias
-        self.direct = {}  # Code --> Set(OntoTerm)
-        self.annos = {}  # Code --> Set(OntoTerm)
+        self.aliases = set() if _alias is None else _alias
+        self.direct = EMPTY  # Code --> Set(OntoTerm)
+        self._annos = EMPTY  # Code --> Set(OntoTerm), None when derived from direct
+        self.lines = 0  # GAF lines naming this gene, NOT and unknown-term lines included
+        self.jsonFragment = None  # toJSON() encoded once, see fragment()
+
+    @property
+    def annos(self):
+        # Propagated annotations, computed from the direct terms' ancestors once an AnnoIndex holds them
+        if self._annos is None:
+            return {code: self.reach(terms) for code, terms in self.direct.items()}
+        return self._annos
+
+    @annos.setter
+    def annos(self, value):
+        self._annos = value
+
     def toJSON(self):
         return self.uid + "(" + self.symbol + ")"
 
+    def fragment(self):
+        # toJSON() as pre-encoded JSON text, encoded on first use
+        if self.jsonFragment is None:
+            self.jsonFragment = RawJSON(json.dumps(self.toJSON()))
+        return self.jsonFragment
+
     def terms(self, exclude=None):
         if exclude == None:
             exclude = []
+        if self._annos is None:
+            return self.reach([t for code in self.direct if code not in exclude for t in self.direct[code]])
         result = set()
         for code in self.annos:
             # If this is not an excluded evidence code
@@ -22,12 +48,31 @@ class Gene:
                 result = result.union(self.annos[code])
         return result
 
+    @staticmethod
+    def reach(terms):
+        # The terms and all of their ancestors
+        result = set(terms)
+        for term in terms:
+            result.update(term.ancestors)
+        return result
+
     def directAnnotate(self, term, code):
         if code not in self.direct:
+            if self.direct is EMPTY:
+                self.direct = {}
             self.direct[code] = set()
         self.direct[code].add(term)
 
+    def directRemove(self, term, code):
+        self.direct[code].discard(term)
+        if len(self.direct[code]) == 0:
+            del self.direct[code]
+            if len(self.direct) == 0:
+                self.direct = EMPTY
+
     def addAnnos(self, term, code):
         if code not in self.annos:
+            if self.annos is EMPTY:
+                self.annos = {}
             self.annos[code] = set()
         self.annos[code].add(term)
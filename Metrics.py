@@ -0,0 +1,162 @@
+"""Request counters, histograms and per-stage timings in Prometheus text format.
+
+Code that does a measurable piece of work wraps it in METRICS.stage(name);
+the elapsed time goes into the go_stage_seconds histogram and, while a
+request collects its own timings (METRICS.timing()), into that request's
+timing dict as well. Each observation is a pair of perf_counter calls and
+a bucket update under a lock, so the metrics can stay on in production.
+Observations made in forked worker processes stay in those processes.
+"""
+import bisect
+import functools
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+#Histogram bucket upper bounds
+SECONDS_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 20000, 50000)
+
+
+class Histogram:
+    """Counts of observations per bucket (not cumulative), with their sum."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) #Last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    """Named counters and histograms, each keyed by a tuple of (label, value) pairs."""
+
+    def __init__(self):
+        self.enabled = True
+        self.lock = threading.Lock()
+        self.kinds = {} #Metric name --> (type, help text, histogram buckets)
+        self.values = {} #Metric name --> {labels: count or Histogram}
+        self.local = threading.local() #timing dict of the request running in this thread
+        self.describe("go_stage_seconds", "histogram", "Time spent in each stage of loading and enrichment.",
+                      SECONDS_BUCKETS)
+
+    def resetLock(self):
+        #In a forked child, where another thread of the parent may have held the lock
+        self.lock = threading.Lock()
+
+    def describe(self, name, kind, text, buckets=None):
+        """Declare a counter, gauge or histogram before its first use."""
+        self.kinds[name] = (kind, text, buckets)
+        self.values.setdefault(name, {})
+
+    def inc(self, name, labels=(), value=1):
+        if not self.enabled:
+            return
+        with self.lock:
+            series = self.values[name]
+            series[labels] = series.get(labels, 0) + value
+
+    def observe(self, name, value, labels=()):
+        if not self.enabled:
+            return
+        with self.lock:
+            series = self.values[name]
+            if labels not in series:
+                series[labels] = Histogram(self.kinds[name][2])
+            series[labels].observe(value)
+
+    @contextmanager
+    def stage(self, name):
+        """Time the enclosed block as stage name."""
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.observe("go_stage_seconds", elapsed, (("stage", name),))
+            timing = getattr(self.local, "timing", None)
+            if timing is not None:
+                timing[name] = timing.get(name, 0.0) + elapsed
+
+    def timed(self, name):
+        """Decorator timing every call of the function as stage name."""
+        def decorate(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.stage(name):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorate
+
+    @contextmanager
+    def timing(self):
+        """Collect the stages run by this thread into the yielded dict (stage --> seconds)."""
+        timing = {}
+        outer = getattr(self.local, "timing", None)
+        self.local.timing = timing
+        try:
+            yield timing
+        finally:
+            self.local.timing = outer
+
+    def render(self, gauges=()):
+        """Prometheus text exposition of every metric.
+
+        gauges lists extra (name, help text, [(labels, value)]) computed by
+        the caller at scrape time.
+        """
+        lines = []
+        with self.lock:
+            for name in sorted(self.values):
+                kind, text, buckets = self.kinds[name]
+                lines.append("# HELP " + name + " " + text)
+                lines.append("# TYPE " + name + " " + kind)
+                for labels in sorted(self.values[name]):
+                    value = self.values[name][labels]
+                    if kind != "histogram":
+                        lines.append(name + _labels(labels) + " " + _number(value))
+                        continue
+                    total = 0
+                    for bound, count in zip(list(buckets) + ["+Inf"], value.counts):
+                        total += count
+                        lines.append(name + "_bucket" + _labels(labels + (("le", _number(bound)),)) + " " + str(total))
+                    lines.append(name + "_sum" + _labels(labels) + " " + _number(value.sum))
+                    lines.append(name + "_count" + _labels(labels) + " " + str(value.count))
+        for name, text, samples in gauges:
+            lines.append("# HELP " + name + " " + text)
+            lines.append("# TYPE " + name + " gauge")
+            for labels, value in samples:
+                lines.append(name + _labels(labels) + " " + _number(value))
+        return "\n".join(lines) + "\n"
+
+
+def _number(value):
+    if isinstance(value, str):
+        return value
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value)) if abs(value) < 1e15 else repr(value)
+    return repr(value)
+
+def _labels(labels):
+    if len(labels) == 0:
+        return ""
+    escaped = [(k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for k, v in labels]
+    return "{" + ",".join([k + '="' + v + '"' for k, v in escaped]) + "}"
+
+
+#Process-wide metrics
+METRICS = Metrics()
+os.register_at_fork(after_in_child=METRICS.resetLock)
+METRICS.describe("go_requests_total", "counter", "HTTP requests served, by endpoint and status.")
+METRICS.describe("go_request_seconds", "histogram", "HTTP request latency, by endpoint.", SECONDS_BUCKETS)
+METRICS.describe("go_query_genes", "histogram", "Resolved genes per enrichment query.", SIZE_BUCKETS)
+METRICS.describe("go_candidate_terms", "histogram", "Candidate terms tested per enrichment query.", SIZE_BUCKETS)
@@ -1,88 +1,125 @@
+import json
+from types import MappingProxyType
 import scipy.stats as stats
+from Fragments import RawJSON
+from TreeMap import TreeMap
+
+#Shared read-only stand-ins for the many empty dicts and sets of terms and genes
+EMPTY = MappingProxyType({})
+EMPTY_SET = frozenset()
+
+def frozen(items):
+    """items as a frozenset, sharing EMPTY_SET when there are none."""
+    return frozenset(items) if len(items) > 0 else EMPTY_SET
 
 class OntoTerm:
-    # uid = ""
-    # name = ""
-    # defn = ""
-    # is_a = set() #Set of OntoTerms that are direct parents
-    # part_of = set()
-    # regulates = set()
-    # children = set()
-
-    def __init__(self, _uid="", _name="", _defn="", _is_a=set(), _part_of=set(), _regulates=set()):
+    #No per-instance __dict__: a full GO release has tens of thousands of terms
+    __slots__ = ("uid", "name", "defn", "namespace", "is_a", "part_of", "regulates", "relationships",
+                 "parentTerms", "direct", "_annos", "store", "children", "ancestors", "directCounts",
+                 "totalCounts", "nDirect", "nTotal", "jsonFragment")
+
+    def __init__(self, _uid="", _name="", _defn="", _is_a=None, _part_of=None, _regulates=None):
         self.uid  = _uid
         self.name = _name
         self.defn = _defn
-        self.is_a = _is_a
-        self.part_of = _part_of
-        self.regulates = _regulates
-        self.direct = {} #Code --> Gene
-        self.annos = {} #Code --> Gene
+        self.namespace = "" #biological_process, molecular_function or cellular_component
+        self.is_a = set() if _is_a is None else _is_a #Set of OntoTerms that are direct parents
+        self.part_of = set() if _part_of is None else _part_of
+        self.regulates = set() if _regulates is None else _regulates
+        self.relationships = {} #Other relationship type --> set of target ids
+        self.parentTerms = None #Tuple of all parents once the DAG is frozen, see Ontology.freezeDag
+        self.direct = EMPTY #Code --> Gene
+        self._annos = EMPTY #Code --> Gene, None once held by an AnnoIndex
+        self.store = None #AnnoIndex holding the propagated annotations
         self.children = set()
+        self.ancestors = EMPTY_SET #Transitive parents, set by Ontology.buildClosure
+        #Cached counts, filled in by Ontology.computeCounts after annotations load
+        self.directCounts = EMPTY #Code --> number of directly annotated genes
+        self.totalCounts = EMPTY #Code --> number of genes incl. propagated
+        self.nDirect = 0 #Genes directly annotated with any code
+        self.nTotal = 0 #Genes annotated with any code incl. propagated
+        self.jsonFragment = None #toJSON() encoded once, see fragment()
+
+    @property
+    def annos(self):
+        #Propagated annotations, read from the AnnoIndex once it holds them (see AnnoIndex.attach)
+        if self._annos is None:
+            return self.store.termAnnos(self)
+        return self._annos
+
+    @annos.setter
+    def annos(self, value):
+        self._annos = value
 
     def toJSON(self):
         return {"uid": self.uid,
                 "name": self.name,
                 "defn": self.defn }
 
+    def fragment(self):
+        #toJSON() as pre-encoded JSON text, encoded on first use
+        if self.jsonFragment is None:
+            self.jsonFragment = RawJSON(json.dumps(self.toJSON()))
+        return self.jsonFragment
+
     def toTreeMapPlotlyJSON(self, depth=2):
-        labels = [self.uid]
-        parents = [""]
-        if len(self.parents()) > 0:
-            parents = [list(self.parents())[0].uid]
-        if depth > 0:
-            for child in self.children:
-                kidStuff = child.toTreeMapPlotlyJSON(depth - 1)
-                for kidLabel in kidStuff["labels"]:
-                    labels.append(kidLabel)
-                for kidParent in kidStuff["parents"]:
-                    parents.append(kidParent)
-        #print(len(labels))
-        #print(len(parents))
-        #print(labels)
-        return {
-            'labels': labels,
-            'parents': parents,
-        }
+        #Flat ids/labels/parents/values table, one row per path (see TreeMap.flat)
+        return TreeMap().flat(self, depth)
 
     def toTreeMapJSON(self, depth=6, withAnno=True):
-        data = { 'name': self.name, 'uid': self.uid }
-        data['size'] = len(self.allAnnos())
-        data['kids'] = []
-        if depth > 0:
-            for kid in self.children:
-                if not withAnno or len(kid.allAnnos()) > 0:
-                    data['kids'].append(kid.toTreeMapJSON(depth-1))
-        return data
+        return TreeMap(withAnno=withAnno).nested(self, depth)
 
     def parents(self):
+        if self.parentTerms is not None:
+            return self.parentTerms
         return(self.is_a.union(self.part_of).union(self.regulates))
 
-    def directAnnos(self):
+    def directAnnos(self, codes=None):
         result = set()
         for code in self.direct:
-            result = result.union(self.direct[code])
+            # Only evidence codes in codes, if given
+            if codes is None or code in codes:
+                result = result.union(self.direct[code])
         return result
 
-    def allAnnos(self):
+    def allAnnos(self, codes=None):
+        if self._annos is None:
+            return self.store.termGenes(self, codes)
         result = set()
         for code in self.annos:
-            result = result.union(self.annos[code])
+            if codes is None or code in codes:
+                result = result.union(self.annos[code])
         return result
 
     def annotate(self, gene, code):
-        #Add gene to term
+        self.annotateDirect(gene, code)
+        #Recursively annotate up
+        self.addAnnos(gene, code)
+
+    def annotateDirect(self, gene, code):
+        #Add gene to term (propagation is left to Ontology.propagateAnnos)
         if code not in self.direct:
+            if self.direct is EMPTY:
+                self.direct = {}
             self.direct[code] = set()
         self.direct[code].add(gene)
         #Add term to gene
         gene.directAnnotate(self,code)
-        #Recursively annotate up
-        self.addAnnos(gene, code)
+
+    def removeDirect(self, gene, code):
+        #Inverse of annotateDirect (see Ontology.applyAnnoDiff)
+        self.direct[code].discard(gene)
+        if len(self.direct[code]) == 0:
+            del self.direct[code]
+            if len(self.direct) == 0:
+                self.direct = EMPTY
+        gene.directRemove(self, code)
 
     def addAnnos(self, gene, code):
         #Add gene to the annotations of this term
         if code not in self.annos:
+            if self.annos is EMPTY:
+                self.annos = {}
             self.annos[code] = set()
         if gene not in self.annos[code]:
             self.annos[code].add(gene)
@@ -94,10 +131,15 @@ class OntoTerm:
 
     def hyperGeomEnrich(self, genes, totalGenes):
         termGenes = self.allAnnos()
-        hgd = stats.hypergeom(totalGenes, len(termGenes), len(genes))
         overlap = termGenes.intersection(genes)
+        return OntoTerm.hyperGeomTail(len(overlap), len(termGenes), len(genes), totalGenes)
+
+    @staticmethod
+    def hyperGeomTail(nOverlap, nTerm, nQuery, totalGenes):
+        #P(X >= nOverlap) when drawing nQuery of totalGenes genes, nTerm annotated
+        hgd = stats.hypergeom(totalGenes, nTerm, nQuery)
         p = 0
-        for x in range(len(overlap),len(genes)+1):
+        for x in range(nOverlap, nQuery+1):
             p += hgd.pmf(x)
         return p
 
@@ -112,10 +154,3 @@ class OntoTerm:
             unadjPval = self.hyperGeomEnrich(queryGenes, totalGenes)
             return Enrichment(self, unadjPval, None, overlap)
         return None
-
-
-testOntolgoy = OntoTerm("GO:0000015",
-                        "phosphopyruvate hydratase complex",
-                        "A multimeric enzyme complex, usually a dimer or an octamer, that catalyzes the conversion of 2-phospho-D-glycerate to phosphoenolpyruvate and water.",
-                        set(["GO:0044445","GO:1902494"]))
-print(testOntolgoy)
@@ -1,109 +1,708 @@
-from OntoTerm import OntoTerm
+import bisect
+import gc
+import itertools
+import os
+import sys
+import time
+from contextlib import contextmanager
+import numpy as np
+from OntoTerm import OntoTerm, EMPTY, frozen
 from Gene import Gene
+from Enrichment import Enrichment
+from Stats import hypergeomUpperTail, bhAdjust
+from Parsers import ParseDiagnostics, iterOboStanzas, iterGafRecords, iterGafDiff
+from Evidence import selectCodes
+from TreeMap import TreeMap
+from Similarity import Similarity
+from Reachability import Reachability
+from Permutation import countBins, exceedances, settled
+import Topology
+import Ranked
+from Metrics import METRICS
+
+#Source of Ontology.generation values
+_generations = itertools.count(1)
+
+#Relationship types that propagate annotations as "regulates" parents
+REGULATES = set(["regulates", "positively_regulates", "negatively_regulates"])
+
+@contextmanager
+def pausedGC():
+    """Suspend cyclic garbage collection while building the annotation graph.
+
+    Loading creates millions of long-lived sets, which otherwise trigger
+    repeated full collections that find nothing to free.
+    """
+    wasEnabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if wasEnabled:
+            gc.enable()
+
+def releaseLabel(fileName, diagnostics, tags):
+    """Release of a parsed file: the first header tag present, else its modification date."""
+    for tag in tags:
+        if diagnostics.header.get(tag, "") != "":
+            return diagnostics.header[tag]
+    try:
+        return time.strftime("%Y-%m-%d", time.gmtime(os.path.getmtime(fileName)))
+    except OSError:
+        return None
+
+def _serialMap(fn, argsIter):
+    for args in argsIter:
+        yield fn(*args)
 
 class Ontology:
-    def __init__(self, oboFileName=None, annoFileName=None):
+    def __init__(self, oboFileName=None, annoFileName=None, useIndex=True, cacheDir=None):
         #Fields
         self.terms = {} #Term.uid --> Term
         self.roots = [] #Root terms
+        self.topoOrder = [] #All terms, each listed after all of its parents
+        self.cyclicTerms = [] #Terms on or below a cycle (none for a valid GO release)
         self.genes = {} #Gene.uid --> Gene
+        self.extraLines = {} #(Gene, Term, code) --> GAF lines repeating that annotation beyond the first
+        self.altIds = {} #alt_id or obsolete id --> primary Term.uid
+        self.diagnostics = {} #File name --> ParseDiagnostics
+        self.popSizes = {} #Namespace --> number of genes annotated under its root(s)
+        self.populations = {} #Namespace --> frozenset of those genes
+        self.filteredPopulations = {} #(Namespace, frozenset of codes) --> frozenset of genes
+        self.codes = frozenset() #Evidence codes present in the annotations
+        self.annotatedUids = [] #Sorted uids of the terms with any annotation
+        self.treeMaps = {} #Frozenset of codes (or None) --> TreeMap
+        self.similarityIndex = None #Similarity (information content and closure), built on first use
+        self.names = {} #Gene uid/symbol/alias --> list of Genes
+        self.namesLower = {} #Lower-cased uid/symbol/alias --> list of Genes
+        self.useIndex = useIndex #Score enrichment with the bitset AnnoIndex
+        self.index = None #AnnoIndex, built after annotations are loaded
+        self.reachabilityIndex = None #Reachability, built with the DAG
+        self.generation = 0 #Changes whenever the annotations change (cache key)
+        self.releases = {} #"ontology"/"annotations" --> release label of the loaded file
 
         #Load files if able
-        if oboFileName is not None:
+        if oboFileName is not None and annoFileName is not None and cacheDir is not None:
+            self.loadCached(oboFileName, annoFileName, cacheDir)
+        elif oboFileName is not None:
             self.loadOboFile(oboFileName)
             if annoFileName is not None:
                 self.loadAnnoFile(annoFileName)
 
 
+    def loadCached(self, oboFileName, annoFileName, cacheDir, dag=None):
+        """Load from a binary snapshot in cacheDir, or parse and write one.
+
+        The snapshot is keyed by the source files' sizes and mtimes, so it
+        is rebuilt automatically when either file changes. dag is an optional
+        function returning an Ontology already holding oboFileName; when the
+        snapshot has to be rebuilt its terms are copied instead of parsed.
+        """
+        from Snapshot import snapshotPath, loadSnapshot, saveSnapshot
+        sources = [oboFileName, annoFileName]
+        path = snapshotPath(cacheDir, sources)
+        if os.path.isdir(path):
+            with pausedGC():
+                loadSnapshot(self, path)
+        else:
+            if dag is not None:
+                dag().copyDag(self)
+            else:
+                self.loadOboFile(oboFileName)
+            self.loadAnnoFile(annoFileName)
+            saveSnapshot(self, path, sources)
+
+    def copyDag(self, target=None):
+        """Copy the terms and edges (no annotations) into a new Ontology.
+
+        Ids, names and definitions are shared with this instance and the
+        ancestor closures are mapped rather than recomputed, so another
+        annotation file can be loaded without re-parsing the OBO file.
+        """
+        if target is None:
+            target = Ontology(useIndex=self.useIndex)
+        with pausedGC():
+            mapping = {}
+            for uid, term in self.terms.items():
+                copy = OntoTerm(term.uid, term.name, term.defn)
+                copy.namespace = term.namespace
+                copy.relationships = term.relationships
+                mapping[term] = copy
+                target.terms[uid] = copy
+            for term, copy in mapping.items():
+                copy.is_a = set([mapping[p] for p in term.is_a])
+                copy.part_of = set([mapping[p] for p in term.part_of])
+                copy.regulates = set([mapping[p] for p in term.regulates])
+                copy.children = set([mapping[c] for c in term.children])
+                copy.ancestors = frozen([mapping[a] for a in term.ancestors])
+            target.freezeDag()
+        if self.reachabilityIndex is not None:
+            target.reachabilityIndex = self.reachabilityIndex.rebind(target)
+        target.roots = [mapping[t] for t in self.roots]
+        target.topoOrder = [mapping[t] for t in self.topoOrder]
+        target.cyclicTerms = [mapping[t] for t in self.cyclicTerms]
+        target.altIds = self.altIds
+        target.diagnostics.update(self.diagnostics)
+        if "ontology" in self.releases:
+            target.releases["ontology"] = self.releases["ontology"]
+        return target
+
+    @METRICS.timed("load_obo")
     def loadOboFile(self, oboFileName):
-        fin = open(oboFileName,"r")
-        #Parsing helper variables
-        interm = False
-        uid = ""
-        name = ""
-        defn = ""
-        is_a = set()
-        part_of = set()
-        regulates = set()
-        #Parse the OBO file format
-        for line in fin:
-            line = line.strip()
-            if line == "":
-                if interm: #If blank line and was reading in a term, add it
-                    if uid not in self.terms:
-                        self.terms[uid] = OntoTerm(uid,name,defn,is_a)
+        """Load the GO DAG from a plain or gzip-compressed OBO file.
+
+        is_a, part_of and regulates (incl. positively/negatively_regulates)
+        edges become parents; other relationship types are kept by target id
+        in OntoTerm.relationships. Obsolete terms are skipped, and their
+        replaced_by targets and all alt_ids are recorded in self.altIds.
+        """
+        diagnostics = ParseDiagnostics(oboFileName)
+        self.diagnostics[oboFileName] = diagnostics
+        defined = set()
+        with pausedGC():
+            for lineNo, stanzaType, tags in iterOboStanzas(oboFileName, diagnostics):
+                if stanzaType != "Term":
+                    continue
+                if "id" not in tags:
+                    diagnostics.warn("missing_id", lineNo, "[Term] stanza without an id")
+                    continue
+                uid = sys.intern(tags["id"][0])
+                if tags.get("is_obsolete", ["false"])[0] == "true":
+                    if "replaced_by" in tags:
+                        self.altIds[uid] = tags["replaced_by"][0]
+                    diagnostics.count("obsolete")
+                    continue
+                term = self._termFor(uid)
+                term.name = tags.get("name", [""])[0]
+                term.defn = tags.get("def", [""])[0]
+                term.namespace = sys.intern(tags.get("namespace", [""])[0])
+                term.is_a = set([self._termFor(value.split()[0]) for value in tags.get("is_a", [])])
+                term.part_of = set()
+                term.regulates = set()
+                term.relationships = {}
+                for value in tags.get("relationship", []):
+                    fields = value.split()
+                    if len(fields) < 2:
+                        diagnostics.warn("malformed", lineNo, uid + " has relationship " + repr(value))
+                    elif fields[0] == "part_of":
+                        term.part_of.add(self._termFor(fields[1]))
+                    elif fields[0] in REGULATES:
+                        term.regulates.add(self._termFor(fields[1]))
                     else:
-                        term = self.terms[uid]
-                        term.name = name
-                        term.defn = defn
-                        term.is_a = is_a
-                        term.part_of = part_of
-                        term.regulates = regulates
-                    if len(self.terms[uid].parents()) == 0:
-                        self.roots.append(self.terms[uid])
-                interm = False
-            elif line == "[Term]":
-                #Reset everything for this term
-                interm = True
-                uid = ""
-                name = ""
-                defn = ""
-                is_a = set()
-                part_of = set()
-                regulates = set()
-            elif interm:
-                if line[0:3] == "id:":
-                    uid = line[4:]
-                elif line[0:5] == "name:":
-                    name = line[6:]
-                elif line[0:4] == "def:":
-                    defn = line[5:]
-                elif line[0:12] == "is_obsolete:":
-                    interm = False
-                elif line[0:5] == "is_a:":
-                    termid = line[6:16]
-                    if termid not in self.terms:
-                        self.terms[termid] = OntoTerm(termid)
-                    is_a.add(self.terms[termid])
-                elif line[0:21] == "relationship: part_of":
-                    termid = line[22:32]
-                    if termid not in self.terms:
-                        self.terms[termid] = OntoTerm(termid)
-                    part_of.add(self.terms[termid])
-                elif line[0:23] == "relationship: regulates":
-                    termid = line[24:34]
-                    if termid not in self.terms:
-                        self.terms[termid] = OntoTerm(termid)
-                    regulates.add(self.terms[termid])
-                elif line[0:34] == "relationship: positively_regulates" or line[0:34] == "relationship: negatively_regulates":
-                    termid = line[35:45]
-                    if termid not in self.terms:
-                        self.terms[termid] = OntoTerm(termid)
-                    regulates.add(self.terms[termid])
-        fin.close()
+                        if fields[0] not in term.relationships:
+                            term.relationships[fields[0]] = set()
+                        term.relationships[fields[0]].add(fields[1])
+                for alt in tags.get("alt_id", []):
+                    self.altIds[alt] = uid
+                defined.add(term)
+                if len(term.parents()) == 0:
+                    self.roots.append(term)
+            for term in self.terms.values():
+                if term not in defined:
+                    diagnostics.warn("undefined_term", 0, term.uid + " is referenced but never defined")
+                for parent in term.parents():
+                    parent.children.add(term)
+            #Follow replaced_by chains so every alias points at a live term
+            for alt in self.altIds:
+                target = self.altIds[alt]
+                steps = 0
+                while target not in self.terms and target in self.altIds and steps < len(self.altIds):
+                    target = self.altIds[target]
+                    steps += 1
+                self.altIds[alt] = target
+            self.buildClosure()
+            self.freezeDag()
+        self.reachabilityIndex = None #Built now, so the copies made by copyDag share it
+        self.reachability()
+        self.releases["ontology"] = releaseLabel(oboFileName, diagnostics, ["data-version", "date"])
+
+    def _termFor(self, uid):
+        """Return the term for uid, creating a placeholder if it is not seen yet."""
+        if uid not in self.terms:
+            uid = sys.intern(uid)
+            self.terms[uid] = OntoTerm(uid)
+        return self.terms[uid]
+
+    def getTerm(self, uid):
+        """Return the term for uid, following alt_id/replaced_by remapping."""
+        if uid in self.terms:
+            return self.terms[uid]
+        if uid in self.altIds and self.altIds[uid] in self.terms:
+            return self.terms[self.altIds[uid]]
+        return None
+
+    def buildClosure(self):
+        """Compute each term's transitive ancestors once, in topological order.
+
+        Parents are visited before their children, so a term's closure is
+        the union of its parents and their (already computed) closures.
+        The result is stored in OntoTerm.ancestors and the visiting order
+        in self.topoOrder.
+        """
+        pending = {}
+        queue = []
         for term in self.terms.values():
+            pending[term] = len(term.parents())
+            if pending[term] == 0:
+                queue.append(term)
+        order = []
+        while len(queue) > 0:
+            term = queue.pop()
+            order.append(term)
+            for child in term.children:
+                pending[child] -= 1
+                if pending[child] == 0:
+                    queue.append(child)
+        for term in order:
+            ancestors = set()
             for parent in term.parents():
-                parent.children.add(term)
-                #print(str(len(term.children)) + " ~~ " + str(len(parent.children)))
-        #print(len(self.terms["GO:0042867"].children))
+                ancestors.add(parent)
+                ancestors.update(parent.ancestors)
+            term.ancestors = frozen(ancestors)
+        #Terms on a cycle (and everything below them) never reach zero pending
+        #parents; fall back to a plain walk for those
+        self.cyclicTerms = []
+        for term in self.terms.values():
+            if pending[term] > 0:
+                self.cyclicTerms.append(term)
+                ancestors = set()
+                stack = list(term.parents())
+                while len(stack) > 0:
+                    parent = stack.pop()
+                    if parent not in ancestors:
+                        ancestors.add(parent)
+                        stack.extend(parent.parents())
+                term.ancestors = frozen(ancestors)
+                order.append(term)
+        self.topoOrder = order
+
+    def freezeDag(self):
+        """Make the edges of every term immutable once the DAG is complete.
 
+        The parent and child sets become frozensets (terms without any share
+        one empty frozenset) and each term's parents are kept as a tuple, so
+        parents() no longer builds a union per call.
+        """
+        for term in self.terms.values():
+            term.is_a = frozen(term.is_a)
+            term.part_of = frozen(term.part_of)
+            term.regulates = frozen(term.regulates)
+            term.children = frozen(term.children)
+            term.parentTerms = tuple(term.is_a | term.part_of | term.regulates)
+            if len(term.relationships) == 0:
+                term.relationships = EMPTY
+
+    @METRICS.timed("load_annotations")
     def loadAnnoFile(self, annoFileName):
-        fin = open(annoFileName, "r")
-        for line in fin:
-            if line[0] != "!":
-                line = line.strip()
-                parts = line.split("\t")
+        """Load annotations from a plain or gzip-compressed GAF file.
+
+        Negative (NOT) annotations are skipped, annotations to alt_ids or
+        obsolete terms are remapped, and unknown terms are recorded in the
+        file's diagnostics.
+        """
+        self.index = None #Any existing index no longer matches the annotations
+        diagnostics = ParseDiagnostics(annoFileName)
+        self.diagnostics[annoFileName] = diagnostics
+        with pausedGC():
+            for lineNo, parts in iterGafRecords(annoFileName, diagnostics):
                 #Get gene instance (Create it if needed)
                 if parts[2] not in self.genes:
-                    self.genes[parts[2]] = Gene(parts[1], parts[2], parts[9], set(parts[10].split("|")))
+                    aliases = set([a for a in parts[10].split("|") if a != ""])
+                    self.genes[parts[2]] = Gene(parts[1], parts[2], parts[9], aliases)
                 g = self.genes[parts[2]]
+                g.lines += 1
                 #Annotate the gene to Terms
-                if "NOT" not in parts[3]: #Eliminate negative annotations
-                    if parts[4] not in self.terms:
-                        print("ERROR: " + parts[4] + "not found in Ontology")
+                if "NOT" in parts[3]: #Eliminate negative annotations
+                    diagnostics.count("negated")
+                    continue
+                term = self.getTerm(parts[4])
+                if term is None:
+                    diagnostics.warn("unknown_term", lineNo, parts[4] + " not found in Ontology")
+                    continue
+                if term.uid != parts[4]:
+                    diagnostics.count("remapped")
+                #Interned, so the per-term and per-gene code keys share one string
+                code = sys.intern(parts[6])
+                if g in term.direct.get(code, ()):
+                    #Repeats (other references, with/from) are counted so a diff can remove them one at a time
+                    line = (g, term, code)
+                    self.extraLines[line] = self.extraLines.get(line, 0) + 1
+                    continue
+                term.annotateDirect(g, code)
+            #With useIndex the bitsets are the only copy of the propagated annotations
+            if self.useIndex:
+                self.buildIndex()
+            else:
+                self.propagateAnnos()
+            self.computeCounts()
+            self.buildNameIndex()
+            self.encodeFragments()
+        self.releases["annotations"] = releaseLabel(annoFileName, diagnostics, ["date-generated", "date"])
+
+    def release(self):
+        """Release labels of the loaded files, e.g. "ontology=releases/2024-01-17; annotations=2024-01-20"."""
+        return "; ".join([key + "=" + str(self.releases[key]) for key in ["ontology", "annotations"]
+                          if key in self.releases])
+
+    @METRICS.timed("apply_annotation_diff")
+    def applyAnnoDiff(self, diffFileName, lines=None):
+        """Apply a diff of GAF lines to the loaded annotations in place.
+
+        Lines starting with "+" add a GAF record and lines starting with "-"
+        remove one, so `diff -u old.gaf new.gaf` output applies as is (see
+        Parsers.iterGafDiff); lines, if given, are the diff's lines and
+        diffFileName only names them in the diagnostics. The outcome is the
+        same as reloading the patched GAF file, except that genes added by
+        the diff come after the existing ones.
+
+        Only what the diff touches is recomputed: the terms each changed
+        (gene, code) pair reaches through its direct terms' ancestors before
+        and after the diff are compared, the differences are set or cleared
+        in the AnnoIndex bitsets, and the counts of just those terms are
+        refreshed. Without an index the propagated sets are rebuilt instead.
+        Returns a summary of the changes.
+        """
+        start = time.perf_counter()
+        diagnostics = ParseDiagnostics(diffFileName)
+        self.diagnostics[diffFileName] = diagnostics
+        before = {} #(Gene, code) --> its direct terms with code before the diff
+        changedTerms = set() #Terms whose direct annotations changed
+        touchedGenes = set()
+        newGenes = []
+        summary = {"added": 0, "removed": 0}
+        with pausedGC():
+            for lineNo, sign, parts in iterGafDiff(diffFileName, diagnostics, lines):
+                if sign == "+":
+                    if parts[2] not in self.genes:
+                        aliases = set([a for a in parts[10].split("|") if a != ""])
+                        self.genes[parts[2]] = Gene(parts[1], parts[2], parts[9], aliases)
+                        if self.index is not None and self.index.attached:
+                            self.genes[parts[2]].annos = None
+                        newGenes.append(self.genes[parts[2]])
+                    g = self.genes[parts[2]]
+                    g.lines += 1
+                else:
+                    g = self.genes.get(parts[2])
+                    if g is None:
+                        diagnostics.warn("unknown_gene", lineNo, parts[2] + " has no annotations to remove")
+                        continue
+                    g.lines -= 1
+                touchedGenes.add(g)
+                summary["added" if sign == "+" else "removed"] += 1
+                if "NOT" in parts[3]:
+                    diagnostics.count("negated")
+                    continue
+                term = self.getTerm(parts[4])
+                if term is None:
+                    diagnostics.warn("unknown_term", lineNo, parts[4] + " not found in Ontology")
+                    continue
+                if term.uid != parts[4]:
+                    diagnostics.count("remapped")
+                code = sys.intern(parts[6])
+                if (g, code) not in before:
+                    before[(g, code)] = frozenset(g.direct.get(code, ()))
+                line = (g, term, code)
+                present = g in term.direct.get(code, ())
+                if sign == "+":
+                    if present:
+                        self.extraLines[line] = self.extraLines.get(line, 0) + 1
                     else:
-                        term = self.terms[parts[4]]
-                        term.annotate(g, parts[6])
+                        term.annotateDirect(g, code)
+                        changedTerms.add(term)
+                elif line in self.extraLines:
+                    self.extraLines[line] -= 1
+                    if self.extraLines[line] == 0:
+                        del self.extraLines[line]
+                elif present:
+                    term.removeDirect(g, code)
+                    changedTerms.add(term)
+                else:
+                    diagnostics.warn("not_annotated", lineNo, parts[2] + " has no " + code + " annotation to " + term.uid)
+                    g.lines += 1
+                    summary["removed"] -= 1
+            #A gene exists while some GAF line names it
+            removedGenes = [g for g in touchedGenes if g.lines <= 0 and len(g.direct) == 0]
+            for g in removedGenes:
+                del self.genes[g.symbol]
+
+            #Propagated changes per (gene, code): the terms reached before vs. after
+            changes = []
+            for (g, code), old in before.items():
+                new = frozenset(g.direct.get(code, ()))
+                if old == new:
+                    continue
+                reachedBefore = Gene.reach(old)
+                reachedAfter = Gene.reach(new)
+                changes.append((g, code, reachedAfter - reachedBefore, reachedBefore - reachedAfter))
+            touched = None
+            if self.index is not None and self.index.attached:
+                touched = self.index.update(self, changes)
+            elif self.useIndex:
+                self.buildIndex()
+            else:
+                self.propagateAnnos()
+            if touched is None:
+                self.computeCounts()
+            else:
+                self._refreshCounts(changedTerms, changes, before)
+            for g in newGenes:
+                if g.symbol in self.genes:
+                    self._indexNames(g)
+                    g.fragment()
+            for g in removedGenes:
+                self._indexNames(g, remove=True)
+            for term in changedTerms.union(touched or ()):
+                if term.nTotal > 0:
+                    term.fragment()
+        if diagnostics.header.get("date-generated", "") != "":
+            self.releases["annotations"] = diagnostics.header["date-generated"]
+        summary.update({"diff": diffFileName,
+                        "genes_added": len([g for g in newGenes if g.symbol in self.genes]),
+                        "genes_removed": len([g for g in removedGenes if g not in newGenes]),
+                        "terms_changed": len(changedTerms),
+                        "terms_recounted": len(self.terms) if touched is None else len(changedTerms.union(touched)),
+                        "index": "updated" if touched is not None else "rebuilt" if self.useIndex else None,
+                        "generation": self.generation,
+                        "seconds": round(time.perf_counter() - start, 6),
+                        "diagnostics": diagnostics.toJSON()})
+        return summary
+
+    def _refreshCounts(self, changedTerms, changes, before):
+        """Recount what AnnoIndex.update changed (see computeCounts).
+
+        Direct counts are redone for the terms in changedTerms and the
+        per-code totals only for the (term, code) pairs in changes.
+        """
+        index = self.index
+        for term in changedTerms:
+            term.directCounts = {code: len(genes) for code, genes in term.direct.items()} or EMPTY
+            term.nDirect = len(term.directAnnos())
+        byCode = {}
+        for g, code, gained, lost in changes:
+            if code not in byCode:
+                byCode[code] = set()
+            byCode[code].update(gained)
+            byCode[code].update(lost)
+        totals = {}
+        for code, terms in byCode.items():
+            for term, n in index.termCodeCounts(terms, code).items():
+                if term not in totals:
+                    totals[term] = dict(term.totalCounts)
+                if n > 0:
+                    totals[term][code] = n
+                else:
+                    totals[term].pop(code, None)
+        for term, counts in totals.items():
+            term.totalCounts = counts or EMPTY
+            wasAnnotated = term.nTotal > 0
+            term.nTotal = index.termSize(term)
+            if term.nTotal > 0 and not wasAnnotated:
+                bisect.insort(self.annotatedUids, term.uid)
+            elif term.nTotal == 0 and wasAnnotated:
+                del self.annotatedUids[bisect.bisect_left(self.annotatedUids, term.uid)]
+        codes = set(self.codes).union([code for g, code in before if code in g.direct])
+        for code in set([code for g, code in before if code not in g.direct and code in codes]):
+            if not any(code in g.direct for g in self.genes.values()):
+                codes.discard(code)
+        self.codes = frozenset(codes)
+        self._countsChanged()
+
+    def propagateAnnos(self):
+        """Propagate direct annotations to every ancestor in one bulk pass.
+
+        Terms are visited children-first (reverse topological order) and each
+        pushes its accumulated gene sets into its parents, one set union per
+        edge and evidence code. Each gene's annotated terms are the union of
+        its direct terms and their ancestor closures. This gives the same
+        direct/annos contents as OntoTerm.annotate without walking the DAG
+        once per annotation line.
+        """
+        cyclic = set(self.cyclicTerms)
+        for term in self.terms.values():
+            term.annos = {}
+            term.store = None
+        for term in self.terms.values():
+            for code in term.direct:
+                if code not in term.annos:
+                    term.annos[code] = set()
+                term.annos[code].update(term.direct[code])
+                #Without a topological order, push straight to the closure
+                if term in cyclic:
+                    for ancestor in term.ancestors:
+                        if code not in ancestor.annos:
+                            ancestor.annos[code] = set()
+                        ancestor.annos[code].update(term.direct[code])
+        for term in reversed(self.topoOrder):
+            if term in cyclic:
+                continue
+            for parent in term.parents():
+                for code in term.annos:
+                    if code not in parent.annos:
+                        parent.annos[code] = set()
+                    parent.annos[code].update(term.annos[code])
+        for term in self.terms.values():
+            if len(term.annos) == 0:
+                term.annos = EMPTY
+        for gene in self.genes.values():
+            gene.annos = {code: Gene.reach(gene.direct[code]) for code in gene.direct} or EMPTY
+
+    def computeCounts(self):
+        """Cache per-term annotation counts and per-namespace population sizes.
+
+        Called once after annotations are loaded so that enrichment and the
+        server endpoints never have to rebuild annotation unions for a count.
+        """
+        #Once an attached AnnoIndex holds the propagated annotations, count its bits
+        index = self.index if self.index is not None and self.index.attached else None
+        codeCounts = index.codeCounts() if index is not None else {}
+        for term in self.terms.values():
+            term.directCounts = {code: len(genes) for code, genes in term.direct.items()} or EMPTY
+            term.nDirect = len(term.directAnnos())
+            if index is not None:
+                term.totalCounts = codeCounts.get(term) or EMPTY
+                term.nTotal = index.termSize(term)
+            else:
+                term.totalCounts = {code: len(genes) for code, genes in term.annos.items()} or EMPTY
+                term.nTotal = len(term.allAnnos())
+        self.codes = frozenset([code for gene in self.genes.values() for code in gene.direct])
+        self.annotatedUids = sorted([term.uid for term in self.terms.values() if term.nTotal > 0])
+        self._countsChanged()
+
+    def _countsChanged(self):
+        """Recompute the populations and drop everything derived from the old counts."""
+        populations = {}
+        for root in self.roots:
+            if root.namespace not in populations:
+                populations[root.namespace] = set()
+            populations[root.namespace].update(root.allAnnos())
+        self.populations = {ns: frozenset(genes) for ns, genes in populations.items()}
+        self.popSizes = {ns: len(genes) for ns, genes in self.populations.items()}
+        self.filteredPopulations = {}
+        self.treeMaps = {}
+        self.similarityIndex = None
+        self.generation = next(_generations)
+
+    def buildNameIndex(self):
+        """Map every systematic id, symbol and alias to the Genes that carry it."""
+        self.names = {}
+        self.namesLower = {}
+        for gene in self.genes.values():
+            self._indexNames(gene)
+
+    def _indexNames(self, gene, remove=False):
+        #Add gene under (or with remove, drop it from) each of its names
+        for name in set([gene.uid, gene.symbol]).union(gene.aliases):
+            if not name:
+                continue
+            for index, key in ((self.names, name), (self.namesLower, name.lower())):
+                if remove:
+                    if gene in index.get(key, ()):
+                        index[key].remove(gene)
+                        if len(index[key]) == 0:
+                            del index[key]
+                    continue
+                if key not in index:
+                    index[key] = []
+                if gene not in index[key]:
+                    index[key].append(gene)
+
+    def encodeFragments(self):
+        """Pre-encode the JSON of every annotated term and every gene for response building."""
+        for term in self.terms.values():
+            if term.nTotal > 0:
+                term.fragment()
+        for gene in self.genes.values():
+            gene.fragment()
+
+    def resolveName(self, query):
+        """Look up a gene query string.
+
+        Returns a (kind, genes) tuple: kind is "direct" for a gene key or
+        systematic id, "alias" for a symbol/alias match (exact first, then
+        case-insensitive) and None when nothing matches. More than one gene
+        means the query is ambiguous.
+        """
+        if query in self.genes:
+            return "direct", [self.genes[query]]
+        matches = self.names.get(query, [])
+        if len(matches) == 1 and matches[0].uid == query:
+            return "direct", matches
+        if len(matches) == 0:
+            matches = self.namesLower.get(query.lower(), [])
+        if len(matches) == 0:
+            return None, []
+        return "alias", matches
+
+    def annotatedTerms(self, after=None):
+        """Yield the terms with annotations in uid order, starting after the uid after."""
+        uids = self.annotatedUids
+        start = 0 if after is None else bisect.bisect_right(uids, after)
+        for i in range(start, len(uids)):
+            yield self.terms[uids[i]]
+
+    def treeMap(self, codes=None):
+        """The memoized TreeMap for an evidence-code filter (None for all codes)."""
+        if codes not in self.treeMaps:
+            self.treeMaps[codes] = TreeMap(codes)
+        return self.treeMaps[codes]
+
+    def similarity(self):
+        """The Similarity over this Ontology's terms, built on first use."""
+        if self.similarityIndex is None:
+            with METRICS.stage("similarity_index"):
+                self.similarityIndex = Similarity(self)
+        return self.similarityIndex
+
+    def reachability(self):
+        """The Reachability index of this Ontology's DAG, built on first use."""
+        if self.reachabilityIndex is None:
+            with METRICS.stage("reachability_index"):
+                self.reachabilityIndex = Reachability(self)
+        return self.reachabilityIndex
+
+    def evidenceCodes(self, include=None, exclude=None, preset=None):
+        """The evidence codes kept by a filter, or None for no filtering (see Evidence.selectCodes)."""
+        return selectCodes(self.codes, include, exclude, preset)
+
+    def population(self, namespace, codes=None):
+        """Genes annotated anywhere under the root(s) of a namespace.
+
+        With codes, only annotations with those evidence codes count.
+        """
+        if codes is not None:
+            key = (namespace, codes)
+            if key not in self.filteredPopulations:
+                result = set()
+                for root in self.roots:
+                    if root.namespace == namespace or namespace not in self.populations:
+                        result.update(root.allAnnos(codes))
+                self.filteredPopulations[key] = frozenset(result)
+            return self.filteredPopulations[key]
+        if namespace in self.populations:
+            return self.populations[namespace]
+        #Terms outside any known namespace are tested against every annotated gene
+        result = set()
+        for genes in self.populations.values():
+            result.update(genes)
+        return result
+
+    def populationSize(self, namespace, codes=None):
+        if codes is None and namespace in self.popSizes:
+            return self.popSizes[namespace]
+        return len(self.population(namespace, codes))
+
+    @METRICS.timed("build_index")
+    def buildIndex(self):
+        """Build the integer-indexed bitset view of the loaded annotations and let it hold them (see AnnoIndex.attach)."""
+        from AnnoIndex import AnnoIndex
+        self.index = AnnoIndex(self)
+        self.index.attach(self)
+        return self.index
+
+    def getIndex(self):
+        if self.index is None:
+            self.buildIndex()
+        return self.index
 
     #Return map of term->pvalue for enrichment results
     def pvalsByGene(self, qGenes):
@@ -112,7 +711,7 @@ class Ontology:
         for gene in qGenes:
             termsToCheck = termsToCheck.union(gene.terms())
         for term in termsToCheck:
-            pvalResults[term] = term.hyperGeomEnrich(qGenes, len(self.roots[0].allAnnos()))
+            pvalResults[term] = term.hyperGeomEnrich(qGenes, self.populationSize(term.namespace))
         return pvalResults
 
     #Return map of term->pvalue for enrichment results
@@ -127,54 +726,272 @@ class Ontology:
             return {}
 
     #Return list of enrichment records from enrichment search
-    def enrichByGeneNames(self, qGeneNames):
-        """Perform enrichment analysis for a list of gene names with FDR correction."""
-        from scipy.stats import rankdata
-        
-        # Convert gene names to Gene objects
-        qGenes = set()
-        for name in qGeneNames:
-            if name in self.genes:
-                qGenes.add(self.genes[name])
-        
+    def enrichByGeneNames(self, qGeneNames, codes=None):
+        """Perform enrichment analysis for a list of gene names with FDR correction.
+
+        Query entries may be gene names or Gene instances (as produced by
+        name resolution in GOServer). Overlap and term sizes are collected for
+        every candidate term first, then all p-values are computed in a
+        single vectorized call. codes (see evidenceCodes) restricts term
+        sizes, overlaps and populations to annotations with those evidence
+        codes.
+        """
+        qGenes = self._queryGenes(qGeneNames)
         if len(qGenes) == 0:
             return []
             
-        # Get all terms annotated to query genes and calculate enrichment
-        termsToCheck = set()
-        enrichResults = []
-        
-        # Collect terms to check from all query genes
-        for gene in qGenes:
-            termsToCheck = termsToCheck.union(gene.terms())
-            
-        # Calculate enrichment for each term
-        totalGenes = len(self.roots[0].allAnnos())  # Total genes in database
-        for term in termsToCheck:
-            result = term.enrichRecord(qGenes, totalGenes)
-            if result is not None:
-                enrichResults.append(result)
-                
-        # Apply FDR correction if we have results
-        if len(enrichResults) > 0:
-            # Extract p-values and sort enrichment results
-            pvals = [r.unadjPval for r in enrichResults]
-            
-            # Calculate FDR (Benjamini-Hochberg)
-            n_tests = len(pvals)
-            ranked_p_values = rankdata(pvals)
-            fdr = pvals * n_tests / ranked_p_values
-            fdr[fdr > 1] = 1  # Cap FDR at 1
-            
-            # Assign adjusted p-values back to enrichment results
-            for idx, result in enumerate(enrichResults):
-                result.pval = fdr[idx]
-                
+        # Collect every term annotated to a query gene
+        with METRICS.stage("candidates"):
+            if self.useIndex:
+                terms, overlaps, termSizes, overlapGenes = self._candidatesIndexed(qGenes, codes)
+            else:
+                terms, overlaps, termSizes, overlapGenes = self._candidatesBySets(qGenes, codes)
+            if len(terms) == 0:
+                return []
+
+            # Each term is tested against the genes annotated in its own namespace
+            querySizes, totalGenes = self._namespaceSizes(terms, qGenes, codes)
+
+        # Calculate enrichment and FDR (Benjamini-Hochberg) for all terms at once
+        with METRICS.stage("pvalues"):
+            pvals = hypergeomUpperTail(overlaps, termSizes, querySizes, totalGenes)
+        with METRICS.stage("fdr"):
+            fdr = bhAdjust(pvals)
+        return self._enrichments(terms, pvals, fdr, overlapGenes, termSizes, codes)
+
+    def topologyEnrich(self, qGeneNames, method="elim", codes=None, cutoff=0.01):
+        """Enrichment with topGO-style "elim" or "weight" scoring (see Topology).
+
+        Terms are scored bottom-up in one sweep so that a signal is
+        credited to the most specific terms rather than to every ancestor.
+        For elim, a term's genes are removed from its ancestors when its
+        p-value is below cutoff, and each result's overlapping genes are
+        those left after elimination.
+        """
+        qGenes = self._queryGenes(qGeneNames)
+        if len(qGenes) == 0:
+            return []
+        with METRICS.stage("candidates"):
+            terms, overlaps, termSizes, overlapGenes = self._candidatesIndexed(qGenes, codes)
+            if len(terms) == 0:
+                return []
+            index = self.getIndex()
+            source = index.bits if codes is None else index.combine(codes)
+            bits = source[np.array([index.termIds[t] for t in terms], dtype=np.int64)]
+            qBits = index.pack(qGenes)
+            querySizes, totalGenes = self._namespaceSizes(terms, qGenes, codes)
+        with METRICS.stage("pvalues"):
+            if method == "elim":
+                pvals, effective = Topology.elim(terms, bits, qBits, querySizes, totalGenes, cutoff)
+                overlapGenes = index.genesIn(effective & qBits)
+            elif method == "weight":
+                pvals = hypergeomUpperTail(overlaps, termSizes, querySizes, totalGenes)
+                pvals = Topology.weight(terms, bits, qBits, querySizes, totalGenes, pvals)
+            else:
+                raise ValueError("Unknown topology method " + str(method))
+        with METRICS.stage("fdr"):
+            fdr = bhAdjust(pvals)
+        return self._enrichments(terms, pvals, fdr, overlapGenes, termSizes, codes)
+
+    def permutationEnrich(self, qGeneNames, codes=None, permutations=10000, seed=0, timeBudget=None,
+                          matchCounts=False, alpha=0.05, batchSize=250, mapper=None):
+        """Enrichment with empirical p-values from random gene sets (see Permutation).
+
+        As in enrichByGeneNames, each term is tested within its namespace:
+        random sets have the size of the query's part of that namespace's
+        population and are drawn from it, matched to the query genes'
+        annotation counts when matchCounts is set. Permutations stop at
+        permutations, after timeBudget seconds, or once every term's
+        p-value is settled relative to alpha (Permutation.settled). mapper(fn, argsIter) runs
+        the batches and yields their results in order (default: serially).
+
+        Returns (results, info); info records the permutations requested
+        and run and why they stopped.
+        """
+        info = {"requested": permutations, "run": 0, "seed": seed,
+                "matched": bool(matchCounts), "stopped": "complete"}
+        qGenes = self._queryGenes(qGeneNames)
+        if len(qGenes) == 0:
+            return [], info
+        with METRICS.stage("candidates"):
+            terms, overlaps, termSizes, overlapGenes = self._candidatesIndexed(qGenes, codes)
+        if len(terms) == 0:
+            return [], info
+
+        #One null per namespace: (term columns, membership, bins to draw from)
+        index = self.getIndex()
+        namespaces = np.array([term.namespace for term in terms])
+        groups = []
+        for namespace in sorted(set(namespaces.tolist())):
+            cols = np.flatnonzero(namespaces == namespace)
+            population = self.population(namespace, codes)
+            #Sorted ids, so a seed draws the same sets in every process
+            poolIds = np.array(sorted([index.geneIds[g] for g in population]), dtype=np.int64)
+            queryIds = np.array(sorted([index.geneIds[g] for g in qGenes.intersection(population)]), dtype=np.int64)
+            if matchCounts:
+                counts = index.geneCounts(codes)
+                poolBins = countBins(poolIds, counts)
+                queryBins = countBins(queryIds, counts)
+                bins = [(poolBins[b], len(queryBins[b])) for b in sorted(queryBins)]
+            else:
+                bins = [(poolIds, len(queryIds))]
+            groups.append((cols, index.membership([index.termIds[terms[c]] for c in cols], codes), bins))
+
+        batches = [min(batchSize, permutations - start) for start in range(0, permutations, batchSize)]
+        tasks = ((membership, bins, overlaps[cols], seed, b * len(groups) + g, size)
+                 for b, size in enumerate(batches) for g, (cols, membership, bins) in enumerate(groups))
+        exceed = np.zeros(len(terms), dtype=np.int64)
+        with METRICS.stage("pvalues"):
+            start = time.perf_counter()
+            results = (mapper or _serialMap)(exceedances, tasks)
+            for i, groupExceed in enumerate(results):
+                b, g = divmod(i, len(groups))
+                exceed[groups[g][0]] += groupExceed
+                if g < len(groups) - 1:
+                    continue
+                info["run"] += batches[b]
+                if info["run"] >= permutations:
+                    break
+                if timeBudget is not None and time.perf_counter() - start > timeBudget:
+                    info["stopped"] = "time"
+                    break
+                if settled(exceed, info["run"], alpha):
+                    info["stopped"] = "early"
+                    break
+            if hasattr(results, "close"):
+                results.close()
+        info["seconds"] = time.perf_counter() - start
+
+        pvals = (exceed + 1.0) / (info["run"] + 1.0)
+        with METRICS.stage("fdr"):
+            fdr = bhAdjust(pvals)
+        return self._enrichments(terms, pvals, fdr, overlapGenes, termSizes, codes), info
+
+    def rankedEnrich(self, qGeneScores, codes=None, method="mann_whitney", direction="both", minSize=1, maxSize=None):
+        """Threshold-free enrichment of a scored gene list (see Ranked).
+
+        qGeneScores maps gene names or Gene instances to scores, higher
+        first. As in enrichByGeneNames, each term is tested within its
+        namespace: against the scored genes in that namespace's population,
+        with codes restricting annotations and populations. Terms holding
+        fewer than minSize (or more than maxSize) of those genes, or all of
+        them, are not tested. Results carry the method's statistic and list
+        their overlapping genes in score order.
+        """
+        scores = {}
+        for name, score in qGeneScores.items():
+            gene = name if isinstance(name, Gene) else self.genes.get(name)
+            if gene is not None and gene not in scores:
+                scores[gene] = float(score)
+        if len(scores) == 0:
+            return []
+        index = self.getIndex()
+        with METRICS.stage("candidates"):
+            qBits = index.pack(scores)
+            rows = np.flatnonzero(index.overlapCounts(qBits, codes))
+            terms = [index.terms[row] for row in rows]
+        namespaces = np.array([term.namespace for term in terms])
+        statistics = np.full(len(terms), np.nan)
+        pvals = np.ones(len(terms))
+        sizes = np.zeros(len(terms), dtype=np.int64)
+        testable = np.zeros(len(terms), dtype=bool)
+        overlapGenes = [None] * len(terms)
+        with METRICS.stage("pvalues"):
+            for namespace in sorted(set(namespaces.tolist())):
+                cols = np.flatnonzero(namespaces == namespace)
+                population = self.population(namespace, codes)
+                #Membership rows in descending score order, so columns list genes by rank
+                ranked = sorted([g for g in scores if g in population], key=lambda g: -scores[g])
+                if len(ranked) == 0:
+                    continue
+                ids = np.array([index.geneIds[g] for g in ranked], dtype=np.int64)
+                membership = index.membership(rows[cols], codes)[ids].tocsc()
+                membership.sort_indices()
+                stat, p, n1 = Ranked.rankTest(membership, [scores[g] for g in ranked], method, direction)
+                statistics[cols] = stat
+                pvals[cols] = p
+                sizes[cols] = n1
+                testable[cols] = ~np.isnan(stat)
+                rankedGenes = np.empty(len(ranked), dtype=object)
+                rankedGenes[:] = ranked
+                for j, col in enumerate(cols.tolist()):
+                    overlapGenes[col] = rankedGenes[membership.indices[membership.indptr[j]:membership.indptr[j + 1]]].tolist()
+        keep = testable & (sizes >= minSize)
+        if maxSize is not None:
+            keep &= sizes <= maxSize
+        keep = np.flatnonzero(keep)
+        with METRICS.stage("fdr"):
+            fdr = bhAdjust(pvals[keep])
+        return self._enrichments([terms[i] for i in keep], pvals[keep], fdr, [overlapGenes[i] for i in keep],
+                                 index.termSizes(codes)[rows[keep]], codes, statistics[keep])
+
+    def _namespaceSizes(self, terms, qGenes, codes=None):
+        """Query and population size of each term's namespace, as two arrays."""
+        namespaces = np.array([term.namespace for term in terms])
+        querySizes = np.zeros(len(terms), dtype=np.int64)
+        totalGenes = np.zeros(len(terms), dtype=np.int64)
+        for namespace in set(namespaces.tolist()):
+            population = self.population(namespace, codes)
+            inNamespace = namespaces == namespace
+            querySizes[inNamespace] = len(qGenes.intersection(population))
+            totalGenes[inNamespace] = len(population)
+        return querySizes, totalGenes
+
+    def _queryGenes(self, qGeneNames):
+        """Gene objects for query entries that are gene names or Gene instances."""
+        qGenes = set()
+        for name in qGeneNames:
+            if isinstance(name, Gene):
+                qGenes.add(name)
+            elif name in self.genes:
+                qGenes.add(self.genes[name])
+        return qGenes
+
+    def _enrichments(self, terms, pvals, fdr, overlapGenes, termSizes, codes=None, statistics=None):
+        """Enrichment records sorted by adjusted p-value."""
+        METRICS.observe("go_candidate_terms", len(terms))
+        with METRICS.stage("results"):
+            enrichResults = []
+            for idx, term in enumerate(terms):
+                if codes is None:
+                    enrichResults.append(Enrichment(term, pvals[idx], fdr[idx], overlapGenes[idx]))
+                else:
+                    enrichResults.append(Enrichment(term, pvals[idx], fdr[idx], overlapGenes[idx],
+                                                    len(term.directAnnos(codes)), int(termSizes[idx])))
+                if statistics is not None:
+                    enrichResults[-1].statistic = float(statistics[idx])
+
             # Sort by adjusted p-value
             enrichResults.sort(key=lambda x: x.pval)
-            
         return enrichResults
 
+    def _candidatesIndexed(self, qGenes, codes=None):
+        """Collect candidate terms, overlaps and term sizes from the bitset index."""
+        index = self.getIndex()
+        qBits = index.pack(qGenes)
+        overlaps = index.overlapCounts(qBits, codes)
+        rows = np.flatnonzero(overlaps)
+        terms = [index.terms[row] for row in rows]
+        return terms, overlaps[rows], index.termSizes(codes)[rows], index.overlapGenes(rows, qBits, codes)
+
+    def _candidatesBySets(self, qGenes, codes=None):
+        """Collect candidate terms, overlaps and term sizes from the annotation sets."""
+        exclude = None if codes is None else self.codes - codes
+        termsToCheck = set()
+        for gene in qGenes:
+            termsToCheck = termsToCheck.union(gene.terms(exclude))
+        terms = list(termsToCheck)
+        overlaps = []
+        termSizes = []
+        overlapGenes = []
+        for term in terms:
+            termGenes = term.allAnnos(codes)
+            overlap = termGenes.intersection(qGenes)
+            overlaps.append(len(overlap))
+            termSizes.append(len(termGenes) if codes is not None else term.nTotal)
+            overlapGenes.append(overlap)
+        return terms, np.array(overlaps, dtype=np.int64), np.array(termSizes, dtype=np.int64), overlapGenes
+
 #This is for the 2027 version of go.obo file
 '''
 if __name__ == '__main__':
@@ -0,0 +1,246 @@
+import gc
+import os
+import threading
+import time
+from collections import OrderedDict
+from Ontology import Ontology
+
+def fileSignature(fileName):
+    """(size, mtime) of fileName, or None if it cannot be read."""
+    try:
+        info = os.stat(fileName)
+    except OSError:
+        return None
+    return (info.st_size, info.st_mtime_ns)
+
+def currentRSS():
+    """Resident set size of this process in bytes (0 if unknown)."""
+    try:
+        with open("/proc/self/statm") as fin:
+            return int(fin.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+class Organism:
+    """One organism's annotation layer and how much it cost to load."""
+
+    def __init__(self, name, annoFileName):
+        self.name = name
+        self.annoFileName = annoFileName
+        self.go = None #Ontology with this organism's annotations, while resident
+        self.loadSeconds = None
+        self.memoryBytes = 0 #RSS growth measured while loading (approximate)
+        self.lastUsed = None
+        self.signature = None #fileSignatures of the OBO and annotation files go was built from
+        self.lock = threading.Lock() #Held while loading so each file loads once
+
+    def toJSON(self):
+        return {"name": self.name,
+                "annotation_file": self.annoFileName,
+                "resident": self.go is not None,
+                "release": self.go.releases if self.go is not None else None,
+                "genes": len(self.go.genes) if self.go is not None else None,
+                "load_seconds": self.loadSeconds,
+                "memory_mb": round(self.memoryBytes / 2**20, 1),
+                "last_used": self.lastUsed}
+
+
+class OrganismRegistry:
+    """Per-organism Ontologies that share one parsed GO DAG.
+
+    The OBO file is parsed once; each organism's GAF file is loaded on the
+    first request for it, on top of a copy of that DAG. When the resident
+    organisms together exceed memoryBudget bytes, the least recently used
+    ones are dropped (requests already holding them finish normally).
+
+    reload() rebuilds the DAG and the resident organisms from changed files
+    in a background thread while the current Ontologies keep serving, then
+    swaps each new one in; requests that already hold the old one finish
+    against it.
+    """
+
+    def __init__(self, oboFileName, annoFiles, default=None, memoryBudget=None, cacheDir=None):
+        self.oboFileName = oboFileName
+        self.organisms = OrderedDict() #Name --> Organism, least recently used first
+        for name in annoFiles:
+            self.organisms[name] = Organism(name, annoFiles[name])
+        self.default = default if default is not None else next(iter(self.organisms), None)
+        self.memoryBudget = memoryBudget
+        self.cacheDir = cacheDir
+        self.lock = threading.RLock()
+        self._dag = None
+        self._dagLock = threading.Lock()
+        self.dagSignature = None #fileSignature of the OBO file self._dag was parsed from
+        self.reloading = False
+        self.lastReload = None #Outcome of the latest reload, for status()
+        self.listeners = [] #Called as listener(name, ontology) after an organism (re)loads
+        #A worker forked while another thread held a lock must not inherit it held
+        os.register_at_fork(after_in_child=self._resetLocks)
+
+    def _resetLocks(self):
+        self.lock = threading.RLock()
+        self._dagLock = threading.Lock()
+        for organism in self.organisms.values():
+            organism.lock = threading.Lock()
+
+    def dag(self):
+        """The shared GO DAG, parsed on first use."""
+        with self._dagLock:
+            if self._dag is None:
+                self.dagSignature = fileSignature(self.oboFileName)
+                self._dag = Ontology(self.oboFileName)
+            return self._dag
+
+    def name(self, org=''):
+        """Canonical organism name (the default organism for an empty org)."""
+        if org == '' or org is None:
+            return self.default
+        return org
+
+    def get(self, org=''):
+        """Return the Ontology for org (default organism if empty), loading it if needed.
+
+        Returns None for an unknown organism.
+        """
+        org = self.name(org)
+        with self.lock:
+            if org not in self.organisms:
+                return None
+            organism = self.organisms[org]
+            self.organisms.move_to_end(org)
+            organism.lastUsed = time.time()
+            go = organism.go
+        if go is not None:
+            return go
+        with organism.lock:
+            if organism.go is None:
+                self._load(organism)
+            go = organism.go
+        self._evict(keep=organism)
+        return go
+
+    def _load(self, organism):
+        if self.cacheDir is None:
+            self.dag() #Parse the shared DAG first so it is not charged to this organism
+        self._swap(organism, *self._build(organism, self.dag))
+
+    def _build(self, organism, dag):
+        """Build a new Ontology for organism on top of dag(); returns (go, signature, seconds, bytes)."""
+        signature = self._signature(organism)
+        before = currentRSS()
+        start = time.perf_counter()
+        if self.cacheDir is not None:
+            go = Ontology()
+            go.loadCached(self.oboFileName, organism.annoFileName, self.cacheDir, dag=dag)
+        else:
+            go = dag().copyDag()
+            go.loadAnnoFile(organism.annoFileName)
+        return go, signature, time.perf_counter() - start, max(0, currentRSS() - before)
+
+    def _swap(self, organism, go, signature, seconds, memoryBytes):
+        with self.lock:
+            organism.loadSeconds = seconds
+            organism.memoryBytes = memoryBytes
+            organism.signature = signature
+            organism.go = go
+        for listener in self.listeners:
+            listener(organism.name, go)
+
+    def _signature(self, organism):
+        return (fileSignature(self.oboFileName), fileSignature(organism.annoFileName))
+
+    def changed(self):
+        """True if the files of any resident organism changed since it was loaded."""
+        with self.lock:
+            resident = [o for o in self.organisms.values() if o.go is not None]
+        return any([self._signature(o) != o.signature for o in resident])
+
+    def reload(self, force=False):
+        """Start rebuilding changed (or with force, all) resident organisms in a background thread.
+
+        Returns False if a reload is already running.
+        """
+        with self.lock:
+            if self.reloading:
+                return False
+            self.reloading = True
+        threading.Thread(target=self._reload, args=(force,), name="go-reload", daemon=True).start()
+        return True
+
+    def _reload(self, force):
+        start = time.time()
+        reloaded = []
+        try:
+            with self._dagLock:
+                if force or fileSignature(self.oboFileName) != self.dagSignature:
+                    #Parsed again on next use, by the first organism rebuilt below
+                    self._dag = None
+            with self.lock:
+                resident = [o for o in self.organisms.values() if o.go is not None]
+            for organism in resident:
+                if not force and self._signature(organism) == organism.signature:
+                    continue
+                with organism.lock:
+                    #Requests keep getting (and finishing against) the old Ontology until the swap
+                    self._swap(organism, *self._build(organism, self.dag))
+                reloaded.append(organism.name)
+                gc.collect()
+            error = None
+        except Exception as e:
+            error = repr(e) #Keep serving the Ontologies already loaded
+        with self.lock:
+            self.lastReload = {"started": start, "seconds": round(time.time() - start, 3),
+                               "reloaded": reloaded, "error": error}
+            self.reloading = False
+
+    def applyDiff(self, org, diffFileName, lines=None):
+        """Apply a GAF diff to org's annotations in place (see Ontology.applyAnnoDiff).
+
+        The organism is loaded first if needed. Returns the diff's summary,
+        or None for an unknown organism. The change lasts until the organism
+        is next built from its GAF file (a reload or a load after eviction),
+        so the file itself should be patched as well.
+        """
+        org = self.name(org)
+        go = self.get(org)
+        if go is None:
+            return None
+        with self.organisms[org].lock:
+            summary = go.applyAnnoDiff(diffFileName, lines)
+        for listener in self.listeners:
+            listener(org, go)
+        return summary
+
+    def _evict(self, keep):
+        """Drop least recently used organisms until the memory budget is met."""
+        if self.memoryBudget is None:
+            return
+        evicted = False
+        with self.lock:
+            for organism in list(self.organisms.values()):
+                if self.residentBytes() <= self.memoryBudget:
+                    break
+                if organism is not keep and organism.go is not None:
+                    organism.go = None
+                    evicted = True
+        if evicted:
+            #Terms and genes reference each other, so freeing needs the cyclic collector
+            gc.collect()
+
+    def residentBytes(self):
+        return sum([o.memoryBytes for o in self.organisms.values() if o.go is not None])
+
+    def loaded(self):
+        """The resident Ontologies, by organism name."""
+        with self.lock:
+            return {name: o.go for name, o in self.organisms.items() if o.go is not None}
+
+    def status(self):
+        with self.lock:
+            return {"default_organism": self.default,
+                    "memory_budget_mb": None if self.memoryBudget is None else round(self.memoryBudget / 2**20, 1),
+                    "resident_mb": round(self.residentBytes() / 2**20, 1),
+                    "reloading": self.reloading,
+                    "last_reload": self.lastReload,
+                    "organisms": [o.toJSON() for o in self.organisms.values()]}
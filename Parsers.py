@@ -0,0 +1,167 @@
+"""Streaming readers for OBO ontology files, GAF 2.x annotation files and GAF diffs.
+
+The readers accept plain text or gzip-compressed files, read them line
+by line and tokenize each line once. Problems are collected in a
+ParseDiagnostics object instead of being printed.
+"""
+import gzip
+
+GAF_MIN_COLUMNS = 15 #GAF 1.0 has 15 columns, GAF 2.x has 17
+
+def openText(fileName):
+    """Open a plain or gzip-compressed text file for reading."""
+    fin = open(fileName, "rb")
+    magic = fin.read(2)
+    fin.close()
+    if magic == b"\x1f\x8b":
+        return gzip.open(fileName, "rt", encoding="utf-8")
+    return open(fileName, "r", encoding="utf-8")
+
+
+class ParseDiagnostics:
+    """Header values, counts and problems collected while reading one file."""
+
+    MAX_MESSAGES = 100 #Keep the first few messages; everything is still counted
+
+    def __init__(self, fileName):
+        self.fileName = fileName
+        self.header = {} #Header tag --> value
+        self.lines = 0
+        self.records = 0
+        self.counts = {} #Problem kind --> number of occurrences
+        self.messages = []
+
+    def warn(self, kind, lineNo, message):
+        self.count(kind)
+        if len(self.messages) < ParseDiagnostics.MAX_MESSAGES:
+            self.messages.append("line " + str(lineNo) + ": " + message)
+
+    def count(self, kind):
+        self.counts[kind] = self.counts.get(kind, 0) + 1
+
+    def toJSON(self):
+        return {"file": self.fileName,
+                "header": self.header,
+                "lines": self.lines,
+                "records": self.records,
+                "problems": self.counts,
+                "messages": self.messages}
+
+
+def _stripComment(value):
+    """Drop a trailing `! comment` and `{qualifiers}` from an OBO value."""
+    bang = value.find(" !")
+    if bang >= 0:
+        value = value[:bang]
+    brace = value.find(" {")
+    if brace >= 0:
+        value = value[:brace]
+    return value.strip()
+
+#Tags whose values are identifiers that may be followed by comments/qualifiers
+_ID_TAGS = set(["id", "is_a", "alt_id", "replaced_by", "consider", "relationship", "intersection_of"])
+
+def iterOboStanzas(fileName, diagnostics):
+    """Yield (lineNo, stanzaType, tags) for every stanza of an OBO file.
+
+    tags maps each tag to the list of its values, in file order. Header
+    tags before the first stanza go to diagnostics.header. A stanza ends at
+    the next stanza header or at end of file, blank line or not.
+    """
+    fin = openText(fileName)
+    stanzaType = None
+    tags = {}
+    start = 0
+    lineNo = 0
+    for line in fin:
+        lineNo += 1
+        line = line.strip()
+        if line == "" or line[0] == "!":
+            continue
+        if line[0] == "[":
+            if stanzaType is not None:
+                diagnostics.records += 1
+                yield start, stanzaType, tags
+            stanzaType = line[1:-1] if line[-1] == "]" else line[1:]
+            tags = {}
+            start = lineNo
+            continue
+        tag, sep, value = line.partition(":")
+        if sep == "":
+            diagnostics.warn("malformed", lineNo, "no tag in " + repr(line))
+            continue
+        value = value.strip()
+        if tag in _ID_TAGS:
+            value = _stripComment(value)
+        if stanzaType is None:
+            diagnostics.header[tag] = value
+        elif tag in tags:
+            tags[tag].append(value)
+        else:
+            tags[tag] = [value]
+    if stanzaType is not None:
+        diagnostics.records += 1
+        yield start, stanzaType, tags
+    diagnostics.lines = lineNo
+    fin.close()
+
+def _gafHeader(line, diagnostics):
+    """Record a `!tag: value` GAF header line in diagnostics.header."""
+    tag, sep, value = line[1:].partition(":")
+    if sep != "" and " " not in tag.strip():
+        diagnostics.header[tag.strip()] = value.strip()
+
+def iterGafRecords(fileName, diagnostics):
+    """Yield (lineNo, columns) for every annotation line of a GAF file.
+
+    `!tag: value` header lines go to diagnostics.header; lines with too few
+    columns are reported and skipped.
+    """
+    fin = openText(fileName)
+    lineNo = 0
+    for line in fin:
+        lineNo += 1
+        if line[0] == "!":
+            _gafHeader(line, diagnostics)
+            continue
+        parts = line.rstrip("\r\n").split("\t")
+        if len(parts) < GAF_MIN_COLUMNS:
+            if line.strip() != "":
+                diagnostics.warn("malformed", lineNo, "expected at least " + str(GAF_MIN_COLUMNS) +
+                                 " columns, found " + str(len(parts)))
+            continue
+        diagnostics.records += 1
+        yield lineNo, parts
+    diagnostics.lines = lineNo
+    fin.close()
+
+def iterGafDiff(fileName, diagnostics, lines=None):
+    """Yield (lineNo, sign, columns) for every added ("+") or removed ("-") GAF line of a diff.
+
+    Takes `diff -u old.gaf new.gaf` output as well as bare +/- lines: file
+    headers (+++/---), hunk markers, context and blank lines are skipped,
+    and added `!tag: value` header lines go to diagnostics.header. lines,
+    if given, are read instead of fileName (which then only names them).
+    """
+    fin = openText(fileName) if lines is None else None
+    lineNo = 0
+    for line in (fin if fin is not None else lines):
+        lineNo += 1
+        sign = line[:1]
+        if sign not in ("+", "-") or line.startswith("+++ ") or line.startswith("--- "):
+            continue
+        if line[1:2] == "!":
+            if sign == "+":
+                _gafHeader(line[1:], diagnostics)
+            continue
+        parts = line[1:].rstrip("\r\n").split("\t")
+        if len(parts) < GAF_MIN_COLUMNS:
+            if line[1:].strip() != "":
+                diagnostics.warn("malformed", lineNo, "expected at least " + str(GAF_MIN_COLUMNS) +
+                                 " columns, found " + str(len(parts)))
+            continue
+        diagnostics.records += 1
+        yield lineNo, sign, parts
+    diagnostics.lines = lineNo
+    if fin is not None:
+        fin.close()
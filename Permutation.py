@@ -0,0 +1,48 @@
+"""Empirical enrichment p-values from random gene sets.
+
+Each permutation draws a random gene set of the query's size from the
+population (optionally matched to the query genes' annotation counts) and
+counts its overlap with every candidate term; a term's empirical p-value
+is the fraction of permutations whose overlap reaches the observed one.
+Permutations run in batches: one batch is a sparse (sets x genes) matrix
+times the sparse (genes x terms) membership matrix, and each batch draws
+from its own seeded generator, so results depend only on the seed and the
+number of batches run, not on which process ran them.
+"""
+import numpy as np
+from scipy import sparse
+
+def countBins(geneIds, geneCounts):
+    """Group genes by annotation count, in powers of two: bin --> array of gene ids."""
+    geneIds = np.asarray(geneIds, dtype=np.int64)
+    keys = np.floor(np.log2(np.maximum(geneCounts[geneIds], 1))).astype(np.int64)
+    return {int(key): geneIds[keys == key] for key in np.unique(keys)}
+
+def exceedances(membership, bins, observed, seed, batch, size):
+    """Count, per term, the permutations of one batch that reach the observed overlap.
+
+    bins is a list of (gene ids to draw from, number to draw); one
+    permutation draws that many genes without replacement from each.
+    """
+    rng = np.random.default_rng([seed, batch])
+    k = sum([n for members, n in bins])
+    draws = np.empty((size, k), dtype=np.int64)
+    for i in range(size):
+        col = 0
+        for members, n in bins:
+            draws[i, col:col + n] = rng.choice(members, n, replace=False)
+            col += n
+    sets = sparse.csr_matrix((np.ones(size * k, dtype=np.int32), draws.ravel(), np.arange(0, size * k + 1, k)),
+                             shape=(size, membership.shape[0]))
+    overlaps = (sets @ membership).toarray()
+    return (overlaps >= observed).sum(axis=0)
+
+def settled(exceed, run, alpha, z=3.0, tolerance=0.1):
+    """True when every term's empirical p-value is settled relative to alpha.
+
+    A term is settled when its empirical p-value is clearly (z standard
+    errors) above or below alpha, or is known to within tolerance * alpha.
+    """
+    p = (exceed + 1.0) / (run + 1.0)
+    margin = z * np.sqrt(p * (1 - p) / run)
+    return bool(np.all((p + margin < alpha) | (p - margin > alpha) | (margin < tolerance * alpha)))
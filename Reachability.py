@@ -0,0 +1,150 @@
+"""Reachability index over the GO DAG: ancestor/descendant closure with path lengths.
+
+Every (term, ancestor) pair is stored once in a sparse matrix whose value
+is the length of the shortest upward path between them, so:
+
+    isAncestor(a, b)    binary search in b's row of up
+    ancestors(t, n)     t's row of up, optionally cut at n edges
+    descendants(t, n)   t's row of down (the transpose of up)
+
+The matrix is filled one path length at a time with sparse products
+against the parent adjacency matrix, so building it takes a few sparse
+products rather than a walk per term. Edges follow is_a, part_of and
+regulates, the same closure as annotation propagation.
+
+Lowest common ancestors of a set of terms are their common ancestors
+(each term counting as its own) that are not above another common
+ancestor. The minimal induced subgraph of a set of terms holds every term
+on an upward path from one of them to one of their lowest common
+ancestors (to the roots when they have none), with the is_a, part_of and
+regulates edges between those terms.
+"""
+import numpy as np
+from scipy import sparse
+
+EDGE_TYPES = ["is_a", "part_of", "regulates"]
+
+class Reachability:
+    """Shortest-path closure of one Ontology's terms."""
+
+    def __init__(self, go):
+        self.terms = list(go.terms.values())
+        self.positions = {t: i for i, t in enumerate(self.terms)}
+        n = len(self.terms)
+        rows = []
+        cols = []
+        for i, term in enumerate(self.terms):
+            for parent in term.parents():
+                rows.append(i)
+                cols.append(self.positions[parent])
+        parents = sparse.csr_matrix((np.ones(len(rows), dtype=bool), (rows, cols)), shape=(n, n))
+        #Frontier k holds the pairs first reached by a path of k edges
+        frontier = parents
+        seen = parents.copy()
+        blocks = [(frontier.tocoo(), 1)]
+        distance = 1
+        while frontier.nnz > 0:
+            distance += 1
+            reached = frontier @ parents
+            frontier = (reached > seen).tocsr() #Pairs in reached but not yet seen
+            frontier.eliminate_zeros()
+            if frontier.nnz == 0:
+                break
+            seen = seen + frontier
+            blocks.append((frontier.tocoo(), distance))
+        rows = np.concatenate([b.row for b, d in blocks])
+        cols = np.concatenate([b.col for b, d in blocks])
+        lengths = np.concatenate([np.full(b.nnz, d, dtype=np.int32) for b, d in blocks])
+        self.up = sparse.csr_matrix((lengths, (rows, cols)), shape=(n, n))
+        self.up.sort_indices()
+        self.down = self.up.T.tocsr()
+        self.down.sort_indices()
+
+    def rebind(self, go):
+        """The same index for the terms of a copy of its Ontology (see Ontology.copyDag)."""
+        other = Reachability.__new__(Reachability)
+        other.terms = [go.terms[t.uid] for t in self.terms]
+        other.positions = {t: i for i, t in enumerate(other.terms)}
+        other.up = self.up
+        other.down = self.down
+        return other
+
+    @staticmethod
+    def _row(matrix, i, maxDepth=None):
+        #Positions and path lengths of one row, cut at maxDepth edges
+        start, end = matrix.indptr[i], matrix.indptr[i + 1]
+        cols = matrix.indices[start:end]
+        lengths = matrix.data[start:end]
+        if maxDepth is not None:
+            keep = lengths <= maxDepth
+            cols = cols[keep]
+            lengths = lengths[keep]
+        return cols, lengths
+
+    def _terms(self, matrix, term, maxDepth):
+        cols, lengths = self._row(matrix, self.positions[term], maxDepth)
+        order = np.lexsort((cols, lengths))
+        return [(self.terms[c], int(d)) for c, d in zip(cols[order].tolist(), lengths[order].tolist())]
+
+    def ancestors(self, term, maxDepth=None):
+        """[(ancestor, path length)] of term, nearest first, up to maxDepth edges."""
+        return self._terms(self.up, term, maxDepth)
+
+    def descendants(self, term, maxDepth=None):
+        """[(descendant, path length)] of term, nearest first, down to maxDepth edges."""
+        return self._terms(self.down, term, maxDepth)
+
+    def distance(self, ancestor, term):
+        """Edges on the shortest upward path from term to ancestor (0 for itself), or None."""
+        if ancestor is term:
+            return 0
+        cols, lengths = self._row(self.up, self.positions[term])
+        pos = np.searchsorted(cols, self.positions[ancestor])
+        if pos < len(cols) and cols[pos] == self.positions[ancestor]:
+            return int(lengths[pos])
+        return None
+
+    def isAncestor(self, ancestor, term):
+        """Whether ancestor is a (strict) ancestor of term."""
+        return ancestor is not term and self.distance(ancestor, term) is not None
+
+    def _upClosure(self, idx):
+        #Positions of the terms idx and all of their ancestors
+        return np.union1d(idx, self.up[idx].indices)
+
+    def lowestCommonAncestors(self, terms):
+        """The common ancestors of terms (a term counting as its own) not above another one."""
+        common = None
+        for term in terms:
+            i = self.positions[term]
+            reach = np.union1d([i], self._row(self.up, i)[0])
+            common = reach if common is None else np.intersect1d(common, reach, assume_unique=True)
+        if common is None or len(common) == 0:
+            return []
+        #Drop every common ancestor that is above another common ancestor
+        lowest = np.setdiff1d(common, self.up[common].indices, assume_unique=False)
+        return sorted([self.terms[i] for i in lowest.tolist()], key=lambda t: t.uid)
+
+    def subgraph(self, terms):
+        """(nodes, edges, lowest common ancestors) of the minimal induced subgraph of terms.
+
+        nodes are sorted by uid; edges are (child, relation, parent) for the
+        is_a, part_of and regulates edges between nodes.
+        """
+        idx = np.unique([self.positions[t] for t in terms])
+        nodes = self._upClosure(idx)
+        lowest = self.lowestCommonAncestors(terms)
+        if len(lowest) > 0:
+            #Only the part of the closure at or below a lowest common ancestor
+            top = np.array([self.positions[t] for t in lowest])
+            below = np.union1d(top, self.down[top].indices)
+            nodes = np.intersect1d(nodes, below, assume_unique=True)
+        nodes = set([self.terms[i] for i in nodes.tolist()])
+        edges = []
+        for child in nodes:
+            for relation in EDGE_TYPES:
+                for parent in getattr(child, relation):
+                    if parent in nodes:
+                        edges.append((child, relation, parent))
+        edges.sort(key=lambda e: (e[0].uid, EDGE_TYPES.index(e[1]), e[2].uid))
+        return sorted(nodes, key=lambda t: t.uid), edges, lowest
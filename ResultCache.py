@@ -0,0 +1,69 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+class ResultCache:
+    """Thread-safe LRU cache with an entry limit and a time-to-live.
+
+    Keys are tuples whose first element is the organism name, so all
+    entries of one organism can be dropped when its data is reloaded.
+    """
+
+    def __init__(self, maxEntries=256, ttl=600):
+        self.maxEntries = maxEntries
+        self.ttl = ttl #Seconds an entry stays valid (None for no expiry)
+        self.entries = OrderedDict() #Key --> (expiry time, value), least recently used first
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        #A worker forked while another thread held the lock must not inherit it held
+        os.register_at_fork(after_in_child=self._resetLock)
+
+    def _resetLock(self):
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """Return the cached value for key, or None."""
+        with self.lock:
+            if key in self.entries:
+                expires, value = self.entries[key]
+                if expires is None or expires > time.time():
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self.entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        if self.maxEntries <= 0:
+            return
+        with self.lock:
+            expires = None if self.ttl is None else time.time() + self.ttl
+            self.entries[key] = (expires, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxEntries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, org=None):
+        """Drop every entry (or only those of one organism)."""
+        with self.lock:
+            if org is None:
+                self.entries.clear()
+            else:
+                for key in [k for k in self.entries if k[0] == org]:
+                    del self.entries[key]
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {"entries": len(self.entries),
+                    "max_entries": self.maxEntries,
+                    "ttl_seconds": self.ttl,
+                    "hits": self.hits,
+                    "misses": self.misses,
+                    "evictions": self.evictions,
+                    "hit_rate": self.hits / lookups if lookups > 0 else None}
@@ -0,0 +1,128 @@
+"""GO semantic similarity from information content over the ancestor closure.
+
+A term's information content is IC(t) = -log(p(t)), where p(t) is the
+fraction of its namespace's annotated genes that are annotated to t or
+below it. Two terms' shared information is the IC of their most
+informative common ancestor (MICA), a term counting as its own ancestor:
+
+    resnik(a, b) = IC(mica)
+    lin(a, b)    = 2 IC(mica) / (IC(a) + IC(b))
+    jc(a, b)     = 1 / (1 + IC(a) + IC(b) - 2 IC(mica))   (Jiang-Conrath distance as a similarity)
+
+Terms of different namespaces have similarity 0 under every method.
+
+Genes are compared through their direct annotations in one namespace by
+best-match average: each term's best match among the other gene's terms,
+averaged over both genes' terms and then over the two directions.
+
+For matrices, MICA values for all pairs of a term set are filled in one
+common ancestor at a time from the sparse ancestor closure, and gene
+best-match averages come from a single product of each gene's best-match
+row against the gene x term membership matrix.
+"""
+import numpy as np
+from scipy import sparse
+
+METHODS = ["resnik", "lin", "jc"]
+
+class Similarity:
+    """Information content and ancestor closure of one Ontology's terms."""
+
+    def __init__(self, go):
+        self.go = go
+        self.terms = list(go.terms.values())
+        self.positions = {t: i for i, t in enumerate(self.terms)}
+        self.ic = np.full(len(self.terms), np.nan)
+        for i, term in enumerate(self.terms):
+            population = go.popSizes.get(term.namespace, 0)
+            if term.nTotal > 0 and population > 0:
+                self.ic[i] = np.log(population / term.nTotal)
+        #Row i flags term i and its ancestors
+        rows = []
+        cols = []
+        for i, term in enumerate(self.terms):
+            rows.append(i)
+            cols.append(i)
+            for ancestor in term.ancestors:
+                rows.append(i)
+                cols.append(self.positions[ancestor])
+        self.closure = sparse.csr_matrix((np.ones(len(rows), dtype=bool), (rows, cols)),
+                                         shape=(len(self.terms), len(self.terms)))
+
+    def termIC(self, term):
+        """IC of term, or None if it has no annotations."""
+        value = self.ic[self.positions[term]]
+        return None if np.isnan(value) else float(value)
+
+    def micaMatrix(self, terms):
+        """IC of the most informative common ancestor for every pair of terms (0 if none)."""
+        idx = np.array([self.positions[t] for t in terms], dtype=np.int64)
+        result = np.zeros((len(idx), len(idx)))
+        if len(idx) == 0:
+            return result
+        #Columns: common ancestors, each with the rows (terms) below it
+        below = self.closure[idx].tocsc()
+        ic = np.nan_to_num(self.ic, nan=0.0)
+        counts = np.diff(below.indptr)
+        for col in np.flatnonzero((counts > 0) & (ic > 0)):
+            members = below.indices[below.indptr[col]:below.indptr[col + 1]]
+            block = np.ix_(members, members)
+            result[block] = np.maximum(result[block], ic[col])
+        return result
+
+    def termMatrix(self, terms, method="resnik"):
+        """Pairwise similarity of terms under method (see METHODS); NaN for unannotated terms."""
+        mica = self.micaMatrix(terms)
+        if method == "resnik":
+            result = mica
+        else:
+            ic = self.ic[[self.positions[t] for t in terms]]
+            pairs = ic[:, None] + ic[None, :]
+            namespaces = np.array([t.namespace for t in terms])
+            #Terms of different namespaces have no common ancestor
+            shared = namespaces[:, None] == namespaces[None, :]
+            with np.errstate(divide="ignore", invalid="ignore"):
+                if method == "lin":
+                    result = np.where(pairs > 0, 2 * mica / pairs, 1.0)
+                elif method == "jc":
+                    result = 1.0 / (1.0 + np.maximum(pairs - 2 * mica, 0.0))
+                else:
+                    raise ValueError("Unknown similarity method " + str(method))
+            result[~shared] = 0.0
+        unknown = np.isnan(self.ic[[self.positions[t] for t in terms]])
+        result[unknown, :] = np.nan
+        result[:, unknown] = np.nan
+        return result
+
+    def geneTerms(self, gene, namespace, codes=None):
+        """Terms of namespace that gene is directly annotated to (with codes, under those evidence codes)."""
+        result = set()
+        for code, terms in gene.direct.items():
+            if codes is None or code in codes:
+                result.update([t for t in terms if t.namespace == namespace])
+        return sorted(result, key=lambda t: t.uid)
+
+    def geneMatrix(self, genes, namespace, method="resnik", codes=None):
+        """Best-match-average similarity for every pair of genes; NaN where a gene has no terms."""
+        geneTerms = [self.geneTerms(g, namespace, codes) for g in genes]
+        terms = sorted(set([t for ts in geneTerms for t in ts]), key=lambda t: t.uid)
+        positions = {t: i for i, t in enumerate(terms)}
+        scores = np.nan_to_num(self.termMatrix(terms, method), nan=0.0)
+        rows = [i for i, ts in enumerate(geneTerms) for t in ts]
+        cols = [positions[t] for ts in geneTerms for t in ts]
+        membership = sparse.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(len(genes), len(terms)))
+        #best[i, u]: the best match of term u among gene i's terms
+        best = np.zeros((len(genes), len(terms)))
+        for i, ts in enumerate(geneTerms):
+            if len(ts) > 0:
+                best[i] = scores[[positions[t] for t in ts]].max(axis=0)
+        sizes = np.array([len(ts) for ts in geneTerms], dtype=float)
+        #toward[i, j]: mean over gene j's terms of their best match in gene i
+        toward = np.asarray(membership @ best.T).T
+        with np.errstate(divide="ignore", invalid="ignore"):
+            toward = toward / sizes[None, :]
+            result = (toward + toward.T) / 2
+        missing = sizes == 0
+        result[missing, :] = np.nan
+        result[:, missing] = np.nan
+        return result
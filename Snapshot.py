@@ -0,0 +1,216 @@
+"""Binary snapshots of a parsed Ontology.
+
+A snapshot is a directory holding a string table (strings.json), the terms,
+edges, other relationships, alt_id remappings, genes, aliases, direct
+annotations and GAF line counts as integer .npy arrays that refer to it, and the propagated annotations as the packed bitsets of the
+AnnoIndex. Snapshots live under cacheDir in a subdirectory named after a
+hash of the source files' paths, sizes and modification times (optionally
+their contents), so a changed source file selects a new snapshot and the
+stale one is removed when the new one is written.
+
+The bitset arrays are opened with mmap_mode="r": worker processes that
+load the same snapshot share those pages through the OS page cache instead
+of each holding a private copy. The Python term/gene objects are rebuilt
+from the arrays, which skips text parsing entirely.
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import numpy as np
+from Gene import Gene
+from OntoTerm import OntoTerm
+from Metrics import METRICS
+
+FORMAT_VERSION = 4
+EDGE_TYPES = ["is_a", "part_of", "regulates"]
+
+def snapshotKey(sourceFiles, hashContents=False):
+    """Hash identifying one version of the source files."""
+    digest = hashlib.sha1(("snapshot-v%d" % FORMAT_VERSION).encode("utf-8"))
+    for fileName in sourceFiles:
+        info = os.stat(fileName)
+        digest.update(os.path.abspath(fileName).encode("utf-8"))
+        if hashContents:
+            fin = open(fileName, "rb")
+            for block in iter(lambda: fin.read(1 << 20), b""):
+                digest.update(block)
+            fin.close()
+        else:
+            digest.update(("%d:%d" % (info.st_size, info.st_mtime_ns)).encode("utf-8"))
+    return digest.hexdigest()
+
+def snapshotPath(cacheDir, sourceFiles, hashContents=False):
+    return os.path.join(cacheDir, snapshotKey(sourceFiles, hashContents))
+
+
+class _StringTable:
+    def __init__(self):
+        self.strings = []
+        self.ids = {}
+
+    def id(self, value):
+        if value is None:
+            value = ""
+        if value not in self.ids:
+            self.ids[value] = len(self.strings)
+            self.strings.append(value)
+        return self.ids[value]
+
+
+def saveSnapshot(go, path, sourceFiles=()):
+    """Write go to the snapshot directory path (atomically)."""
+    table = _StringTable()
+    terms = list(go.terms.values())
+    termIds = {t: i for i, t in enumerate(terms)}
+    genes = list(go.genes.items())
+    geneIds = {g: i for i, (key, g) in enumerate(genes)}
+
+    termRows = [[table.id(t.uid), table.id(t.name), table.id(t.defn), table.id(t.namespace)] for t in terms]
+    edgeRows = []
+    for t in terms:
+        for edgeType, parents in enumerate([t.is_a, t.part_of, t.regulates]):
+            for parent in parents:
+                edgeRows.append([termIds[t], termIds[parent], edgeType])
+    geneRows = [[table.id(key), table.id(g.uid), table.id(g.symbol), table.id(g.name)] for key, g in genes]
+    relationRows = []
+    relationTypes = _StringTable()
+    for t in terms:
+        for relType in t.relationships:
+            for target in t.relationships[relType]:
+                relationRows.append([termIds[t], relationTypes.id(relType), table.id(target)])
+    altRows = [[table.id(alt), table.id(uid)] for alt, uid in go.altIds.items()]
+    aliasRows = []
+    directRows = []
+    for key, g in genes:
+        for alias in sorted(g.aliases):
+            aliasRows.append([geneIds[g], table.id(alias)])
+        for code in g.direct:
+            for t in g.direct[code]:
+                directRows.append([geneIds[g], termIds[t], table.id(code)])
+    extraRows = [[geneIds[g], termIds[t], table.id(code), n] for (g, t, code), n in go.extraLines.items()]
+
+    arrays = {
+        "terms": np.array(termRows, dtype=np.int32).reshape(-1, 4),
+        "edges": np.array(edgeRows, dtype=np.int32).reshape(-1, 3),
+        "relations": np.array(relationRows, dtype=np.int32).reshape(-1, 3),
+        "alt_ids": np.array(altRows, dtype=np.int32).reshape(-1, 2),
+        "roots": np.array([termIds[t] for t in go.roots], dtype=np.int32),
+        "genes": np.array(geneRows, dtype=np.int32).reshape(-1, 4),
+        "aliases": np.array(aliasRows, dtype=np.int32).reshape(-1, 2),
+        "direct": np.array(directRows, dtype=np.int32).reshape(-1, 3),
+        "gene_lines": np.array([g.lines for key, g in genes], dtype=np.int32),
+        "extra_lines": np.array(extraRows, dtype=np.int32).reshape(-1, 4),
+    }
+    index = go.getIndex()
+    codes = sorted(index.codeRows.keys())
+    arrays["index_genes"] = np.array([geneIds[g] for g in index.genes], dtype=np.int32)
+    arrays["index_terms"] = np.array([termIds[t] for t in index.terms], dtype=np.int32)
+    arrays["index_bits"] = index.bits
+    arrays["index_sizes"] = index.sizes
+    for i, code in enumerate(codes):
+        arrays["code_%d_rows" % i] = index.codeRows[code]
+        arrays["code_%d_bits" % i] = index.codeBits[code]
+
+    manifest = {
+        "version": FORMAT_VERSION,
+        "sources": [os.path.abspath(f) for f in sourceFiles],
+        "codes": codes,
+        "relationship_types": relationTypes.strings,
+        "releases": go.releases,
+    }
+
+    #Write into a temporary sibling directory and rename it into place, so
+    #concurrent workers never see a half-written snapshot
+    cacheDir = os.path.dirname(os.path.abspath(path))
+    os.makedirs(cacheDir, exist_ok=True)
+    tmpPath = tempfile.mkdtemp(dir=cacheDir, prefix=".tmp-")
+    for name, array in arrays.items():
+        np.save(os.path.join(tmpPath, name + ".npy"), array)
+    with open(os.path.join(tmpPath, "strings.json"), "w") as fout:
+        json.dump(table.strings, fout)
+    with open(os.path.join(tmpPath, "manifest.json"), "w") as fout:
+        json.dump(manifest, fout)
+    try:
+        os.rename(tmpPath, path)
+    except OSError:
+        #Another process finished the same snapshot first
+        shutil.rmtree(tmpPath, ignore_errors=True)
+        return
+    _removeStale(cacheDir, os.path.abspath(path), manifest["sources"])
+
+def _removeStale(cacheDir, keep, sources):
+    """Delete older snapshots built from the same source files."""
+    for name in os.listdir(cacheDir):
+        other = os.path.join(cacheDir, name)
+        if other == keep or name.startswith("."):
+            continue
+        try:
+            with open(os.path.join(other, "manifest.json")) as fin:
+                otherSources = json.load(fin).get("sources")
+        except (OSError, ValueError):
+            continue
+        if otherSources == sources:
+            shutil.rmtree(other, ignore_errors=True)
+
+@METRICS.timed("load_snapshot")
+def loadSnapshot(go, path):
+    """Fill an empty Ontology from the snapshot directory path."""
+    from AnnoIndex import AnnoIndex
+    with open(os.path.join(path, "manifest.json")) as fin:
+        manifest = json.load(fin)
+    if manifest.get("version") != FORMAT_VERSION:
+        raise ValueError("Snapshot " + path + " has an unsupported format version")
+    with open(os.path.join(path, "strings.json")) as fin:
+        strings = json.load(fin)
+
+    def load(name, mmap=False):
+        return np.load(os.path.join(path, name + ".npy"), mmap_mode="r" if mmap else None)
+
+    terms = []
+    for uid, name, defn, namespace in load("terms").tolist():
+        term = OntoTerm(strings[uid], strings[name], strings[defn])
+        term.namespace = strings[namespace]
+        go.terms[term.uid] = term
+        terms.append(term)
+    for child, parent, edgeType in load("edges").tolist():
+        getattr(terms[child], EDGE_TYPES[edgeType]).add(terms[parent])
+        terms[parent].children.add(terms[child])
+    relationTypes = manifest["relationship_types"]
+    for term, relType, target in load("relations").tolist():
+        relationships = terms[term].relationships
+        if relationTypes[relType] not in relationships:
+            relationships[relationTypes[relType]] = set()
+        relationships[relationTypes[relType]].add(strings[target])
+    for alt, uid in load("alt_ids").tolist():
+        go.altIds[strings[alt]] = strings[uid]
+    go.roots = [terms[i] for i in load("roots").tolist()]
+    go.buildClosure()
+    go.freezeDag()
+
+    genes = []
+    for key, uid, symbol, name in load("genes").tolist():
+        gene = Gene(strings[uid], strings[symbol], strings[name])
+        go.genes[strings[key]] = gene
+        genes.append(gene)
+    for gene, alias in load("aliases").tolist():
+        genes[gene].aliases.add(strings[alias])
+    for gene, term, code in load("direct").tolist():
+        terms[term].annotateDirect(genes[gene], strings[code])
+    for gene, lines in zip(genes, load("gene_lines").tolist()):
+        gene.lines = lines
+    for gene, term, code, n in load("extra_lines").tolist():
+        go.extraLines[(genes[gene], terms[term], strings[code])] = n
+    codes = manifest["codes"]
+    #The saved bitsets already hold the propagated annotations: no propagation pass
+    go.index = AnnoIndex.fromArrays([genes[i] for i in load("index_genes").tolist()],
+                                    [terms[i] for i in load("index_terms").tolist()],
+                                    load("index_bits", mmap=True), load("index_sizes"),
+                                    {code: load("code_%d_rows" % i) for i, code in enumerate(codes)},
+                                    {code: load("code_%d_bits" % i, mmap=True) for i, code in enumerate(codes)})
+    go.index.attach(go)
+    go.computeCounts()
+    go.buildNameIndex()
+    go.encodeFragments()
+    go.releases.update(manifest["releases"])
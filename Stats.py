@@ -0,0 +1,25 @@
+import numpy as np
+import scipy.stats as stats
+from scipy.stats import rankdata
+
+def hypergeomUpperTail(overlaps, termSizes, querySize, totalGenes):
+    """P(X >= overlap) for every term in one vectorized survival-function call.
+
+    Equivalent to summing hypergeom(totalGenes, termSize, querySize).pmf(x)
+    for x from the overlap size up to the query size, as
+    OntoTerm.hyperGeomEnrich does for a single term. querySize and totalGenes
+    may be scalars or arrays aligned with overlaps.
+    """
+    overlaps = np.asarray(overlaps, dtype=np.int64)
+    return stats.hypergeom.sf(overlaps - 1, totalGenes, termSizes, querySize)
+
+def bhAdjust(pvals):
+    """Benjamini-Hochberg FDR for an array of p-values, capped at 1."""
+    pvals = np.asarray(pvals, dtype=float)
+    if len(pvals) == 0:
+        return pvals
+    n_tests = len(pvals)
+    ranked_p_values = rankdata(pvals)
+    fdr = pvals * n_tests / ranked_p_values
+    fdr[fdr > 1] = 1  # Cap FDR at 1
+    return fdr
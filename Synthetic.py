@@ -0,0 +1,173 @@
+"""Synthetic GO-like OBO and GAF files for benchmarks.
+
+makeDag lays out nTerms terms below the three GO roots, one level at a
+time down to depth: every term has a parent on the level just above it
+(so the DAG really is that deep) and up to fanIn parents in all, the
+extra ones drawn from any level above in the same namespace. Edges are
+mostly is_a with some part_of and (in biological_process) regulates, and
+a few terms are obsolete or have alt_ids, as in a real release.
+
+writeGaf annotates nGenes genes to about annotationsPerGene terms each,
+with term popularity and evidence codes skewed the way real files are,
+plus a few NOT, alt_id and shared-alias lines. Output depends only on
+the arguments, so a fixture can be regenerated anywhere.
+
+    python Synthetic.py outDir --terms 45000 --genes 20000
+"""
+import argparse
+import os
+import random
+
+#(namespace, root id, aspect, share of the terms)
+NAMESPACES = [("biological_process", "GO:0008150", "P", 0.6),
+              ("molecular_function", "GO:0003674", "F", 0.25),
+              ("cellular_component", "GO:0005575", "C", 0.15)]
+#Evidence codes and their relative frequency
+EVIDENCE_CODES = [("IEA", 45), ("IBA", 10), ("IDA", 10), ("IMP", 8), ("IPI", 8), ("ISS", 6),
+                  ("IGI", 4), ("TAS", 4), ("HDA", 3), ("EXP", 2)]
+
+
+class SyntheticDag:
+    """Terms of a generated ontology, before it is written out."""
+
+    def __init__(self, seed):
+        self.seed = seed
+        self.terms = [] #(uid, namespace index, level), roots first
+        self.parents = {} #uid --> [(relationship, parent uid)]
+        self.altIds = {} #uid --> [alt_id]
+        self.obsolete = {} #Obsolete uid --> replaced_by uid
+
+def makeDag(nTerms=10000, depth=12, fanIn=3, seed=0):
+    """A SyntheticDag of about nTerms live terms, depth levels and at most fanIn parents per term."""
+    rng = random.Random(seed)
+    dag = SyntheticDag(seed)
+    nextId = [1000000]
+
+    def newId():
+        nextId[0] += 1
+        return "GO:%07d" % nextId[0]
+
+    for ns, (namespace, root, aspect, share) in enumerate(NAMESPACES):
+        dag.terms.append((root, ns, 0))
+        dag.parents[root] = []
+        levels = [[root]]
+        count = max(depth, int(round((nTerms - len(NAMESPACES)) * share)))
+        #Wider levels further down, like GO
+        weights = [1.5 ** level for level in range(1, depth + 1)]
+        scale = count / sum(weights)
+        for level in range(1, depth + 1):
+            width = max(1, int(round(weights[level - 1] * scale)))
+            current = []
+            for _ in range(width):
+                uid = newId()
+                parents = [rng.choice(levels[level - 1])]
+                extra = min(fanIn - 1, int(rng.expovariate(1.5)))
+                for _ in range(extra):
+                    candidate = rng.choice(levels[rng.randrange(level)])
+                    if candidate not in parents:
+                        parents.append(candidate)
+                edges = []
+                for parent in parents:
+                    draw = rng.random()
+                    if draw < 0.04 and namespace == "biological_process":
+                        edges.append((rng.choice(["regulates", "positively_regulates", "negatively_regulates"]), parent))
+                    elif draw < 0.2:
+                        edges.append(("part_of", parent))
+                    else:
+                        edges.append(("is_a", parent))
+                dag.terms.append((uid, ns, level))
+                dag.parents[uid] = edges
+                if rng.random() < 0.02:
+                    dag.altIds[uid] = [newId()]
+                current.append(uid)
+            levels.append(current)
+    live = [uid for uid, ns, level in dag.terms if level > 0]
+    for _ in range(len(live) // 100):
+        dag.obsolete[newId()] = rng.choice(live)
+    return dag
+
+def writeObo(fileName, dag):
+    """Write dag as an OBO 1.2 file."""
+    namespaces = {uid: NAMESPACES[ns][0] for uid, ns, level in dag.terms}
+    with open(fileName, "w") as fout:
+        fout.write("format-version: 1.2\n")
+        fout.write("data-version: synthetic/%d-terms/seed-%d\n" % (len(dag.terms), dag.seed))
+        fout.write("ontology: go\n\n")
+        for uid, ns, level in dag.terms:
+            name = NAMESPACES[ns][0] if level == 0 else "synthetic term %s" % uid[3:]
+            fout.write("[Term]\nid: %s\nname: %s\nnamespace: %s\n" % (uid, name, namespaces[uid]))
+            for alt in dag.altIds.get(uid, []):
+                fout.write("alt_id: %s\n" % alt)
+            fout.write('def: "Level %d term of the synthetic %s DAG." [GOC:synthetic]\n' % (level, namespaces[uid]))
+            for relationship, parent in dag.parents[uid]:
+                if relationship == "is_a":
+                    fout.write("is_a: %s\n" % parent)
+                else:
+                    fout.write("relationship: %s %s\n" % (relationship, parent))
+            fout.write("\n")
+        for uid, replacement in dag.obsolete.items():
+            fout.write("[Term]\nid: %s\nname: obsolete synthetic term\nnamespace: %s\nis_obsolete: true\n"
+                       "replaced_by: %s\n\n" % (uid, namespaces[replacement], replacement))
+
+def writeGaf(fileName, dag, nGenes=6000, annotationsPerGene=8, seed=0):
+    """Write a GAF 2.2 file annotating nGenes genes to the terms of dag."""
+    rng = random.Random(seed)
+    #Popular terms first; deeper terms are more likely to be annotated directly
+    annotatable = [(uid, ns, level) for uid, ns, level in dag.terms if level > 0]
+    rng.shuffle(annotatable)
+    annotatable.sort(key=lambda t: -t[2] * rng.random())
+    obsolete = list(dag.obsolete)
+    codes = [code for code, weight in EVIDENCE_CODES]
+    codeWeights = [weight for code, weight in EVIDENCE_CODES]
+    with open(fileName, "w") as fout:
+        fout.write("!gaf-version: 2.2\n")
+        fout.write("!date-generated: synthetic-%d-genes-seed-%d\n" % (nGenes, seed))
+        fout.write("!generated-by: Synthetic.py\n")
+        for g in range(nGenes):
+            symbol = "SYN%05d" % g
+            aliases = ["ALIAS%05d" % g, "syn%05d_orf" % g]
+            if g % 100 == 1:
+                aliases.append("ALIAS%05d" % (g - 1)) #Alias shared with another gene (ambiguous)
+            for _ in range(max(1, int(rng.expovariate(1.0 / annotationsPerGene)))):
+                if len(obsolete) > 0 and rng.random() < 0.005:
+                    uid = rng.choice(obsolete)
+                    ns = 0
+                else:
+                    uid, ns, level = annotatable[min(len(annotatable) - 1, int(len(annotatable) * rng.random() ** 3))]
+                    if uid in dag.altIds and rng.random() < 0.1:
+                        uid = dag.altIds[uid][0]
+                qualifier = "NOT" if rng.random() < 0.01 else ""
+                code = rng.choices(codes, codeWeights)[0]
+                fout.write("\t".join(["SYN", "SYN:%07d" % g, symbol, qualifier, uid, "PMID:%d" % rng.randrange(10 ** 7),
+                                      code, "", NAMESPACES[ns][2], "synthetic protein %d" % g, "|".join(aliases),
+                                      "protein", "taxon:32644", "20200101", "SYN", "", ""]) + "\n")
+
+def generate(outDir, nTerms=10000, depth=12, fanIn=3, nGenes=6000, annotationsPerGene=8, seed=0):
+    """Write (or reuse) the OBO and GAF files for these settings in outDir; returns their paths."""
+    os.makedirs(outDir, exist_ok=True)
+    stem = "synthetic-t%d-d%d-f%d-s%d" % (nTerms, depth, fanIn, seed)
+    oboFileName = os.path.join(outDir, stem + ".obo")
+    annoFileName = os.path.join(outDir, stem + "-g%d-a%d.gaf" % (nGenes, annotationsPerGene))
+    dag = None
+    if not os.path.exists(oboFileName):
+        dag = makeDag(nTerms, depth, fanIn, seed)
+        writeObo(oboFileName + ".tmp", dag)
+        os.replace(oboFileName + ".tmp", oboFileName)
+    if not os.path.exists(annoFileName):
+        dag = dag or makeDag(nTerms, depth, fanIn, seed)
+        writeGaf(annoFileName + ".tmp", dag, nGenes, annotationsPerGene, seed)
+        os.replace(annoFileName + ".tmp", annoFileName)
+    return oboFileName, annoFileName
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Write a synthetic GO-like OBO file and GAF file.")
+    parser.add_argument("outDir")
+    parser.add_argument("--terms", type=int, default=10000)
+    parser.add_argument("--depth", type=int, default=12)
+    parser.add_argument("--fan-in", type=int, default=3)
+    parser.add_argument("--genes", type=int, default=6000)
+    parser.add_argument("--annotations", type=int, default=8, help="mean direct annotations per gene")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    for path in generate(args.outDir, args.terms, args.depth, args.fan_in, args.genes, args.annotations, args.seed):
+        print(path)
@@ -0,0 +1,93 @@
+"""Topology-aware enrichment in the style of topGO's elim and weight algorithms.
+
+Both visit the candidate terms once, bottom-up: terms are grouped by
+height (longest path down to a candidate leaf), so every term is scored
+after all of its children, and the terms of one height are scored
+together in a single vectorized call.
+
+elim: genes of a term that is significant at cutoff are removed from all
+of its ancestors before those are tested, so a signal is reported at the
+most specific term instead of spreading to every ancestor.
+
+weight: a term's genes that also belong to a more significant child are
+down-weighted by the ratio of the two significances (-log10 p), and the
+term is retested on the weighted counts. Unlike topGO, children are not
+re-evaluated afterwards, which keeps it to a single sweep.
+"""
+import numpy as np
+from AnnoIndex import popcount
+from Stats import hypergeomUpperTail
+
+def heightLevels(terms):
+    """Return (children, levels) for a list of terms.
+
+    children[i] lists the positions of term i's children within terms;
+    levels lists the positions of the terms of each height, leaves first.
+    """
+    positions = {t: i for i, t in enumerate(terms)}
+    children = [[positions[c] for c in t.children if c in positions] for t in terms]
+    heights = [None] * len(terms)
+
+    def height(i):
+        if heights[i] is None:
+            heights[i] = 1 + max([height(c) for c in children[i]]) if len(children[i]) > 0 else 0
+        return heights[i]
+
+    levels = {}
+    for i in range(len(terms)):
+        levels.setdefault(height(i), []).append(i)
+    return children, [np.array(levels[h], dtype=np.int64) for h in sorted(levels)]
+
+def elim(terms, bits, qBits, querySizes, totalGenes, cutoff=0.01):
+    """elim p-values for terms (rows of the packed bitset matrix bits).
+
+    Returns (pvals, effective) where effective holds each term's genes
+    left after elimination.
+    """
+    children, levels = heightLevels(terms)
+    excluded = np.zeros_like(bits)
+    effective = np.zeros_like(bits)
+    pvals = np.ones(len(terms))
+    for level in levels:
+        for i in level:
+            for c in children[i]:
+                excluded[i] |= excluded[c]
+                if pvals[c] < cutoff:
+                    excluded[i] |= bits[c]
+        effective[level] = bits[level] & ~excluded[level]
+        pvals[level] = hypergeomUpperTail(popcount(effective[level] & qBits), popcount(effective[level]),
+                                          querySizes[level], totalGenes[level])
+    return pvals, effective
+
+def _flags(bits):
+    return np.unpackbits(np.ascontiguousarray(bits, dtype="<u8").view(np.uint8), bitorder="little").astype(bool)
+
+def weight(terms, bits, qBits, querySizes, totalGenes, pvals):
+    """weight p-values for terms, given their unweighted p-values."""
+    children, levels = heightLevels(terms)
+    sig0 = -np.log10(np.maximum(pvals, 1e-300))
+    result = np.array(pvals, dtype=float)
+    sig = sig0.copy()
+    qFlags = _flags(qBits)
+    for level in levels:
+        overlaps = np.zeros(len(level))
+        sizes = np.zeros(len(level))
+        reweighted = np.zeros(len(level), dtype=bool)
+        for j, i in enumerate(level):
+            stronger = [c for c in children[i] if sig[c] > sig0[i]]
+            if len(stronger) == 0:
+                continue
+            factors = np.ones(len(qFlags))
+            for c in stronger:
+                factors[_flags(bits[c])] *= sig0[i] / sig[c]
+            flags = _flags(bits[i])
+            sizes[j] = factors[flags].sum()
+            overlaps[j] = factors[flags & qFlags].sum()
+            reweighted[j] = True
+        if reweighted.any():
+            rows = level[reweighted]
+            result[rows] = hypergeomUpperTail(np.rint(overlaps[reweighted]).astype(np.int64),
+                                              np.rint(sizes[reweighted]).astype(np.int64),
+                                              querySizes[rows], totalGenes[rows])
+            sig[rows] = -np.log10(np.maximum(result[rows], 1e-300))
+    return result
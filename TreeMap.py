@@ -0,0 +1,60 @@
+"""Treemap/sunburst layouts of the GO DAG below a term.
+
+GO is a DAG, so a term below several parents appears once per path that
+reaches it. A TreeMap builds each (term, remaining depth) subtree once and
+shares it between all of those paths, reading annotation counts from the
+counts cached on the terms instead of rebuilding annotation sets.
+"""
+
+class TreeMap:
+    """Memoized treemap layouts for one Ontology and evidence-code filter.
+
+    codes limits the counts to annotations with those evidence codes (None
+    for all); with withAnno, terms without annotations are left out.
+    """
+
+    def __init__(self, codes=None, withAnno=True):
+        self.codes = codes
+        self.withAnno = withAnno
+        self.nodes = {} #(Term, depth) --> nested node, shared by every path reaching it
+        self.sizes = {} #Term --> annotation count under codes
+
+    def size(self, term):
+        if self.codes is None:
+            return term.nTotal
+        if term not in self.sizes:
+            self.sizes[term] = len(term.allAnnos(self.codes))
+        return self.sizes[term]
+
+    def nested(self, term, depth=6):
+        """{name, uid, size, kids} for term and its descendants down to depth levels."""
+        key = (term, depth)
+        if key not in self.nodes:
+            kids = []
+            if depth > 0:
+                for kid in sorted(term.children, key=lambda t: t.uid):
+                    if not self.withAnno or self.size(kid) > 0:
+                        kids.append(self.nested(kid, depth - 1))
+            self.nodes[key] = {'name': term.name, 'uid': term.uid, 'size': self.size(term), 'kids': kids}
+        return self.nodes[key]
+
+    def flat(self, term, depth=6):
+        """The same tree as parallel id/label/parent/value columns (Plotly treemap/sunburst input).
+
+        Ids are paths of term uids from term ("GO:1/GO:2/GO:3"), so a term
+        reached through several parents gets one distinct, stable id per path.
+        """
+        table = {'ids': [], 'uids': [], 'labels': [], 'parents': [], 'values': []}
+
+        def add(node, parentId):
+            nodeId = node['uid'] if parentId == "" else parentId + "/" + node['uid']
+            table['ids'].append(nodeId)
+            table['uids'].append(node['uid'])
+            table['labels'].append(node['name'])
+            table['parents'].append(parentId)
+            table['values'].append(node['size'])
+            for kid in node['kids']:
+                add(kid, nodeId)
+
+        add(self.nested(term, depth), "")
+        return table
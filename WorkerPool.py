@@ -0,0 +1,166 @@
+"""Process pool whose workers are forked from the loaded server.
+
+Workers are created with fork after the Ontologies are loaded, so they
+share the parent's term, gene and bitset pages copy-on-write instead of
+each parsing and holding their own copy, and enrichment runs outside the
+parent's GIL. gc.freeze() is called just before forking so that the
+collector in the workers never touches (and so never copies) the pages
+holding the inherited objects.
+
+call() runs one request's work in the pool behind a bounded admission
+queue: at most maxPending calls are running or waiting at a time, and
+further calls are refused at once with Saturated rather than queued
+without limit.
+"""
+import collections
+import gc
+import multiprocessing
+import os
+import signal
+import threading
+
+#Object whose methods the workers call; inherited by the workers through fork
+_target = None
+
+def _initWorker():
+    #Workers inherit the server's signal handlers; let the pool stop them normally
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if hasattr(signal, "SIGHUP"):
+        signal.signal(signal.SIGHUP, signal.SIG_DFL)
+
+class Saturated(Exception):
+    """The admission queue is full; the caller should retry later."""
+
+class DeadlineExceeded(Exception):
+    """The call did not finish within its deadline (it may still be running in a worker)."""
+
+def _call(task):
+    #task is (name of a _target method or a module-level function, args)
+    fn, args = task
+    if isinstance(fn, str):
+        fn = getattr(_target, fn)
+    return fn(*args)
+
+
+class WorkerPool:
+    """Runs calls to target's methods in forked worker processes.
+
+    The pool is forked lazily and re-forked whenever the caller's key
+    changes (for example when an organism is loaded or reloaded), so
+    workers always see the data the parent has. With processes=0, where
+    fork is unavailable, or inside a worker, calls run serially in the
+    calling thread.
+    """
+
+    def __init__(self, target, processes=None, maxPending=None):
+        self.target = target
+        self.processes = processes if processes is not None else os.cpu_count()
+        if "fork" not in multiprocessing.get_all_start_methods():
+            self.processes = 0
+        #Admission slots for call(), released when the call finishes in its worker
+        self.maxPending = maxPending
+        self.slots = threading.BoundedSemaphore(maxPending) if maxPending else None
+        self.pending = 0
+        self.pool = None
+        self.key = None #Key the current pool was forked for
+        self.pid = os.getpid() #Forked copies of this object must not use the pool
+        self.lock = threading.Lock()
+
+    def call(self, fn, args, key=None, timeout=None):
+        """Return fn(*args) run in a worker; fn is a target method name or a module-level function.
+
+        Raises Saturated without waiting if maxPending calls are already
+        admitted, and DeadlineExceeded after timeout seconds. Without worker
+        processes the call runs in the calling thread, still admitted
+        through the same slots.
+        """
+        if self.slots is not None and not self.slots.acquire(blocking=False):
+            raise Saturated()
+        with self.lock:
+            self.pending += 1
+        try:
+            pool = self._poolFor(key)
+        except BaseException:
+            self._release()
+            raise
+        if pool is None:
+            try:
+                return _call((getattr(self.target, fn) if isinstance(fn, str) else fn, tuple(args)))
+            finally:
+                self._release()
+        result = pool.apply_async(_call, ((fn, tuple(args)),),
+                                  callback=self._release, error_callback=self._release)
+        try:
+            return result.get(timeout)
+        except multiprocessing.TimeoutError:
+            raise DeadlineExceeded()
+
+    def _release(self, result=None):
+        with self.lock:
+            self.pending -= 1
+        if self.slots is not None:
+            self.slots.release()
+
+    def imap(self, methodName, argsList, key=None):
+        """Yield target.methodName(*args) for each args, in completion order."""
+        pool = self._poolFor(key)
+        if pool is None:
+            method = getattr(self.target, methodName)
+            for args in argsList:
+                yield method(*args)
+            return
+        for result in pool.imap_unordered(_call, [(methodName, tuple(args)) for args in argsList]):
+            yield result
+
+    def imapOrdered(self, fn, argsIter, key=None, window=None):
+        """Yield fn(*args) for each args in order, with at most window calls in flight.
+
+        fn is a target method name or a module-level function. argsIter is
+        consumed lazily, so a caller that stops iterating early only
+        leaves the calls already in flight behind.
+        """
+        pool = self._poolFor(key)
+        if pool is None:
+            if isinstance(fn, str):
+                fn = getattr(self.target, fn)
+            for args in argsIter:
+                yield fn(*args)
+            return
+        window = window if window is not None else 2 * self.processes
+        pending = collections.deque()
+        for args in argsIter:
+            pending.append(pool.apply_async(_call, ((fn, tuple(args)),)))
+            if len(pending) >= window:
+                yield pending.popleft().get()
+        while len(pending) > 0:
+            yield pending.popleft().get()
+
+    def _poolFor(self, key):
+        if self.processes <= 0 or os.getpid() != self.pid:
+            return None
+        with self.lock:
+            if self.pool is not None and self.key == key:
+                return self.pool
+            if self.pool is not None:
+                #Running tasks finish; the old workers exit when idle
+                self.pool.close()
+            global _target
+            _target = self.target
+            gc.collect()
+            gc.freeze()
+            try:
+                self.pool = multiprocessing.get_context("fork").Pool(self.processes, initializer=_initWorker)
+            finally:
+                #Only the workers need the frozen heap; the parent keeps collecting
+                gc.unfreeze()
+            self.key = key
+            return self.pool
+
+    def close(self):
+        with self.lock:
+            if self.pool is not None:
+                self.pool.terminate()
+                self.pool.join()
+                self.pool = None
+                self.key = None
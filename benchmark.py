@@ -0,0 +1,665 @@
+"""Performance benchmarks for the CherryPyGO enrichment code.
+
+Run with `python benchmark.py [name ...]`. Each benchmark prints one JSON
+record per measurement so results can be compared between versions.
+
+`python benchmark.py suite` runs the standard suite on synthetic fixtures
+(see Synthetic.py) and on the real files found in this directory, each in
+a fresh process so its peak RSS is its own; `python benchmark.py compare
+old.jsonl new.jsonl` flags the measurements that got slower or bigger.
+`python benchmark.py memory obo gaf` reports the resident memory of one
+loaded organism and the bytes held per term and per gene object;
+`python benchmark.py diff obo gaf 1000` times an in-place annotation diff
+against reloading the patched file.
+"""
+import gc
+import json
+import os
+import random
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from types import MappingProxyType
+import numpy as np
+from Gene import Gene
+from OntoTerm import OntoTerm
+from Ontology import Ontology
+from Parsers import ParseDiagnostics, iterGafRecords, iterOboStanzas, openText
+from Stats import hypergeomUpperTail
+from WorkerPool import WorkerPool
+from Fragments import encodeJSON
+from Metrics import METRICS
+from OrganismRegistry import OrganismRegistry
+from ResultCache import ResultCache
+import Synthetic
+
+def _timeit(fn, repeat=3):
+    """Best wall-clock time of fn() over a few runs, in seconds."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def benchHypergeom(querySizes=(10, 100, 500, 2000), nTerms=2000, totalGenes=6000, loopTerms=25, seed=0):
+    """Per-term pmf loop (OntoTerm.hyperGeomTail) vs one vectorized sf call.
+
+    The loop is only timed on loopTerms terms and scaled to nTerms, since a
+    2,000-gene query takes thousands of pmf calls per term.
+    """
+    rng = np.random.default_rng(seed)
+    records = []
+    for querySize in querySizes:
+        termSizes = rng.integers(1, totalGenes // 10, size=nTerms)
+        overlaps = np.minimum(rng.integers(1, querySize + 1, size=nTerms), np.minimum(termSizes, querySize))
+        loopTime = _timeit(lambda: [OntoTerm.hyperGeomTail(int(overlaps[i]), int(termSizes[i]), querySize, totalGenes)
+                                    for i in range(loopTerms)], repeat=1) * nTerms / loopTerms
+        vectorTime = _timeit(lambda: hypergeomUpperTail(overlaps, termSizes, querySize, totalGenes))
+        loopVals = np.array([OntoTerm.hyperGeomTail(int(overlaps[i]), int(termSizes[i]), querySize, totalGenes)
+                             for i in range(loopTerms)])
+        vectorVals = hypergeomUpperTail(overlaps[:loopTerms], termSizes[:loopTerms], querySize, totalGenes)
+        relDiff = np.max(np.abs(loopVals - vectorVals) / np.maximum(np.abs(loopVals), 1e-300))
+        records.append({"benchmark": "hypergeom", "query_size": querySize, "terms": nTerms,
+                        "loop_seconds": loopTime, "vectorized_seconds": vectorTime,
+                        "speedup": loopTime / vectorTime, "max_rel_diff": float(relDiff)})
+    return records
+
+def _legacyLoadAnnoFile(go, annoFileName):
+    """The original loader: recursive OntoTerm.annotate for every GAF line."""
+    fin = open(annoFileName, "r")
+    for line in fin:
+        if line[0] != "!":
+            parts = line.strip().split("\t")
+            if parts[2] not in go.genes:
+                go.genes[parts[2]] = Gene(parts[1], parts[2], parts[9], set(parts[10].split("|")))
+            g = go.genes[parts[2]]
+            if "NOT" not in parts[3] and parts[4] in go.terms:
+                go.terms[parts[4]].annotate(g, parts[6])
+    fin.close()
+
+def _annoUids(term):
+    return {code: set(g.uid for g in genes) for code, genes in term.annos.items()}
+
+def benchLoad(oboFileName="go.obo", annoFileName="gene_association.sgd"):
+    """Annotation load time: recursive per-line propagation vs the bulk closure pass."""
+    start = time.perf_counter()
+    legacy = Ontology(oboFileName)
+    oboTime = time.perf_counter() - start
+    start = time.perf_counter()
+    _legacyLoadAnnoFile(legacy, annoFileName)
+    legacyTime = time.perf_counter() - start
+    go = Ontology(oboFileName)
+    start = time.perf_counter()
+    go.loadAnnoFile(annoFileName)
+    bulkTime = time.perf_counter() - start
+    same = all(_annoUids(legacy.terms[uid]) == _annoUids(go.terms[uid]) for uid in go.terms)
+    return [{"benchmark": "load", "obo_file": oboFileName, "anno_file": annoFileName,
+             "obo_seconds": oboTime, "legacy_anno_seconds": legacyTime,
+             "bulk_anno_seconds": bulkTime, "identical": same}]
+
+def _legacyLoadOboFile(go, oboFileName):
+    """The original fixed-offset OBO loader, kept here for comparison."""
+    fin = open(oboFileName, "r")
+    interm = False
+    uid = name = defn = ""
+    is_a, part_of, regulates = set(), set(), set()
+    for line in fin:
+        line = line.strip()
+        if line == "":
+            if interm:
+                if uid not in go.terms:
+                    go.terms[uid] = OntoTerm(uid, name, defn, is_a)
+                else:
+                    term = go.terms[uid]
+                    term.name, term.defn = name, defn
+                    term.is_a, term.part_of, term.regulates = is_a, part_of, regulates
+                if len(go.terms[uid].parents()) == 0:
+                    go.roots.append(go.terms[uid])
+            interm = False
+        elif line == "[Term]":
+            interm = True
+            uid = name = defn = ""
+            is_a, part_of, regulates = set(), set(), set()
+        elif interm:
+            if line[0:3] == "id:":
+                uid = line[4:]
+            elif line[0:5] == "name:":
+                name = line[6:]
+            elif line[0:4] == "def:":
+                defn = line[5:]
+            elif line[0:12] == "is_obsolete:":
+                interm = False
+            elif line[0:5] == "is_a:":
+                is_a.add(go.terms.setdefault(line[6:16], OntoTerm(line[6:16])))
+            elif line[0:21] == "relationship: part_of":
+                part_of.add(go.terms.setdefault(line[22:32], OntoTerm(line[22:32])))
+            elif line[0:23] == "relationship: regulates":
+                regulates.add(go.terms.setdefault(line[24:34], OntoTerm(line[24:34])))
+            elif line[0:34] in ("relationship: positively_regulates", "relationship: negatively_regulates"):
+                regulates.add(go.terms.setdefault(line[35:45], OntoTerm(line[35:45])))
+    fin.close()
+    for term in go.terms.values():
+        for parent in term.parents():
+            parent.children.add(term)
+
+def _countLines(fileName):
+    fin = open(fileName, "rb")
+    count = sum(1 for _ in fin)
+    fin.close()
+    return count
+
+def benchParse(oboFileName="go.obo", annoFileName="gene_association.sgd"):
+    """Lines per second: original loaders vs the streaming Parsers layer."""
+    oboLines = _countLines(oboFileName)
+    legacyTime = _timeit(lambda: _legacyLoadOboFile(Ontology(), oboFileName), repeat=1)
+    go = Ontology()
+    streamTime = _timeit(lambda: go.loadOboFile(oboFileName), repeat=1)
+    #The new loader also builds the ancestor closure, which the old one never did
+    closureTime = _timeit(go.buildClosure, repeat=1)
+    tokenizeTime = _timeit(lambda: [None for _ in iterOboStanzas(oboFileName, ParseDiagnostics(oboFileName))])
+    records = [{"benchmark": "parse", "file": oboFileName, "lines": oboLines,
+                "legacy_lines_per_second": oboLines / legacyTime,
+                "streaming_lines_per_second": oboLines / (streamTime - closureTime),
+                "streaming_tokenize_lines_per_second": oboLines / tokenizeTime,
+                "closure_seconds": closureTime}]
+
+    def legacyGaf():
+        fin = open(annoFileName, "r")
+        for line in fin:
+            if line[0] != "!":
+                line.strip().split("\t")
+        fin.close()
+
+    def streamGaf():
+        for _ in iterGafRecords(annoFileName, ParseDiagnostics(annoFileName)):
+            pass
+
+    annoLines = _countLines(annoFileName)
+    records.append({"benchmark": "parse", "file": annoFileName, "lines": annoLines,
+                    "legacy_lines_per_second": annoLines / _timeit(legacyGaf),
+                    "streaming_lines_per_second": annoLines / _timeit(streamGaf)})
+    return records
+
+class _BatchTarget:
+    def __init__(self, go):
+        self.go = go
+
+    def score(self, names):
+        return len(self.go.enrichByGeneNames(names))
+
+def benchBatch(oboFileName="go.obo", annoFileName="gene_association.sgd", nLists=200, listSize=50, seed=0):
+    """Gene lists per second scored serially vs by forked WorkerPools of growing size."""
+    go = Ontology(oboFileName, annoFileName)
+    rng = np.random.default_rng(seed)
+    names = sorted(go.genes)
+    lists = [[[names[i] for i in rng.choice(len(names), size=min(listSize, len(names)), replace=False)]]
+             for _ in range(nLists)]
+    target = _BatchTarget(go)
+    records = []
+    sizes = [0] + [n for n in (1, 2, 4, 8, 16) if n <= (os.cpu_count() or 1)]
+    for processes in sizes:
+        pool = WorkerPool(target, processes)
+        list(pool.imap("score", lists[:1])) #Fork outside the timed region
+        elapsed = _timeit(lambda: list(pool.imap("score", lists)), repeat=1)
+        pool.close()
+        records.append({"benchmark": "batch", "processes": processes, "lists": nLists,
+                        "list_size": listSize, "lists_per_second": nLists / elapsed})
+    return records
+
+def benchEncode(oboFileName="go.obo", annoFileName="gene_association.sgd", seed=0):
+    """Encoding an /enrich result list: json.dumps of toJSON() dicts vs spliced fragments.
+
+    "typical" is 50 genes drawn from one term of about 200 genes, filtered
+    at 0.05; "worst" is a random third of all genes with every candidate
+    term returned.
+    """
+    go = Ontology(oboFileName, annoFileName)
+    rng = np.random.default_rng(seed)
+    names = sorted(go.genes)
+    term = min([t for t in go.terms.values() if t.nTotal > 0], key=lambda t: abs(t.nTotal - 200))
+    members = sorted([g.symbol for g in term.allAnnos()])
+    typical = [members[i] for i in rng.choice(len(members), size=min(50, len(members)), replace=False)]
+    worst = [names[i] for i in rng.choice(len(names), size=len(names) // 3, replace=False)]
+    records = []
+    for case, query, threshold in (("typical", typical, 0.05), ("worst", worst, 1.0)):
+        results = [r for r in go.enrichByGeneNames(query) if r.pval <= threshold]
+
+        def legacy():
+            return json.dumps({"threshold": threshold, "enriched_terms": [r.toJSON() for r in results]})
+
+        def spliced():
+            for r in results:
+                r.jsonFragment = None
+            return encodeJSON({"threshold": threshold, "enriched_terms": [r.toJSONFragment() for r in results]})
+
+        def cached():
+            return encodeJSON({"threshold": threshold, "enriched_terms": [r.toJSONFragment() for r in results]})
+
+        legacyTime = _timeit(legacy)
+        records.append({"benchmark": "encode", "case": case, "query_size": len(query),
+                        "results": len(results), "bytes": len(legacy()),
+                        "json_dumps_seconds": legacyTime,
+                        "fragments_seconds": _timeit(spliced),
+                        "cached_fragments_seconds": _timeit(cached),
+                        "identical": legacy() == spliced()})
+    return records
+
+#Synthetic fixture settings (see Synthetic.generate), smallest first
+SUITE_FIXTURES = {
+    "small": {"nTerms": 2000, "depth": 8, "fanIn": 3, "nGenes": 1000, "annotationsPerGene": 6},
+    "medium": {"nTerms": 10000, "depth": 12, "fanIn": 3, "nGenes": 6000, "annotationsPerGene": 8},
+    "large": {"nTerms": 45000, "depth": 16, "fanIn": 4, "nGenes": 20000, "annotationsPerGene": 12},
+}
+#Real releases used when present: (fixture name, OBO file, GAF file)
+REAL_FIXTURES = [("sgd", "go.obo", "gene_association.sgd"), ("mgi", "go.obo", "gene_association.mgi")]
+#Fields that identify a measurement when comparing two runs
+RECORD_KEYS = ["benchmark", "fixture", "measure", "case", "query_size", "format", "processes"]
+
+def _peakRSS():
+    """Peak resident set size of this process in MB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+def _currentRSS():
+    """Resident set size of this process in MB (the peak where /proc is unavailable)."""
+    try:
+        with open("/proc/self/statm") as fin:
+            return int(fin.read().split()[1]) * resource.getpagesize() / 2**20
+    except OSError:
+        return _peakRSS()
+
+_OWNED = (str, dict, set, frozenset, tuple, list, MappingProxyType)
+
+def _objectBytes(objects, seen=None):
+    """Bytes of objects plus the strings and containers they hold, each counted once.
+
+    Other terms and genes reached through those containers are not followed,
+    so shared parent sets, interned codes and empty singletons count only
+    for the first object holding them.
+    """
+    seen = set() if seen is None else seen
+    total = 0
+    for obj in objects:
+        total += sys.getsizeof(obj)
+        stack = [obj.__dict__] if hasattr(obj, "__dict__") else []
+        for cls in type(obj).__mro__:
+            stack.extend([getattr(obj, name) for name in getattr(cls, "__slots__", ()) if hasattr(obj, name)])
+        while len(stack) > 0:
+            item = stack.pop()
+            if not isinstance(item, _OWNED) or id(item) in seen:
+                continue
+            seen.add(id(item))
+            total += sys.getsizeof(item)
+            if isinstance(item, (dict, MappingProxyType)):
+                stack.extend(item.keys())
+                stack.extend(item.values())
+            elif not isinstance(item, str):
+                stack.extend(item)
+    return total
+
+def _objectRecord(go):
+    """Per-object and total bytes of the terms and genes of go, and of its AnnoIndex arrays."""
+    seen = set()
+    record = {}
+    for kind, objects in (("term", list(go.terms.values())), ("gene", list(go.genes.values()))):
+        total = _objectBytes(objects, seen)
+        record[kind + "s"] = len(objects)
+        record[kind + "_objects_mb"] = total / 2**20
+        record["bytes_per_" + kind] = total / max(1, len(objects))
+    if go.index is not None:
+        arrays = [go.index.bits] + list(go.index.codeBits.values()) + list(go.index.codeRows.values())
+        record["index_arrays_mb"] = sum([a.nbytes for a in arrays]) / 2**20
+    return record
+
+def benchMemory(oboFileName="go.obo", annoFileName="gene_association.sgd"):
+    """Resident memory before and after loading one organism, and the bytes held per term and gene."""
+    gc.collect()
+    before = _currentRSS()
+    start = time.perf_counter()
+    go = Ontology(oboFileName, annoFileName)
+    loadTime = time.perf_counter() - start
+    gc.collect()
+    record = {"benchmark": "memory", "obo_file": oboFileName, "anno_file": annoFileName,
+              "load_seconds": loadTime, "rss_before_mb": before, "rss_loaded_mb": _currentRSS(),
+              "peak_rss_mb": _peakRSS()}
+    record["rss_delta_mb"] = record["rss_loaded_mb"] - before
+    record.update(_objectRecord(go))
+    return [record]
+
+def benchDiff(oboFileName="go.obo", annoFileName="gene_association.sgd", nLines=1000, seed=0):
+    """Applying an nLines GAF diff in place vs reloading the patched file, and whether they agree."""
+    nLines = int(nLines)
+    rng = random.Random(int(seed))
+    fin = openText(annoFileName)
+    records = [line for line in fin if line[0] != "!" and line.count("\t") >= 14]
+    fin.close()
+    removed = set(rng.sample(range(len(records)), min(len(records), nLines // 2)))
+    #Added lines: existing genes with terms and codes taken from other lines
+    added = []
+    for i in range(nLines - len(removed)):
+        parts = rng.choice(records).split("\t")
+        other = rng.choice(records).split("\t")
+        parts[4], parts[6] = other[4], other[6]
+        added.append("\t".join(parts))
+    diff = ["-" + records[i] for i in sorted(removed)] + ["+" + line for line in added]
+    patched = tempfile.NamedTemporaryFile("w", suffix=".gaf", delete=False)
+    patched.writelines([line for i, line in enumerate(records) if i not in removed] + added)
+    patched.close()
+    try:
+        go = Ontology(oboFileName, annoFileName)
+        summary = go.applyAnnoDiff("benchmark", diff)
+        reverse = ["+" + line[1:] if line[0] == "-" else "-" + line[1:] for line in diff]
+        go.applyAnnoDiff("benchmark-reverse", reverse)
+        again = go.applyAnnoDiff("benchmark-again", diff)
+        start = time.perf_counter()
+        reloaded = go.copyDag()
+        reloaded.loadAnnoFile(patched.name)
+        reloadTime = time.perf_counter() - start
+    finally:
+        os.unlink(patched.name)
+    same = all([(t.nTotal, dict(t.totalCounts)) == (reloaded.terms[uid].nTotal, dict(reloaded.terms[uid].totalCounts))
+                for uid, t in go.terms.items()]) and go.popSizes == reloaded.popSizes
+    return [{"benchmark": "diff", "obo_file": oboFileName, "anno_file": annoFileName, "diff_lines": len(diff),
+             "terms_recounted": again["terms_recounted"], "first_diff_seconds": summary["seconds"],
+             "diff_seconds": again["seconds"], "reload_seconds": reloadTime, "identical": same}]
+
+def benchRanked(oboFileName="go.obo", annoFileName="gene_association.sgd", sample=200, seed=0):
+    """Ranked-list enrichment of every annotated gene: vectorized tests vs a per-term scipy loop.
+
+    The loop is timed on a sample of the tested terms and scaled up to all
+    of them; the statistics of the sampled terms are compared as well.
+    """
+    from scipy import stats
+    go = Ontology(oboFileName, annoFileName)
+    rng = random.Random(int(seed))
+    scores = {g: rng.gauss(0, 1) for g in go.genes.values()}
+    records = []
+    for method in ["mann_whitney", "ks"]:
+        start = time.perf_counter()
+        results = go.rankedEnrich(scores, method=method)
+        vectorized = time.perf_counter() - start
+        chosen = rng.sample(results, min(len(results), int(sample)))
+        start = time.perf_counter()
+        worst = 0.0
+        for e in chosen:
+            population = go.population(e.term.namespace)
+            annotated = e.term.allAnnos()
+            x = [scores[g] for g in population if g in annotated]
+            y = [scores[g] for g in population if g not in annotated]
+            if method == "mann_whitney":
+                statistic = stats.mannwhitneyu(x, y, method="asymptotic").statistic / (len(x) * len(y))
+                worst = max(worst, abs(statistic - e.statistic))
+            else:
+                #ks_2samp reports the unsigned distance
+                worst = max(worst, abs(stats.ks_2samp(x, y, method="asymp").statistic - abs(e.statistic)))
+        looped = (time.perf_counter() - start) * len(results) / max(1, len(chosen))
+        records.append({"benchmark": "ranked", "obo_file": oboFileName, "anno_file": annoFileName, "method": method,
+                        "genes": len(scores), "terms_tested": len(results), "vectorized_seconds": vectorized,
+                        "loop_seconds_estimate": looped, "max_statistic_difference": worst})
+    return records
+
+def _revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def benchSuite(sizes="small,medium", fixtureDir=".benchmark-fixtures"):
+    """The standard suite: benchFixture on each synthetic size and real fixture, one process each."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    fixtures = []
+    for size in sizes.split(","):
+        obo, gaf = Synthetic.generate(os.path.join(here, fixtureDir), **SUITE_FIXTURES[size])
+        fixtures.append((size, obo, gaf))
+    for name, obo, gaf in REAL_FIXTURES:
+        if os.path.exists(os.path.join(here, obo)) and os.path.exists(os.path.join(here, gaf)):
+            fixtures.append((name, os.path.join(here, obo), os.path.join(here, gaf)))
+    records = [{"benchmark": "suite", "measure": "environment", "revision": _revision(),
+                "python": sys.version.split()[0], "numpy": np.__version__, "cpus": os.cpu_count()}]
+    for name, obo, gaf in fixtures:
+        run = subprocess.run([sys.executable, os.path.abspath(__file__), "fixture", name, obo, gaf],
+                             capture_output=True, text=True, cwd=here)
+        lines = [line for line in run.stdout.splitlines() if line.startswith("{")]
+        if run.returncode != 0:
+            lines.append(json.dumps({"benchmark": "suite", "fixture": name, "failed": run.stderr[-2000:]}))
+        records.extend([json.loads(line) for line in lines])
+    return records
+
+def benchFixture(name, oboFileName, annoFileName, querySizes="10,50,200,1000", seed=0):
+    """Load, name resolution, enrichment by query size, /tm and /allTerms encoding, and peak RSS for one fixture."""
+    from GOServer import GOServer
+    base = {"benchmark": "suite", "fixture": name}
+    records = []
+    with METRICS.timing() as stages:
+        start = time.perf_counter()
+        registry = OrganismRegistry(oboFileName, {name: annoFileName})
+        go = registry.get(name)
+        loadTime = time.perf_counter() - start
+    record = dict(base, measure="load", terms=len(go.terms), genes=len(go.genes), load_seconds=loadTime,
+                  peak_rss_mb=_peakRSS())
+    record.update({stage + "_seconds": seconds for stage, seconds in stages.items()})
+    records.append(record)
+
+    #The real handlers, over this fixture only
+    server = GOServer.__new__(GOServer)
+    server.registry = registry
+    server.cache = ResultCache()
+    server.pool = WorkerPool(server, 0)
+    server.deadline = None
+    server.retry_after = 5
+
+    rng = np.random.default_rng(seed)
+    genes = sorted(go.genes.values(), key=lambda g: g.symbol)
+    queries = []
+    for i in rng.choice(len(genes), size=min(1000, len(genes)), replace=False):
+        gene = genes[i]
+        aliases = sorted(gene.aliases)
+        queries.append([gene.symbol, gene.symbol.lower(), gene.uid,
+                        aliases[0] if len(aliases) > 0 else gene.symbol, "UNKNOWN%d" % i][i % 5])
+    resolveTime = _timeit(lambda: server._resolve_gene_names(go, queries))
+    records.append(dict(base, measure="resolve", queries=len(queries), resolve_seconds=resolveTime,
+                        queries_per_second=len(queries) / resolveTime))
+
+    for querySize in [int(n) for n in querySizes.split(",") if int(n) <= len(genes)]:
+        query = [genes[i].symbol for i in rng.choice(len(genes), size=querySize, replace=False)]
+        with METRICS.timing() as stages:
+            results = go.enrichByGeneNames(query)
+        record = dict(base, measure="enrich", query_size=querySize, candidate_terms=len(results),
+                      enrich_seconds=_timeit(lambda: go.enrichByGeneNames(query)))
+        record.update({stage + "_seconds": seconds for stage, seconds in stages.items()})
+        records.append(record)
+
+    for format in ("nested", "flat"):
+        def treeMaps():
+            go.treeMaps = {}
+            server.cache.invalidate()
+            return sum([len(server.tm(name, root.uid, 6, format)) for root in go.roots])
+        records.append(dict(base, measure="tm", format=format, depth=6, bytes=treeMaps(),
+                            tm_seconds=_timeit(treeMaps)))
+
+    for format, call in (("list", lambda: server.allTerms(name)),
+                         ("stream", lambda: b"".join(server.allTerms(name, stream="1"))),
+                         ("page", lambda: server.allTerms(name, limit="1000"))):
+        records.append(dict(base, measure="allTerms", format=format, bytes=len(call()),
+                            allterms_seconds=_timeit(call, repeat=1)))
+
+    records.append(dict(base, measure="memory", peak_rss_mb=_peakRSS(), rss_mb=_currentRSS(), **_objectRecord(go)))
+    return records
+
+def _percentiles(values):
+    values = np.sort(np.array(values, dtype=float))
+    if len(values) == 0:
+        return {}
+    return {"p50_ms": 1000 * float(np.percentile(values, 50)), "p90_ms": 1000 * float(np.percentile(values, 90)),
+            "p99_ms": 1000 * float(np.percentile(values, 99)), "max_ms": 1000 * float(values[-1])}
+
+def benchLatency(oboFileName="go.obo", annoFileName="gene_association.sgd", workers="0,2", seconds=20):
+    """Lookup latency percentiles under concurrent enrichment load, per worker pool size.
+
+    Each setting runs a live server in its own process (see latencyRun).
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    records = []
+    for processes in workers.split(","):
+        run = subprocess.run([sys.executable, os.path.abspath(__file__), "latency-run", os.path.abspath(oboFileName),
+                              os.path.abspath(annoFileName), processes, str(seconds)],
+                             capture_output=True, text=True, cwd=here)
+        lines = [line for line in run.stdout.splitlines() if line.startswith("{")]
+        if run.returncode != 0:
+            lines.append(json.dumps({"benchmark": "latency", "processes": int(processes), "failed": run.stderr[-2000:]}))
+        records.extend([json.loads(line) for line in lines])
+    return records
+
+def latencyRun(oboFileName, annoFileName, processes, seconds=20, enrichThreads=4, lookupThreads=4,
+               querySize=1000, seed=0):
+    """Serve one fixture with go.workers=processes and measure it under load.
+
+    enrichThreads clients keep POSTing random querySize-gene /enrich
+    requests (distinct, so the result cache never answers) while
+    lookupThreads clients call /gene and /term; reports lookup latency
+    percentiles and the enrichment throughput and 503 rejections.
+    """
+    import cherrypy as cp
+    from GOServer import GOServer
+    probe = socket.socket()
+    probe.bind(("127.0.0.1", 0))
+    port = probe.getsockname()[1]
+    probe.close()
+    cp.config.update({"server.socket_port": port, "server.thread_pool": enrichThreads + lookupThreads + 2,
+                      "log.screen": False, "log.error_file": "", "go.obo_file": oboFileName, "go.cache_dir": None,
+                      "go.default_org": "bench", "go.memory_budget_mb": None, "go.workers": int(processes)})
+    server = GOServer({"bench": annoFileName})
+    cp.tree.mount(server, "/", {"/": {}})
+    cp.engine.start()
+    go = server.registry.get("bench")
+    base = "http://127.0.0.1:%d" % port
+    symbols = sorted(go.genes)
+    uids = [t.uid for t in go.terms.values() if 0 < t.nTotal <= 50]
+    stop = time.perf_counter() + float(seconds)
+    lookups = {"gene": [], "term": []}
+    enrichments = {"ok": 0, "rejected": 0, "seconds": []}
+
+    def enrichClient(worker):
+        rng = np.random.default_rng([seed, worker])
+        while time.perf_counter() < stop:
+            query = [symbols[i] for i in rng.choice(len(symbols), size=min(querySize, len(symbols)), replace=False)]
+            request = urllib.request.Request(base + "/enrich", data=json.dumps({"genes": query}).encode(),
+                                             headers={"Content-Type": "application/json"})
+            start = time.perf_counter()
+            try:
+                urllib.request.urlopen(request).read()
+                enrichments["ok"] += 1
+                enrichments["seconds"].append(time.perf_counter() - start)
+            except urllib.error.HTTPError as e:
+                if e.code != 503:
+                    raise
+                enrichments["rejected"] += 1
+                time.sleep(0.05)
+
+    def lookupClient(worker):
+        rng = np.random.default_rng([seed, 1000 + worker])
+        while time.perf_counter() < stop:
+            if rng.random() < 0.5:
+                kind, url = "gene", "/gene?uid=" + symbols[rng.integers(len(symbols))]
+            else:
+                kind, url = "term", "/term?uid=" + uids[rng.integers(len(uids))]
+            start = time.perf_counter()
+            urllib.request.urlopen(base + url).read()
+            lookups[kind].append(time.perf_counter() - start)
+            time.sleep(0.01)
+
+    #Fork the pool and warm the caches outside the measurement
+    urllib.request.urlopen(urllib.request.Request(base + "/enrich", data=json.dumps({"genes": symbols[:10]}).encode(),
+                                                  headers={"Content-Type": "application/json"})).read()
+    threads = [threading.Thread(target=enrichClient, args=(i,)) for i in range(enrichThreads)]
+    threads += [threading.Thread(target=lookupClient, args=(i,)) for i in range(lookupThreads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    cp.engine.exit()
+    record = {"benchmark": "latency", "processes": int(processes), "seconds": float(seconds),
+              "enrich_threads": enrichThreads, "query_size": querySize,
+              "enrichments": enrichments["ok"], "rejected": enrichments["rejected"],
+              "lookups": len(lookups["gene"]) + len(lookups["term"])}
+    record.update({"lookup_" + k: v for k, v in _percentiles(lookups["gene"] + lookups["term"]).items()})
+    record.update({"enrich_" + k: v for k, v in _percentiles(enrichments["seconds"]).items()})
+    return [record]
+
+def _loadRecords(fileName):
+    with open(fileName) as fin:
+        return [json.loads(line) for line in fin if line.startswith("{")]
+
+def compareRuns(oldFileName, newFileName, tolerance=1.2):
+    """Compare two result files; measurements more than tolerance times worse are regressions.
+
+    Times (*_seconds) and sizes (*_mb) should not grow and rates
+    (*_per_second) should not shrink. Exits with status 1 on a regression.
+    """
+    tolerance = float(tolerance)
+
+    def key(record):
+        return tuple([(k, record[k]) for k in RECORD_KEYS if k in record])
+
+    old = {key(r): r for r in _loadRecords(oldFileName)}
+    records = []
+    for new in _loadRecords(newFileName):
+        if key(new) not in old:
+            continue
+        for field, value in new.items():
+            before = old[key(new)].get(field)
+            if not isinstance(value, (int, float)) or isinstance(value, bool) or not before:
+                continue
+            if field.endswith("_per_second"):
+                ratio = before / value if value > 0 else float("inf")
+            elif field.endswith("_seconds") or field.endswith("_mb"):
+                ratio = value / before
+            else:
+                continue
+            records.append(dict(key(new), field=field, old=before, new=value, ratio=ratio,
+                                regression=ratio > tolerance))
+    if any([r["regression"] for r in records]):
+        for record in records:
+            print(json.dumps(record))
+        sys.exit(1)
+    return records
+
+BENCHMARKS = {
+    "hypergeom": benchHypergeom,
+    "load": benchLoad,
+    "parse": benchParse,
+    "batch": benchBatch,
+    "encode": benchEncode,
+    "suite": benchSuite,
+    "fixture": benchFixture,
+    "compare": compareRuns,
+    "latency": benchLatency,
+    "latency-run": latencyRun,
+    "memory": benchMemory,
+    "diff": benchDiff,
+    "ranked": benchRanked,
+}
+
+if __name__ == '__main__':
+    #Either `benchmark.py name [args...]` or no arguments to run the per-feature benchmarks
+    if len(sys.argv) > 1:
+        runs = [(sys.argv[1], sys.argv[2:])]
+    else:
+        runs = [(name, []) for name in ["hypergeom", "load", "parse", "batch", "encode", "diff", "ranked"]]
+    for name, args in runs:
+        try:
+            records = BENCHMARKS[name](*args)
+        except FileNotFoundError as e:
+            records = [{"benchmark": name, "skipped": str(e)}]
+        for record in records:
+            print(json.dumps(record))